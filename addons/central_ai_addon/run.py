@@ -2,6 +2,7 @@
 print("--- ADDON SCRIPT STARTED ---")
 import os
 import json
+import uuid
 import requests
 import traceback
 from paho.mqtt import client as mqtt_client
@@ -70,12 +71,16 @@ def on_message(client, userdata, msg):
         payload = json.loads(msg.payload.decode())
         prompt_text = payload.get("text")
         model_override = payload.get("model")
+        # Optional: lets each caller (satellite, dashboard, ...) keep its own conversation.
+        session_id = payload.get("session_id")
 
-        # Forward the prompt to the AI Engine
-        print(f"Forwarding prompt to AI Engine at {AI_ENGINE_URL}...")
+        # Forward the prompt to the AI Engine; the engine logs under the same request id.
+        request_id = uuid.uuid4().hex[:12]
+        print(f"Forwarding prompt to AI Engine at {AI_ENGINE_URL} (request {request_id})...")
         response = requests.post(
             AI_ENGINE_URL,
-            json={"prompt": prompt_text, "model": model_override},
+            json={"prompt": prompt_text, "model": model_override, "session_id": session_id},
+            headers={"X-Request-ID": request_id},
             timeout=120,  # Increased timeout for potentially long AI responses
         )
         response.raise_for_status()
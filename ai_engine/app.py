@@ -1,26 +1,100 @@
 # ai_engine/app.py
 import os
+import logging
 import json
 import time
-import traceback
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from dotenv import load_dotenv
 
 import chromadb
 
 from lib.ha_helpers import *
+from lib.ha_state_mirror import HAStateMirror
 from lib.prompts import *
 from lib.chroma_helpers import *
+from lib.context_selection import select_prompt_context, estimate_tokens
+from lib.http_client import get_pool_stats
+from lib.logging_setup import configure_logging, set_request_id, get_request_id
+from lib.metrics import stage, track_request, record_cache, record_llm_plan, render_metrics, PROMPT_TOKENS
+from lib.command_executor import run_concurrently, submit
+from lib.service_batching import plan_service_calls, execute_batch, is_service_call_error, StreamingBatcher
+from lib.plan_cache import PlanCache
+from lib.command_parsing import IncrementalCommandParser, tool_output_format
+from lib.intent_router import IntentRouter, INTENT_ROUTER, prompt_paths
+from lib.entity_index import get_entity_index
+from lib.group_index import get_group_index
+from lib.shared_state import get_state_store
+from lib.conversation_memory import ConversationMemory, is_follow_up
+from lib.embeddings import MEMORY_EMBED_MODEL, get_embedding_service
 from lib.ollama_helpers import *
 from lib.tool_helpers import *
 from lib.utils import *
 
-print("-- IMPORTS COMPLETE --")
+configure_logging()
+logger = logging.getLogger(__name__)
+
+logger.debug("-- IMPORTS COMPLETE --")
+
+# Shared state keys
+AREA_CACHE_KEY = "area_data"
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 
+@app.before_request
+def assign_request_id():
+    # Honour an id from the caller (e.g. the add-on) so its logs and ours line up.
+    set_request_id(request.headers.get("X-Request-ID"))
+
+@app.after_request
+def add_request_id_header(response):
+    response.headers["X-Request-ID"] = get_request_id()
+    return response
+
+class PromptTurn:
+    """
+    One prompt on its way through the pipeline. Both serving modes (this app and
+    asgi.py) run the same `AIEngine` steps over it, which fill it in as they go.
+    """
+
+    def __init__(self, prompt_text, session_id, model, history, use_cache):
+        self.prompt_text = prompt_text
+        self.session_id = session_id
+        self.model = model
+        self.history = history
+        self.use_cache = use_cache
+        self.all_states = None
+        self.all_entities = None
+        self.entity_version = None
+        self.entity_index = None
+        self.group_index = None
+        self.commands = None
+        # How the plan was made ("router", "plan_cache", "llm" or "direct_answer").
+        self.path = None
+        # StreamingBatcher of the device commands started while the LLM wrote the plan.
+        self.streamed = None
+
+def feed_plan(parser, token, on_command=None, on_plan_done=None):
+    """Feeds one streamed token of the tool-selection reply to `parser`, calling back as in `_generate_plan`."""
+    if parser.done:
+        # Read on to the final chunk, which carries the token counts. With the
+        # default constrained output the reply ends with the plan anyway.
+        return
+    first = len(parser.commands)
+    for offset, command in enumerate(parser.feed(token)):
+        if on_command is not None:
+            on_command(first + offset, command)
+    if parser.done and on_plan_done is not None:
+        on_plan_done()
+
+def close_plan(parser):
+    """Logs and records the finished tool-selection reply; returns its commands."""
+    log_response(parser.text)
+    with stage("command_extraction"):
+        record_llm_plan(parser)
+        return parser.close()
+
 class AIEngine:
     def __init__(self):
         load_dotenv()
@@ -31,180 +105,630 @@ class AIEngine:
         self.ha_api_token = os.environ.get("HA_API_TOKEN")
         self.ha_api_url = os.environ.get("HA_API_URL", "http://homeassistant.local:8123/api")
         self.domain_mappings = json.loads(os.environ.get("DOMAIN_MAPPINGS", "[]"))
-        print("-- CONFIG LOADED --")
-
-        self.conversation_history = []
-        self.max_history = 10
-        self.area_cache = {}
+        self.prune_prompt_context = os.environ.get("PROMPT_CONTEXT_PRUNING", "true").lower() == "true"
+        # Send the fixed part of the tool-selection prompt as Ollama's system prompt;
+        # false sends it inline, for model templates that ignore the system prompt.
+        self.split_tool_prompt = os.environ.get("SPLIT_TOOL_PROMPT", "true").lower() == "true"
+        logger.debug("-- CONFIG LOADED --")
+
+        # Conversation history and caches live in the shared state store, so all
+        # workers on the host see the same conversation and fill caches once.
+        self.state_store = get_state_store()
+        self.conversations = ConversationMemory(self.state_store)
         self.area_cache_expiration = 300  # 5 minutes
-        self.last_cache_update = 0
-        self.last_entity_context = {}
+
+        self.plan_cache = None
+        if os.environ.get("PLAN_CACHE", "true").lower() == "true":
+            # Optional embedding model for matching paraphrases of cached prompts.
+            embed_model = os.environ.get("PLAN_CACHE_EMBED_MODEL", "")
+            embed_fn = get_embedding_service(embed_model).embed_one if embed_model else None
+            self.plan_cache = PlanCache(embed_fn=embed_fn)
+
+        # Simple device commands are resolved locally instead of by the LLM.
+        self.intent_router = IntentRouter() if INTENT_ROUTER else None
+
+        self.state_mirror = None
+        if os.environ.get("HA_STATE_MIRROR", "true").lower() == "true":
+            self.state_mirror = HAStateMirror()
+            self.state_mirror.start()
+            logger.info("-- HA STATE MIRROR STARTED --")
 
         self.chroma_client = None
         self.memory_collection = None
+        # Memories are embedded here through Ollama (cached, batched) rather than by ChromaDB.
+        self.memory_embedder = get_embedding_service(MEMORY_EMBED_MODEL) if MEMORY_EMBED_MODEL else None
         if self.chromadb_url:
             try:
-                print(f"Connecting to ChromaDB at {self.chromadb_url}...")
+                logger.debug(f"Connecting to ChromaDB at {self.chromadb_url}...")
                 host, port = self.chromadb_url.replace('http://', '').split(':')
                 self.chroma_client = chromadb.HttpClient(host=host, port=port)
                 self.memory_collection = self.chroma_client.get_or_create_collection(
-                    name="long_term_memory",
+                    name=memory_collection_name(MEMORY_EMBED_MODEL),
                     metadata={"hnsw:space": "cosine"}
                 )
-                print("Successfully connected to ChromaDB and got/created collection.")
+                if self.memory_embedder:
+                    migrate_memories(self.chroma_client, self.memory_collection, self.memory_embedder)
+                logger.debug("Successfully connected to ChromaDB and got/created collection.")
             except Exception as e:
-                print(f"-- FAILED TO CONNECT TO CHROMADB: {e} --")
-                print("-- Long-term memory will be disabled. --")
+                logger.error(f"-- FAILED TO CONNECT TO CHROMADB: {e} --")
+                logger.info("-- Long-term memory will be disabled. --")
         else:
-            print("-- No chromadb_url configured. Long-term memory will be disabled. --")
-
-        print("-- AI ENGINE INITIALIZED --")
-
-    def process_prompt(self, prompt_text, model_override=None):
+            logger.info("-- No chromadb_url configured. Long-term memory will be disabled. --")
+
+        logger.info("-- AI ENGINE INITIALIZED --")
+
+    def get_area_data(self):
+        """
+        Area -> entities mapping. Read from the mirrored HA registries when they are
+        loaded; otherwise rendered by the area template, at most once per expiry
+        across all workers.
+        """
+        if self.state_mirror and self.state_mirror.is_ready() and self.state_mirror.areas_ready():
+            record_cache("area", "mirror")
+            return self.state_mirror.get_area_data()
+        fetched = []
+        def fetch():
+            fetched.append(True)
+            return get_ha_area_data()
+        area_data = self.state_store.get_or_fill(AREA_CACHE_KEY, fetch, ttl=self.area_cache_expiration)
+        record_cache("area", "miss" if fetched else "hit")
+        return area_data or {}
+
+    def get_states_and_entities(self):
+        """Returns (all_states, entity_id -> friendly_name), from the live mirror when it is ready."""
+        if self.state_mirror and self.state_mirror.is_ready():
+            return self.state_mirror.get_states(), self.state_mirror.get_entities()
+        all_states = get_ha_states()
+        all_entities = {s["entity_id"]: s["attributes"].get("friendly_name", s["entity_id"]) for s in all_states}
+        return all_states, all_entities
+
+    def entity_set_version(self, all_entities):
+        """Identifies the current entity set, so cached plans are dropped when it changes."""
+        if self.state_mirror and self.state_mirror.is_ready():
+            return self.state_mirror.version
+        return hash(frozenset(all_entities.items()))
+
+    def get_group_index(self, all_states):
+        """Returns the flattened group index, rebuilt only when group membership changes."""
+        if self.state_mirror and self.state_mirror.is_ready():
+            return get_group_index(all_states, ("mirror", self.state_mirror.groups_version))
+        return get_group_index(all_states)
+
+    def process_prompt(self, prompt_text, model_override=None, use_cache=True, session_id=None):
         """Handles the core logic of processing a prompt and returning a response."""
+        return "".join(self.process_prompt_stream(
+            prompt_text, model_override, stream=False, use_cache=use_cache, session_id=session_id
+        ))
+
+    def process_prompt_stream(self, prompt_text, model_override=None, stream=True, use_cache=True, session_id=None):
+        """
+        Generator form of process_prompt that yields the response in chunks.
+        With stream=True, answer-type replies (direct answers and a single web search
+        or calculation) are yielded token by token as Ollama generates them. Device
+        commands are always buffered: the tool-selection JSON is parsed in full, the
+        commands are executed and the summary is yielded as one chunk.
+        Simple device commands are planned by the intent router when it is confident,
+        without an LLM call. With use_cache=False, the plan cache is neither read
+        nor written. Turns are recorded under `session_id` (a shared default session if None) and
+        a budgeted rendering of the earlier turns is included in the prompts.
+        """
+        started = time.perf_counter()
+        turn = None
         try:
             if not prompt_text or not prompt_text.strip():
-                return "Error: Prompt cannot be empty."
+                yield "Error: Prompt cannot be empty."
+                return
 
-            self.conversation_history.append({"role": "user", "content": prompt_text})
-            if len(self.conversation_history) > self.max_history:
-                self.conversation_history = self.conversation_history[-self.max_history:]
+            turn = self._open_turn(prompt_text, model_override, session_id, use_cache)
 
-            model_to_use = model_override or self.custom_model or self.default_model
+            # Memory retrieval overlaps the state fetch; the plan waits for it only
+            # up to the retrieval deadline.
+            memory_lookup = self._start_memory_retrieval(prompt_text)
 
-            retrieved_memories = retrieve_memories(self.memory_collection, prompt_text)
-            all_states = get_ha_states()
+            with stage("ha_states"):
+                all_states, all_entities = self.get_states_and_entities()
             if not all_states:
-                return "Error: Could not get device list."
-            all_entities = {s["entity_id"]: s["attributes"].get("friendly_name", s["entity_id"]) for s in all_states}
-            
-            current_time = time.time()
-            if not self.area_cache or (current_time - self.last_cache_update > self.area_cache_expiration):
-                self.area_cache = get_ha_area_data()
-                self.last_cache_update = current_time
-            
-            entities_str = json.dumps(all_entities, indent=2)
-            areas_str = json.dumps(self.area_cache, indent=2)
+                memory_lookup[0].cancel()
+                yield "Error: Could not get device list."
+                return
+
+            self._plan_locally(turn, all_states, all_entities)
+            self._use_cached_plan(turn)
+            if not self._planned_without_llm(turn, memory_lookup):
+                on_command = self._start_streamed_plan(turn, self._start_batch)
+                commands = self._generate_plan(
+                    prompt_text, turn.model, all_entities, turn.entity_index, turn.history, memory_lookup,
+                    on_command=on_command, on_plan_done=turn.streamed.flush
+                )
+                self._finish_streamed_plan(turn, commands)
+                self._cache_plan(turn)
+
+            if not turn.commands:
+                direct_prompt = self._direct_answer_prompt(turn)
+                if stream:
+                    answer = []
+                    with stage("llm_answer"):
+                        for token in call_ollama(direct_prompt, turn.model, stream=True):
+                            answer.append(token)
+                            yield token
+                    self.conversations.record(session_id, "assistant", "".join(answer))
+                else:
+                    with stage("llm_answer"):
+                        answer = call_ollama(direct_prompt, turn.model)
+                    self.conversations.record(session_id, "assistant", answer)
+                    yield answer
+                return
+
+            if stream and len(turn.commands) == 1:
+                answer_stream = self._stream_answer_command(turn.commands[0], prompt_text, turn.model)
+                if answer_stream is not None:
+                    answer = []
+                    for token in answer_stream:
+                        answer.append(token)
+                        yield token
+                    self.conversations.record(session_id, "assistant", "".join(answer))
+                    return
+
+            results, tasks, jobs = self._prepare_jobs(turn)
+
+            # Batches and the remaining commands are independent, so run them
+            # concurrently; results are slotted back in plan order, which keeps the
+            # summary message deterministic.
+            def run_job(job):
+                kind, item = job
+                if kind == "started":
+                    return item["call"].result()
+                if kind == "batch":
+                    return execute_batch(item)
+                return self._execute_command(turn.commands[item], prompt_text, turn.model)
+            with stage("ha_service_calls"):
+                outcomes = run_concurrently(run_job, jobs)
+
+            yield self._summarize_results(turn, results, tasks, jobs, outcomes)
 
-            tool_prompt = PROMPT_TEMPLATE.format(
-                prompt=prompt_text, 
-                entities=entities_str, 
-                areas=areas_str,
-                memories=retrieved_memories
+        except Exception as e:
+            logger.exception(f"Uncaught exception in process_prompt: {type(e).__name__}: {e}")
+            yield f"An unexpected error occurred: {e}"
+        finally:
+            if turn is not None and turn.path:
+                prompt_paths.record(turn.path, time.perf_counter() - started)
+
+    # --- Pipeline steps, shared with asgi.py, which runs the same steps around async I/O ---
+
+    def _open_turn(self, prompt_text, model_override=None, session_id=None, use_cache=True):
+        """Records the prompt and returns its PromptTurn, holding the conversation before it."""
+        self.conversations.record(session_id, "user", prompt_text)
+        history = self.conversations.history_context(session_id, skip_last=1)
+        model = model_override or self.custom_model or self.default_model
+        return PromptTurn(prompt_text, session_id, model, history, use_cache and self.plan_cache is not None)
+
+    def _plan_locally(self, turn, all_states, all_entities):
+        """
+        The CPU-bound planning steps: indexes the entity and group sets (rebuilt only
+        when they change), then lets the intent router plan simple device commands.
+        """
+        turn.all_states, turn.all_entities = all_states, all_entities
+        # A follow-up ("turn it off") means something different in every conversation.
+        follow_up = bool(turn.history) and is_follow_up(turn.prompt_text)
+        turn.use_cache = turn.use_cache and not follow_up
+        turn.entity_version = self.entity_set_version(all_entities)
+        turn.entity_index = get_entity_index(all_entities, turn.entity_version)
+        turn.group_index = self.get_group_index(all_states)
+        if self.intent_router is not None and not follow_up:
+            with stage("intent_routing"):
+                turn.commands = self.intent_router.route(turn.prompt_text, turn.entity_index)
+            if turn.commands is not None:
+                turn.path = "router"
+
+    def _use_cached_plan(self, turn):
+        """Looks the prompt up in the plan cache if nothing planned it yet. Embeds the prompt if the cache does."""
+        if turn.commands is None and turn.use_cache:
+            turn.commands = self.plan_cache.get(turn.prompt_text, turn.model, turn.entity_version)
+            if turn.commands is not None:
+                turn.path = "plan_cache"
+
+    def _planned_without_llm(self, turn, memory_lookup):
+        """True if the router or plan cache planned the prompt; the memory lookup is then dropped."""
+        if turn.commands is None:
+            return False
+        logger.info(f"Planned by the {turn.path.replace('_', ' ')}; skipping memory retrieval and tool selection.")
+        memory_lookup[0].cancel()
+        memory_stats.record("skipped")
+        return True
+
+    def _start_streamed_plan(self, turn, start_batch):
+        """
+        Device commands start while the LLM is still writing the plan, each run of them
+        sharing a service and parameters as one call through `start_batch(batch)`.
+        Returns the `on_command` callback for `_generate_plan`.
+        """
+        turn.path = "llm"
+        turn.streamed = StreamingBatcher(start_batch)
+        def start_task(index, command_data):
+            if isinstance(command_data, dict) and command_data.get("action") == "execute_task":
+                turn.streamed.add(index, *self._resolve_task(
+                    command_data, turn.prompt_text, turn.all_states, turn.all_entities, turn.entity_index, turn.group_index
+                ))
+        return start_task
+
+    def _finish_streamed_plan(self, turn, commands):
+        # Starts the last run, if the plan never closed.
+        turn.streamed.flush()
+        turn.commands = commands
+
+    def _cache_plan(self, turn):
+        """Stores an LLM plan in the plan cache. Embeds the prompt if the cache does."""
+        if turn.commands and turn.use_cache:
+            self.plan_cache.put(turn.prompt_text, turn.model, turn.entity_version, turn.commands)
+
+    def _direct_answer_prompt(self, turn):
+        """The prompt for answering directly, when nothing produced a command."""
+        turn.path = "direct_answer"
+        logger.warning("LLM failed to generate a command. Attempting to answer directly.")
+        direct_prompt = direct_answer_prompt(turn.prompt_text, turn.history)
+        PROMPT_TOKENS.labels("direct_answer").observe(estimate_tokens(direct_prompt))
+        return direct_prompt
+
+    def _start_memory_retrieval(self, prompt_text):
+        """Starts looking up memories for the prompt in the background; returns (future, start time)."""
+        return submit(query_memories, self.memory_collection, prompt_text, 3, self.memory_embedder), time.perf_counter()
+
+    def _generate_plan(self, prompt_text, model_to_use, all_entities, entity_index=None, history="", memory_lookup=None,
+                       on_command=None, on_plan_done=None):
+        """
+        Asks the LLM to translate the prompt into a list of JSON commands (empty if it
+        could not). The reply is streamed and parsed as it arrives; `on_command(index,
+        command)` is called as soon as each command is complete, and `on_plan_done()`
+        once the plan is, before the rest of the stream is read.
+        """
+        with stage("area_data"):
+            area_data = self.get_area_data()
+        if memory_lookup is None:
+            memory_lookup = self._start_memory_retrieval(prompt_text)
+        with stage("memory_retrieval"):
+            retrieved_memories = wait_for_memories(*memory_lookup)
+
+        system, tool_prompt = self._tool_prompt(prompt_text, all_entities, area_data, retrieved_memories, entity_index, history)
+        parser = IncrementalCommandParser()
+        with stage("llm_call"):
+            tokens = call_ollama(
+                tool_prompt, model_to_use, stream=True, output_format=tool_output_format(), system=system
             )
-            ollama_response = call_ollama(tool_prompt, model_to_use)
-            print(f"-- OLLAMA RAW RESPONSE --\n{ollama_response}\n-- END OLLAMA RAW RESPONSE --")
-            generated_commands = extract_json_commands(ollama_response)
-
-            if not generated_commands:
-                print("LLM failed to generate a command. Attempting to answer directly.")
-                return call_ollama(f"You are a helpful assistant. Answer the following question: {prompt_text}", model_to_use)
-
-            successful_actions = []
-            failed_actions = []
-            acted_upon_entities = []
-
-            for command_data in generated_commands:
-                try:
-                    action = command_data.get("action")
-                    if not action:
-                        raise ValueError("Action not found in command.")
-
-                    if action == "web_search":
-                        query = command_data.get("query")
-                        if not query: raise ValueError("Web search action requires a query.")
-                        search_result = handle_web_search(query, model_to_use)
-                        successful_actions.append(search_result)
-                    
-                    elif action == "calculator":
-                        expression = command_data.get("expression")
-                        if not expression: raise ValueError("Calculator action requires an expression.")
-                        calc_result = perform_calculation(expression)
-                        
-                        answer_prompt = CALCULATOR_ANSWER_PROMPT_TEMPLATE.format(prompt=prompt_text, result=calc_result)
-                        final_answer = call_ollama(answer_prompt, model_to_use)
-                        successful_actions.append(final_answer.strip())
-
-                    elif action == "execute_task":
-                        entity_id = command_data.get("entity_id")
-                        service = command_data.get("service")
-                        if not service: raise ValueError("Service not found in command.")
-
-                        if entity_id:
-                            acted_upon_entities.append(entity_id)
-
-                        if entity_id not in all_entities:
-                            print(f"AI returned an invalid entity_id: '{entity_id}'. Attempting to self-correct.")
-                            corrected_entity_id, _ = find_best_matching_entity(prompt_text, all_entities, target_text=entity_id)
-                            if corrected_entity_id:
-                                print(f"Self-correction successful. Found matching entity: '{corrected_entity_id}'")
-                                entity_id = corrected_entity_id
-                            else:
-                                print(f"Self-correction failed for '{entity_id}'.")
-                                failed_actions.append(f"could not find a matching device for '{entity_id}'")
-                                continue
-                        
-                        expanded_entity_ids = expand_ha_groups(entity_id, all_states)
-                        call_homeassistant_api(service, expanded_entity_ids, command_data.get("parameters"))
-
-                        entity_friendly_name = all_entities.get(entity_id, entity_id)
-                        service_action_friendly = service.split('.')[-1].replace('_', ' ')
-                        successful_actions.append(f"executed {service_action_friendly} on the {entity_friendly_name}")
-
-                    else:
-                        raise ValueError(f"Unknown action '{action}' in command.")
-
-                except Exception as e:
-                    print(f"Error processing command: {e}")
-                    failed_actions.append(f"failed to execute a command due to: {e}")
-                    continue
-            
-            if acted_upon_entities:
-                self.last_entity_context = {"entity_id": acted_upon_entities, "timestamp": time.time()}
+            try:
+                for token in tokens:
+                    feed_plan(parser, token, on_command, on_plan_done)
+            finally:
+                tokens.close()
+        return close_plan(parser)
+
+    def _tool_prompt(self, prompt_text, all_entities, area_data, retrieved_memories, entity_index=None, history=""):
+        """`_build_tool_prompt`, timed and with its estimated size recorded."""
+        with stage("prompt_build"):
+            system, tool_prompt = self._build_tool_prompt(
+                prompt_text, all_entities, area_data, retrieved_memories, entity_index, history
+            )
+        PROMPT_TOKENS.labels("tool_selection").observe(estimate_tokens((system or "") + tool_prompt))
+        return system, tool_prompt
+
+    def _build_tool_prompt(self, prompt_text, all_entities, area_data, retrieved_memories, entity_index=None, history=""):
+        """
+        Fills the tool-selection prompt with the memories, devices, areas and
+        conversation for this request. Returns (system prompt, prompt); the system
+        prompt is the same for every request, or None when it is sent inline.
+        """
+        if self.prune_prompt_context:
+            entities_str, areas_str = select_prompt_context(prompt_text, all_entities, area_data, index=entity_index)
+        else:
+            entities_str = json.dumps(all_entities, indent=2)
+            areas_str = json.dumps(area_data, indent=2)
+
+        request_prompt = TOOL_REQUEST_TEMPLATE.format(
+            prompt=prompt_text, 
+            entities=entities_str, 
+            areas=areas_str,
+            memories=retrieved_memories,
+            history=history or "No earlier conversation."
+        )
+        if self.split_tool_prompt:
+            return TOOL_SYSTEM_PROMPT, request_prompt
+        return None, TOOL_SYSTEM_PROMPT + request_prompt
+
+    def _prepare_jobs(self, turn):
+        """
+        Resolves the turn's plan into independent jobs. Returns (results, tasks, jobs):
+        `results` has one slot per command (pre-filled for commands that failed to
+        resolve), `tasks` the resolved execute_task commands and `jobs` a list of
+        ("started", batch), ("batch", batch) and ("command", index) entries to run.
+        Commands handled while the plan streamed in (`turn.streamed`) have their
+        service calls under way already (as batch["call"]). Every other execute_task
+        is resolved here, so commands sharing a service and parameters can be
+        coalesced into a single Home Assistant call.
+        """
+        generated_commands, started = turn.commands, turn.streamed
+        results = [None] * len(generated_commands)
+        tasks = []
+        started_jobs = []
+        other_commands = []
+        if started is not None:
+            for index, failure in started.failures.items():
+                results[index] = failure
+            tasks.extend(started.tasks)
+            started_jobs = [("started", batch) for batch in started.batches]
+        first_new = len(tasks)
+        for index, command_data in enumerate(generated_commands):
+            if started is not None and index in started.indexes:
+                continue
+            if isinstance(command_data, dict) and command_data.get("action") == "execute_task":
+                failure, task = self._resolve_task(
+                    command_data, turn.prompt_text, turn.all_states, turn.all_entities, turn.entity_index, turn.group_index
+                )
+                if failure:
+                    results[index] = failure
+                else:
+                    task["index"] = index
+                    tasks.append(task)
+            else:
+                other_commands.append(index)
+        # Started tasks come first in `tasks`; batch positions count from after them.
+        batches = plan_service_calls(tasks[first_new:])
+        for batch in batches:
+            batch["tasks"] = [position + first_new for position in batch["tasks"]]
+        jobs = started_jobs + [("batch", batch) for batch in batches] + [("command", index) for index in other_commands]
+        return results, tasks, jobs
+
+    def _summarize_results(self, turn, results, tasks, jobs, outcomes):
+        """Slots job outcomes back into plan order and returns the reply, recording it in the history."""
+        generated_commands, all_entities, session_id = turn.commands, turn.all_entities, turn.session_id
+        for (kind, item), outcome in zip(jobs, outcomes):
+            if kind == "command":
+                results[item] = outcome
+                continue
+            service_action_friendly = item["service"].split('.')[-1].replace('_', ' ')
+            for position in item["tasks"]:
+                task = tasks[position]
+                entity_friendly_name = all_entities.get(task["entity_id"], task["entity_id"])
+                if is_service_call_error(outcome):
+                    results[task["index"]] = (None, f"failed to {service_action_friendly} the {entity_friendly_name}", task["acted_upon_entity"])
+                else:
+                    results[task["index"]] = (f"executed {service_action_friendly} on the {entity_friendly_name}", None, task["acted_upon_entity"])
+
+        successful_actions = [success for success, _, _ in results if success is not None]
+        failed_actions = [failure for _, failure, _ in results if failure is not None]
+        acted_upon_entities = [entity_id for _, _, entity_id in results if entity_id]
+        action = generated_commands[-1].get("action") if isinstance(generated_commands[-1], dict) else None
+
+        if acted_upon_entities:
+            self.conversations.set_last_entities(session_id, acted_upon_entities)
+
+        if len(successful_actions) == 1 and action in ["web_search", "calculator"]:
+             final_summary_message = successful_actions[0]
+        else:
+            final_summary_message = ""
+            if successful_actions:
+                final_summary_message = "Okay, I've " + ", and ".join(successful_actions) + "."
+            if failed_actions:
+                final_summary_message += " However, I " + ", and ".join(failed_actions) + "."
+
+        if not final_summary_message:
+            final_summary_message = "I wasn't able to complete that request."
+
+        self.conversations.record(session_id, "assistant", final_summary_message)
+        return final_summary_message
+
+    def _start_batch(self, batch):
+        """Starts a planned batch's service call on the command pool, its Future in batch["call"]."""
+        batch["call"] = submit(execute_batch, batch)
+
+    def _resolve_task(self, command_data, prompt_text, all_states, all_entities, entity_index=None, group_index=None):
+        """
+        Validates an execute_task command, self-correcting an unknown entity_id.
+        Returns (failure_result, None) if it cannot run, otherwise (None, task) where
+        task holds the service, parameters and group-expanded entity_ids.
+        """
+        acted_upon_entity = None
+        try:
+            entity_id = command_data.get("entity_id")
+            service = command_data.get("service")
+            if not service: raise ValueError("Service not found in command.")
+            if not isinstance(service, str) or '.' not in service:
+                raise ValueError(f"Invalid service format '{service}'. Expected 'domain.action'.")
+
+            if entity_id:
+                acted_upon_entity = entity_id
+
+            if entity_id not in all_entities:
+                logger.warning(f"AI returned an invalid entity_id: '{entity_id}'. Attempting to self-correct.")
+                corrected_entity_id, _ = find_best_matching_entity(prompt_text, all_entities, target_text=entity_id, index=entity_index)
+                if corrected_entity_id:
+                    logger.debug(f"Self-correction successful. Found matching entity: '{corrected_entity_id}'")
+                    entity_id = corrected_entity_id
+                else:
+                    logger.warning(f"Self-correction failed for '{entity_id}'.")
+                    return (None, f"could not find a matching device for '{entity_id}'", acted_upon_entity), None
+
+            task = {
+                "service": service,
+                "parameters": command_data.get("parameters"),
+                "entity_id": entity_id,
+                "entity_ids": expand_ha_groups(entity_id, all_states, index=group_index),
+                "acted_upon_entity": acted_upon_entity,
+            }
+            return None, task
+
+        except Exception as e:
+            logger.error(f"Error processing command: {e}")
+            return (None, f"failed to execute a command due to: {e}", acted_upon_entity), None
+
+    def _execute_command(self, command_data, prompt_text, model_to_use):
+        """
+        Executes one non-device command (web_search or calculator) from the LLM plan.
+        Returns (success_message, failure_message, acted_upon_entity_id); unused fields are None.
+        """
+        try:
+            action = command_data.get("action")
+            if not action:
+                raise ValueError("Action not found in command.")
+
+            if action == "web_search":
+                query = command_data.get("query")
+                if not query: raise ValueError("Web search action requires a query.")
+                search_result = handle_web_search(query, model_to_use)
+                return search_result, None, None
+
+            elif action == "calculator":
+                expression = command_data.get("expression")
+                if not expression: raise ValueError("Calculator action requires an expression.")
+                calc_result = perform_calculation(expression)
+
+                answer_prompt = CALCULATOR_ANSWER_PROMPT_TEMPLATE.format(prompt=prompt_text, result=calc_result)
+                final_answer = call_ollama(answer_prompt, model_to_use)
+                return final_answer.strip(), None, None
 
-            if len(successful_actions) == 1 and action in ["web_search", "calculator"]:
-                 final_summary_message = successful_actions[0]
             else:
-                final_summary_message = ""
-                if successful_actions:
-                    final_summary_message = "Okay, I've " + ", and ".join(successful_actions) + "."
-                if failed_actions:
-                    final_summary_message += " However, I " + ", and ".join(failed_actions) + "."
-            
-            if not final_summary_message:
-                final_summary_message = "I wasn't able to complete that request."
-
-            self.conversation_history.append({"role": "assistant", "content": final_summary_message})
-            return final_summary_message
+                raise ValueError(f"Unknown action '{action}' in command.")
 
         except Exception as e:
-            print(f"-- !!! UNCAUGHT EXCEPTION IN process_prompt !!! --")
-            print(f"ERROR TYPE: {type(e)}")
-            print(f"ERROR: {e}")
-            traceback.print_exc()
-            return f"An unexpected error occurred: {e}"
+            logger.error(f"Error processing command: {e}")
+            return None, f"failed to execute a command due to: {e}", None
+
+    def _stream_answer_command(self, command_data, prompt_text, model_to_use):
+        """
+        Returns a token generator for a single answer-type command (web_search or
+        calculator), or None if the command must go through the buffered path.
+        """
+        action = command_data.get("action")
+        if action == "web_search" and command_data.get("query"):
+            return handle_web_search(command_data["query"], model_to_use, stream=True)
+        if action == "calculator" and command_data.get("expression"):
+            calc_result = perform_calculation(command_data["expression"])
+            answer_prompt = CALCULATOR_ANSWER_PROMPT_TEMPLATE.format(prompt=prompt_text, result=calc_result)
+            return call_ollama(answer_prompt, model_to_use, stream=True)
+        return None
 
 # --- Create a single AIEngine instance ---
 ai_engine = AIEngine()
 
 @app.route('/api/prompt', methods=['POST'])
 def api_prompt():
-    """API endpoint to receive prompts."""
-    print("Received request on /api/prompt endpoint.")
+    """
+    API endpoint to receive prompts. Set "no_cache": true to bypass the plan cache,
+    and "session_id" to keep a separate conversation per caller.
+    """
+    logger.debug("Received request on /api/prompt endpoint.")
     if not request.is_json:
         return jsonify({"error": "Request must be JSON"}), 400
 
     data = request.get_json()
     prompt_text = data.get("prompt")
     model_override = data.get("model")
+    use_cache = not data.get("no_cache", False)
 
     if not prompt_text:
         return jsonify({"error": "Missing 'prompt' in request body"}), 400
 
-    response_message = ai_engine.process_prompt(prompt_text, model_override)
+    with track_request("prompt"):
+        response_message = ai_engine.process_prompt(
+            prompt_text, model_override, use_cache=use_cache, session_id=data.get("session_id")
+        )
     
     return jsonify({"response": response_message})
 
+@app.route('/api/prompt/stream', methods=['POST'])
+def api_prompt_stream():
+    """
+    Streaming variant of /api/prompt. Responds with newline-delimited JSON:
+    {"token": "..."} lines as the reply is generated, then a final
+    {"done": true, "response": "...", "ttft_ms": ..., "total_ms": ...} line.
+    """
+    logger.debug("Received request on /api/prompt/stream endpoint.")
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    data = request.get_json()
+    prompt_text = data.get("prompt")
+    model_override = data.get("model")
+    use_cache = not data.get("no_cache", False)
+    session_id = data.get("session_id")
+
+    if not prompt_text:
+        return jsonify({"error": "Missing 'prompt' in request body"}), 400
+
+    def generate():
+        start = time.perf_counter()
+        first_token_at = None
+        chunks = []
+        with track_request("prompt_stream"):
+            for token in ai_engine.process_prompt_stream(
+                prompt_text, model_override, use_cache=use_cache, session_id=session_id
+            ):
+                if not token:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunks.append(token)
+                yield json.dumps({"token": token}) + "\n"
+        end = time.perf_counter()
+        ttft_ms = round(((first_token_at or end) - start) * 1000, 1)
+        total_ms = round((end - start) * 1000, 1)
+        logger.info(f"Streamed response: time to first token {ttft_ms} ms, total {total_ms} ms.")
+        yield json.dumps({"done": True, "response": "".join(chunks), "ttft_ms": ttft_ms, "total_ms": total_ms}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# Per-worker counters, served as /api/stats/<name> by this app and by asgi.py.
+def http_stats():
+    """Connection pool counters (opened vs. reused) for this worker process."""
+    return {"pid": os.getpid(), "pools": get_pool_stats()}
+
+def plan_cache_stats():
+    """Plan cache size, hit/miss counters and hit rate for this worker process."""
+    if not ai_engine.plan_cache:
+        return {"pid": os.getpid(), "enabled": False}
+    return {"pid": os.getpid(), "enabled": True, **ai_engine.plan_cache.stats()}
+
+def session_stats():
+    """Number and estimated size of the conversation sessions held in the state store."""
+    return {"pid": os.getpid(), **ai_engine.conversations.stats()}
+
+def embedding_stats():
+    """Memory embedding cache size, hit/miss counters and batching for this worker process."""
+    if ai_engine.memory_embedder is None:
+        return {"pid": os.getpid(), "enabled": False}
+    return {"pid": os.getpid(), "enabled": True, **ai_engine.memory_embedder.stats()}
+
+def memory_retrieval_stats():
+    """How often long-term memories were used, had no match, timed out or were skipped in this worker process."""
+    return {"pid": os.getpid(), **memory_stats.stats()}
+
+def router_stats():
+    """Prompts planned by the intent router, plan cache or LLM, with latency per path, for this worker process."""
+    if ai_engine.intent_router is None:
+        return {"pid": os.getpid(), "enabled": False, **prompt_paths.stats()}
+    return {"pid": os.getpid(), "enabled": True, **ai_engine.intent_router.stats(), **prompt_paths.stats()}
+
+STATS_REPORTS = {
+    "http": http_stats,
+    "plan_cache": plan_cache_stats,
+    "sessions": session_stats,
+    "embeddings": embedding_stats,
+    "memory": memory_retrieval_stats,
+    "router": router_stats,
+}
+
+@app.route('/api/stats/<name>', methods=['GET'])
+def stats(name):
+    """One of the STATS_REPORTS."""
+    report = STATS_REPORTS.get(name)
+    if report is None:
+        return jsonify({"error": f"Unknown stats '{name}'"}), 404
+    return jsonify(report())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: per-stage latency histograms, token counts, cache lookups and in-flight requests."""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 @app.route('/healthz', methods=['GET'])
 def healthz():
     """Health check endpoint."""
@@ -215,7 +739,7 @@ def main():
     # The default Flask server is not suitable for production.
     # Use a production-ready WSGI server like Gunicorn or uWSGI.
     # The Dockerfile uses Gunicorn.
-    print("Starting Flask web server for development...")
+    logger.info("Starting Flask web server for development...")
     app.run(host='0.0.0.0', port=5000)
 
 if __name__ == "__main__":
@@ -0,0 +1,292 @@
+# ai_engine/asgi.py
+"""
+Async serving mode for the AI engine.
+
+Serves the same `/api/prompt`, `/api/stats/<name>`, `/metrics` and `/healthz` contract as
+the Flask app, but runs each prompt as a coroutine: Ollama, Home Assistant and ChromaDB
+are called through async clients, so a request waiting on the LLM holds no worker thread
+and a single process can keep hundreds of prompts in flight. `/api/prompt/stream` is
+left out: token streaming is only served by the Flask app.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Engine state (state mirror, plan cache, entity/group indexes, conversation history)
+and the pipeline steps themselves are `AIEngine`'s; only the I/O differs. CPU-bound
+steps (index rebuilds, intent routing, resolving commands) and state store calls run
+in worker threads, off the event loop.
+"""
+import logging
+import time
+import asyncio
+import contextlib
+
+import chromadb
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from app import ai_engine, AREA_CACHE_KEY, STATS_REPORTS, feed_plan, close_plan
+from lib.chroma_helpers import query_memories_async, wait_for_memories_async, memory_collection_name
+from lib.command_executor import COMMAND_MAX_CONCURRENCY
+from lib.ha_helpers import get_ha_states_async, get_ha_area_data_async, call_homeassistant_api_async
+from lib.http_client import close_async_clients
+from lib.intent_router import prompt_paths
+from lib.logging_setup import set_request_id
+from lib.metrics import stage, track_request, record_cache, render_metrics
+from lib.ollama_helpers import call_ollama_async, stream_ollama_async
+from lib.prompts import CALCULATOR_ANSWER_PROMPT_TEMPLATE
+from lib.embeddings import MEMORY_EMBED_MODEL
+from lib.tool_helpers import handle_web_search_async, perform_calculation
+from lib.command_parsing import IncrementalCommandParser, tool_output_format
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPromptProcessor:
+    """Async counterpart of `AIEngine.process_prompt`, reusing the engine's state and pure helpers."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.memory_collection = None
+        self._area_lock = asyncio.Lock()
+
+    async def connect_memory(self):
+        if not self.engine.chromadb_url:
+            return
+        try:
+            host, port = self.engine.chromadb_url.replace('http://', '').split(':')
+            client = await chromadb.AsyncHttpClient(host=host, port=int(port))
+            self.memory_collection = await client.get_or_create_collection(
+                name=memory_collection_name(MEMORY_EMBED_MODEL),
+                metadata={"hnsw:space": "cosine"}
+            )
+            logger.info("Connected async ChromaDB client.")
+        except Exception as e:
+            logger.error(f"-- FAILED TO CONNECT ASYNC CHROMADB CLIENT: {e} --")
+
+    async def get_states_and_entities(self):
+        engine = self.engine
+        if engine.state_mirror and engine.state_mirror.is_ready():
+            return engine.state_mirror.get_states(), engine.state_mirror.get_entities()
+        all_states = await get_ha_states_async()
+        all_entities = {s["entity_id"]: s["attributes"].get("friendly_name", s["entity_id"]) for s in all_states}
+        return all_states, all_entities
+
+    async def process_prompt(self, prompt_text, model_override=None, use_cache=True, session_id=None):
+        engine = self.engine
+        started = time.perf_counter()
+        turn = None
+        try:
+            if not prompt_text or not prompt_text.strip():
+                return "Error: Prompt cannot be empty."
+
+            turn = await self._state_io(engine._open_turn, prompt_text, model_override, session_id, use_cache)
+
+            memory_lookup = self._start_memory_retrieval(prompt_text)
+
+            with stage("ha_states"):
+                all_states, all_entities = await self.get_states_and_entities()
+            if not all_states:
+                memory_lookup[0].cancel()
+                return "Error: Could not get device list."
+
+            # Index rebuilds and intent routing are CPU-bound; keep them off the event loop.
+            await asyncio.to_thread(engine._plan_locally, turn, all_states, all_entities)
+            if turn.commands is None and turn.use_cache:
+                await self._off_loop(engine._use_cached_plan, turn)
+            if not engine._planned_without_llm(turn, memory_lookup):
+                on_command = engine._start_streamed_plan(turn, self._start_batch)
+                commands = await self._generate_plan(
+                    prompt_text, turn.model, all_entities, turn.entity_index, turn.history, memory_lookup,
+                    on_command=on_command, on_plan_done=turn.streamed.flush
+                )
+                engine._finish_streamed_plan(turn, commands)
+                if turn.commands and turn.use_cache:
+                    await self._off_loop(engine._cache_plan, turn)
+
+            if not turn.commands:
+                direct_prompt = engine._direct_answer_prompt(turn)
+                with stage("llm_answer"):
+                    answer = await call_ollama_async(direct_prompt, turn.model)
+                await self._state_io(engine.conversations.record, session_id, "assistant", answer)
+                return answer
+
+            # Resolving the remaining commands may self-correct entity ids, which is CPU-bound too.
+            results, tasks, jobs = await asyncio.to_thread(engine._prepare_jobs, turn)
+
+            semaphore = asyncio.Semaphore(COMMAND_MAX_CONCURRENCY)
+            async def run_job(job):
+                kind, item = job
+                if kind == "started":
+                    return await item["call"]
+                async with semaphore:
+                    if kind == "batch":
+                        return await call_homeassistant_api_async(item["service"], item["entity_ids"], item["parameters"])
+                    return await self._execute_command(turn.commands[item], prompt_text, turn.model)
+            with stage("ha_service_calls"):
+                outcomes = await asyncio.gather(*(run_job(job) for job in jobs))
+
+            # Records the reply in the conversation history, so it goes through the store too.
+            return await self._state_io(engine._summarize_results, turn, results, tasks, jobs, outcomes)
+
+        except Exception as e:
+            logger.exception(f"Uncaught exception in async process_prompt: {type(e).__name__}: {e}")
+            return f"An unexpected error occurred: {e}"
+        finally:
+            if turn is not None and turn.path:
+                prompt_paths.record(turn.path, time.perf_counter() - started)
+
+    async def _state_io(self, fn, *args):
+        # The file and Redis state stores block (flock polling, network round trips).
+        return await asyncio.to_thread(fn, *args)
+
+    async def _off_loop(self, fn, *args):
+        # The plan cache only does I/O when it has an embedding function.
+        if self.engine.plan_cache.embed_fn is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    def _start_memory_retrieval(self, prompt_text):
+        task = asyncio.ensure_future(
+            query_memories_async(self.memory_collection, prompt_text, 3, self.engine.memory_embedder)
+        )
+        return task, time.perf_counter()
+
+    async def _generate_plan(self, prompt_text, model_to_use, all_entities, entity_index=None, history="", memory_lookup=None,
+                             on_command=None, on_plan_done=None):
+        """Async `AIEngine._generate_plan`."""
+        if memory_lookup is None:
+            memory_lookup = self._start_memory_retrieval(prompt_text)
+        with stage("area_data"):
+            area_data = await self._get_area_data()
+        with stage("memory_retrieval"):
+            retrieved_memories = await wait_for_memories_async(*memory_lookup)
+
+        system, tool_prompt = self.engine._tool_prompt(
+            prompt_text, all_entities, area_data, retrieved_memories, entity_index, history
+        )
+        parser = IncrementalCommandParser()
+        with stage("llm_call"):
+            tokens = stream_ollama_async(tool_prompt, model_to_use, tool_output_format(), system)
+            try:
+                async for token in tokens:
+                    feed_plan(parser, token, on_command, on_plan_done)
+            finally:
+                await tokens.aclose()
+        return close_plan(parser)
+
+    def _start_batch(self, batch):
+        """Async `AIEngine._start_batch`: the call runs as a task in batch["call"]."""
+        batch["call"] = asyncio.ensure_future(
+            call_homeassistant_api_async(batch["service"], batch["entity_ids"], batch["parameters"])
+        )
+
+    async def _get_area_data(self):
+        """Async `AIEngine.get_area_data`: one fetch per expiry in this process, shared through the state store."""
+        mirror = self.engine.state_mirror
+        if mirror and mirror.is_ready() and mirror.areas_ready():
+            record_cache("area", "mirror")
+            return mirror.get_area_data()
+        store = self.engine.state_store
+        area_data = await self._state_io(store.get, AREA_CACHE_KEY)
+        result = "hit"
+        if area_data is None:
+            async with self._area_lock:
+                area_data = await self._state_io(store.get, AREA_CACHE_KEY)
+                if area_data is None:
+                    result = "miss"
+                    area_data = await get_ha_area_data_async()
+                    if area_data:
+                        await self._state_io(store.set, AREA_CACHE_KEY, area_data, self.engine.area_cache_expiration)
+        record_cache("area", result)
+        return area_data or {}
+
+    async def _execute_command(self, command_data, prompt_text, model_to_use):
+        """Async version of `AIEngine._execute_command`."""
+        try:
+            action = command_data.get("action")
+            if not action:
+                raise ValueError("Action not found in command.")
+
+            if action == "web_search":
+                query = command_data.get("query")
+                if not query: raise ValueError("Web search action requires a query.")
+                return await handle_web_search_async(query, model_to_use), None, None
+
+            elif action == "calculator":
+                expression = command_data.get("expression")
+                if not expression: raise ValueError("Calculator action requires an expression.")
+                calc_result = perform_calculation(expression)
+                answer_prompt = CALCULATOR_ANSWER_PROMPT_TEMPLATE.format(prompt=prompt_text, result=calc_result)
+                final_answer = await call_ollama_async(answer_prompt, model_to_use)
+                return final_answer.strip(), None, None
+
+            else:
+                raise ValueError(f"Unknown action '{action}' in command.")
+
+        except Exception as e:
+            logger.error(f"Error processing command: {e}")
+            return None, f"failed to execute a command due to: {e}", None
+
+
+processor = AsyncPromptProcessor(ai_engine)
+
+
+async def api_prompt(request):
+    """Same contract as the Flask /api/prompt, including "no_cache" and "session_id"."""
+    request_id = set_request_id(request.headers.get("X-Request-ID"))
+    headers = {"X-Request-ID": request_id}
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Request must be JSON"}, status_code=400, headers=headers)
+    if not isinstance(data, dict):
+        return JSONResponse({"error": "Request must be JSON"}, status_code=400, headers=headers)
+
+    prompt_text = data.get("prompt")
+    if not prompt_text:
+        return JSONResponse({"error": "Missing 'prompt' in request body"}, status_code=400, headers=headers)
+
+    with track_request("prompt"):
+        response_message = await processor.process_prompt(
+            prompt_text, data.get("model"), use_cache=not data.get("no_cache", False), session_id=data.get("session_id")
+        )
+    return JSONResponse({"response": response_message}, headers=headers)
+
+
+async def stats(request):
+    """Same per-worker counters as the Flask /api/stats/<name>."""
+    report = STATS_REPORTS.get(request.path_params["name"])
+    if report is None:
+        return JSONResponse({"error": f"Unknown stats '{request.path_params['name']}'"}, status_code=404)
+    # The session stats sweep the state store.
+    return JSONResponse(await asyncio.to_thread(report))
+
+
+async def metrics(request):
+    """Prometheus metrics, as served by the Flask app."""
+    body, content_type = render_metrics()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+async def healthz(request):
+    """Health check endpoint."""
+    return PlainTextResponse("OK")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await processor.connect_memory()
+    yield
+    await close_async_clients()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/prompt', api_prompt, methods=['POST']),
+        Route('/api/stats/{name}', stats, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/healthz', healthz, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,231 @@
+# ai_engine/benchmarks/bench_area_registry.py
+"""
+Checks the registry-backed area map of HAStateMirror against a fake Home
+Assistant websocket server, and times it.
+
+The fake server speaks just enough of the HA websocket API (auth,
+subscribe_events, config/*_registry/list) for the mirror, and can fire
+*_registry_updated events. The script checks that the mirrored area map matches
+what the area template would render, then moves entities and devices between
+areas and measures how long the change takes to show up.
+
+    python benchmarks/bench_area_registry.py --entities 5000 --areas 40
+"""
+import os
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import statistics
+import threading
+import socketserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib.ha_state_mirror import HAStateMirror
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def build_registries(n_entities, n_areas, seed=1):
+    rng = random.Random(seed)
+    areas = [{"area_id": f"area_{i}", "name": f"Area {i}"} for i in range(n_areas)]
+    devices = [{"id": f"dev_{i}", "area_id": rng.choice(areas)["area_id"]} for i in range(n_entities // 4)]
+    entities, states = [], []
+    for i in range(n_entities):
+        entity_id = f"sensor.thing_{i}"
+        # Mostly device-linked entities, some with their own area, some unassigned.
+        roll = rng.random()
+        area_id = rng.choice(areas)["area_id"] if roll < 0.2 else None
+        device_id = rng.choice(devices)["id"] if roll < 0.9 else None
+        entities.append({"entity_id": entity_id, "area_id": area_id, "device_id": device_id})
+        states.append({"entity_id": entity_id, "state": "1", "attributes": {"friendly_name": f"Thing {i}"}})
+    return {"area": areas, "device": devices, "entity": entities}, states
+
+
+def template_area_data(registries, states):
+    """What the `get_ha_area_data` template renders: area_name() of every state's entity, in HA's entity_id order."""
+    area_names = {a["area_id"]: a["name"] for a in registries["area"]}
+    device_areas = {d["id"]: d["area_id"] for d in registries["device"]}
+    links = {e["entity_id"]: e for e in registries["entity"]}
+    result = {}
+    for state in sorted(states, key=lambda s: s["entity_id"]):
+        link = links.get(state["entity_id"], {})
+        area_id = link.get("area_id") or device_areas.get(link.get("device_id"))
+        if area_id in area_names:
+            result.setdefault(area_names[area_id], []).append(
+                {"entity_id": state["entity_id"], "friendly_name": state["attributes"]["friendly_name"]}
+            )
+    return result
+
+
+class FakeHomeAssistantWS(socketserver.BaseRequestHandler):
+    """Minimal RFC 6455 server playing the HA websocket API."""
+    registries = {}
+    clients = []
+    lock = threading.Lock()
+
+    def handle(self):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            request += self.request.recv(4096)
+        headers = dict(
+            line.split(": ", 1) for line in request.decode().split("\r\n")[1:] if ": " in line
+        )
+        accept = base64.b64encode(hashlib.sha1((headers["Sec-WebSocket-Key"] + WS_GUID).encode()).digest()).decode()
+        self.request.sendall(
+            ("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+             f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode()
+        )
+        self.subscriptions = {}
+        self.send({"type": "auth_required"})
+        with self.lock:
+            self.clients.append(self)
+        try:
+            while True:
+                msg = self.recv()
+                if msg is None:
+                    break
+                if msg["type"] == "auth":
+                    self.send({"type": "auth_ok"})
+                elif msg["type"] == "subscribe_events":
+                    self.subscriptions[msg["event_type"]] = msg["id"]
+                    self.send({"id": msg["id"], "type": "result", "success": True, "result": None})
+                elif msg["type"].startswith("config/") and msg["type"].endswith("_registry/list"):
+                    registry = msg["type"].split("/")[1].replace("_registry", "")
+                    with self.lock:
+                        result = list(self.registries[registry])
+                    self.send({"id": msg["id"], "type": "result", "success": True, "result": result})
+        finally:
+            with self.lock:
+                self.clients.remove(self)
+
+    def recv(self):
+        header = self._read(2)
+        if not header:
+            return None
+        opcode, length = header[0] & 0x0F, header[1] & 0x7F
+        if length == 126:
+            length = int.from_bytes(self._read(2), "big")
+        elif length == 127:
+            length = int.from_bytes(self._read(8), "big")
+        mask = self._read(4)
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._read(length)))
+        if opcode == 8:
+            return None
+        return json.loads(payload)
+
+    def _read(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                return b""
+            data += chunk
+        return data
+
+    def send(self, msg):
+        payload = json.dumps(msg).encode()
+        if len(payload) < 126:
+            header = bytes([0x81, len(payload)])
+        elif len(payload) < 65536:
+            header = bytes([0x81, 126]) + len(payload).to_bytes(2, "big")
+        else:
+            header = bytes([0x81, 127]) + len(payload).to_bytes(8, "big")
+        self.request.sendall(header + payload)
+
+    @classmethod
+    def fire(cls, event_type, data):
+        with cls.lock:
+            for client in cls.clients:
+                sub_id = client.subscriptions.get(event_type)
+                if sub_id is not None:
+                    client.send({"id": sub_id, "type": "event", "event": {"event_type": event_type, "data": data}})
+
+
+class FakeServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def wait_for(condition, timeout=10):
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("condition not met")
+        time.sleep(0.001)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entities", type=int, default=5000)
+    parser.add_argument("--areas", type=int, default=40)
+    parser.add_argument("--moves", type=int, default=20)
+    args = parser.parse_args()
+
+    registries, states = build_registries(args.entities, args.areas)
+    FakeHomeAssistantWS.registries = registries
+    server = FakeServer(("127.0.0.1", 0), FakeHomeAssistantWS)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    mirror = HAStateMirror(
+        ws_url=f"ws://127.0.0.1:{server.server_address[1]}/api/websocket",
+        token="benchmark",
+        fetch_states=lambda: states,
+    )
+    start = time.perf_counter()
+    mirror.start()
+    wait_for(lambda: mirror.is_ready() and mirror.areas_ready())
+    print(f"{args.entities} entities in {args.areas} areas; registries loaded in "
+          f"{(time.perf_counter() - start) * 1000:.0f} ms\n")
+
+    failures = 0
+    if mirror.get_area_data() != template_area_data(registries, states):
+        print("MISMATCH: initial area map differs from the template rendering")
+        failures += 1
+
+    timings = []
+    for _ in range(1000):
+        t = time.perf_counter()
+        mirror.get_area_data()
+        timings.append((time.perf_counter() - t) * 1000)
+    print(f"get_area_data per request: p50 {statistics.median(timings) * 1000:.1f} us")
+
+    rng = random.Random(2)
+    refresh_ms = []
+    for i in range(args.moves):
+        target = rng.choice(registries["area"])
+        if i % 2:
+            # Move an entity to an area of its own.
+            entry = rng.choice(registries["entity"])
+            entry["area_id"] = target["area_id"]
+            event_type, entity_id = "entity_registry_updated", entry["entity_id"]
+        else:
+            # Move a device; its area-less entities follow it.
+            entry = next(e for e in registries["entity"] if e["device_id"] and not e["area_id"])
+            device = next(d for d in registries["device"] if d["id"] == entry["device_id"])
+            device["area_id"] = target["area_id"]
+            event_type, entity_id = "device_registry_updated", entry["entity_id"]
+        FakeHomeAssistantWS.fire(event_type, {"action": "update"})
+        refresh_ms.append(wait_for(lambda: any(
+            e["entity_id"] == entity_id for e in mirror.get_area_data().get(target["name"], [])
+        )))
+
+    if mirror.get_area_data() != template_area_data(registries, states):
+        print("MISMATCH: area map differs from the template rendering after registry updates")
+        failures += 1
+    print(f"registry change visible after: p50 {statistics.median(refresh_ms):.1f} ms, "
+          f"max {max(refresh_ms):.1f} ms ({args.moves} moves)")
+    print("area map matches the template rendering" if not failures else f"{failures} mismatch(es)")
+
+    mirror.stop()
+    server.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# ai_engine/benchmarks/bench_async_serving.py
+"""
+Load-tests /api/prompt under the default gunicorn setup (one sync worker, as in
+the Dockerfile) and under the async ASGI app (uvicorn asgi:app), comparing
+throughput and latency percentiles.
+
+Both servers run against a local stub backend that plays Ollama and Home
+Assistant with a fixed latency per call. Every prompt takes the device path:
+states fetch, tool-selection generation and one service call. The plan cache
+and state mirror are disabled so every request does that I/O.
+
+    python benchmarks/bench_async_serving.py --requests 400 --concurrency 200 --ollama-ms 300
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import httpx
+
+ENGINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+STATES = [
+    {"entity_id": f"light.room_{i}", "state": "off", "attributes": {"friendly_name": f"Room {i} Light"}}
+    for i in range(50)
+]
+TOOL_REPLY = json.dumps({"action": "execute_task", "service": "light.turn_on", "entity_id": "light.room_7"})
+
+
+class StubBackend(BaseHTTPRequestHandler):
+    """Answers the Ollama and Home Assistant endpoints the engine calls."""
+    protocol_version = "HTTP/1.1"
+    ollama_latency = 0.3
+    ha_latency = 0.03
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.ha_latency)
+        self._reply(STATES if self.path.endswith("/states") else {})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/api/generate":
+            time.sleep(self.ollama_latency)
+            self._reply({"response": TOOL_REPLY, "done": True})
+        else:
+            time.sleep(self.ha_latency)
+            self._reply({"Kitchen": []} if self.path.endswith("/template") else [])
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_engine(mode, port, backend_url):
+    env = dict(
+        os.environ,
+        OLLAMA_URL=backend_url,
+        HA_API_URL=f"{backend_url}/api",
+        HA_API_TOKEN="benchmark",
+        HA_STATE_MIRROR="false",
+        PLAN_CACHE="false",
+    )
+    env.pop("CHROMADB_URL", None)
+    if mode == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "app:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning", "--backlog", "2048"]
+    process = subprocess.Popen(cmd, cwd=ENGINE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/healthz", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} did not become healthy")
+
+
+async def run_load(url, total, concurrency, timeout):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, json={"prompt": "turn on the room 7 light"})
+                    response.raise_for_status()
+                    if "executed turn on" not in response.json().get("response", ""):
+                        raise ValueError(response.text)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                except (httpx.HTTPError, ValueError):
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--ollama-ms", type=float, default=300.0)
+    parser.add_argument("--ha-ms", type=float, default=30.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--modes", default="gunicorn,asgi")
+    args = parser.parse_args()
+
+    StubBackend.ollama_latency = args.ollama_ms / 1000
+    StubBackend.ha_latency = args.ha_ms / 1000
+    backend = StubServer(("127.0.0.1", 0), StubBackend)
+    threading.Thread(target=backend.serve_forever, daemon=True).start()
+    backend_url = f"http://127.0.0.1:{backend.server_address[1]}"
+
+    print(f"{args.requests} requests, {args.concurrency} concurrent, "
+          f"Ollama {args.ollama_ms:.0f} ms, HA {args.ha_ms:.0f} ms per call\n")
+    print(f"{'server':<10}{'ok':>6}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}")
+    for mode in args.modes.split(","):
+        port = free_port()
+        process = start_engine(mode, port, backend_url)
+        try:
+            latencies, errors, elapsed = asyncio.run(
+                run_load(f"http://127.0.0.1:{port}/api/prompt", args.requests, args.concurrency, args.timeout)
+            )
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        latencies.sort()
+        p50 = statistics.median(latencies) if latencies else float("nan")
+        p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)] if latencies else float("nan")
+        print(f"{mode:<10}{len(latencies):>6}{errors:>8}{len(latencies) / elapsed:>9.1f}{p50:>10.0f}{p99:>10.0f}")
+
+    backend.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# ai_engine/benchmarks/bench_command_parsing.py
+"""
+Compares the single-pass command parser with the old regex / json.loads / slice
+extraction, and measures how much earlier streamed parsing can start commands.
+
+Replies are shaped like what models produce without constrained output: bare
+JSON, ```json blocks, prose before or after the JSON (with stray braces), and
+single objects. A reply the old extraction could not parse cost a second "answer
+directly" generation. The timing part replays a three-command plan at
+`--tokens-per-s` (about 4 characters per token) and reports when each command
+is complete, i.e. when its service call can start, against the end of the reply.
+
+    python benchmarks/bench_command_parsing.py --tokens-per-s 30
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib.command_parsing import IncrementalCommandParser, parse_commands
+
+LIGHT = {"action": "execute_task", "service": "light.turn_on", "entity_id": "light.kitchen_main_lights"}
+FAN = {"action": "execute_task", "service": "fan.turn_on", "entity_id": "fan.house_master_bedroom_ceiling",
+       "parameters": {"percentage": 50}}
+SEARCH = {"action": "web_search", "query": "first president of the United States"}
+PLAN = [LIGHT, FAN, SEARCH]
+
+# (reply, expected commands)
+REPLIES = [
+    (json.dumps(PLAN), PLAN),
+    (json.dumps(LIGHT), [LIGHT]),
+    ("```json\n" + json.dumps(PLAN, indent=2) + "\n```", PLAN),
+    ("```\n" + json.dumps(LIGHT, indent=2) + "\n```\nThe kitchen is now lit.", [LIGHT]),
+    (json.dumps(PLAN, indent=2) + "\n\nI have turned on the lights and the fan.", PLAN),
+    (json.dumps(LIGHT) + "\nLet me know if you need anything {else}.", [LIGHT]),
+    ("Certainly. Here is the plan:\n" + json.dumps(PLAN), PLAN),
+    ("Certainly [as always]. " + json.dumps(SEARCH) + " I'll look that up.", [SEARCH]),
+    ("I am not sure which device you mean.", []),
+    ("[]", []),
+]
+
+
+def legacy_extract(text):
+    """extract_json_commands before the single-pass parser."""
+    match = re.search(r"```(json)?\s*([\s\S]*?)\s*```", text)
+    if match:
+        try:
+            parsed = json.loads(match.group(2))
+            return parsed if isinstance(parsed, list) else [parsed] if isinstance(parsed, dict) else []
+        except json.JSONDecodeError:
+            return []
+    try:
+        parsed = json.loads(text)
+        return parsed if isinstance(parsed, list) else [parsed] if isinstance(parsed, dict) else []
+    except json.JSONDecodeError:
+        pass
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return []
+    try:
+        parsed = json.loads(text[min(starts):])
+        return parsed if isinstance(parsed, list) else [parsed] if isinstance(parsed, dict) else []
+    except json.JSONDecodeError:
+        return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens-per-s", type=float, default=30.0)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'reply':<60}{'old':>6}{'new':>6}")
+    failures = legacy_misses = 0
+    for reply, expected in REPLIES:
+        old_ok = legacy_extract(reply) == expected
+        new_ok = parse_commands(reply) == expected
+        legacy_misses += not old_ok
+        failures += not new_ok
+        shown = reply.replace("\n", " ")
+        print(f"{shown[:57] + '...' if len(shown) > 60 else shown:<60}{'ok' if old_ok else 'MISS':>6}{'ok' if new_ok else 'MISS':>6}")
+    print(f"\nold extraction missed {legacy_misses} of {len(REPLIES)} replies (each a second LLM generation); "
+          f"new parser missed {failures}")
+
+    for name, fn in (("old", legacy_extract), ("new", parse_commands)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for reply, _ in REPLIES:
+                fn(reply)
+        per_reply = (time.perf_counter() - start) / (args.repeat * len(REPLIES)) * 1e6
+        print(f"{name} parse: {per_reply:.1f} us per reply")
+
+    # Replay the plan the way Ollama streams it, a few characters per token.
+    reply = json.dumps(PLAN, indent=2) + "\nAll done."
+    chars_per_token = 4
+    stream = IncrementalCommandParser()
+    print(f"\n{len(reply) // chars_per_token} tokens at {args.tokens_per_s:.0f} tokens/s:")
+    for position in range(0, len(reply), chars_per_token):
+        for command in stream.feed(reply[position:position + chars_per_token]):
+            at = (position // chars_per_token + 1) / args.tokens_per_s
+            print(f"  {command['action']:<13} {command.get('entity_id', command.get('query')):<40} ready at {at:5.2f} s")
+        if stream.done:
+            break
+    total = -(-len(reply) // chars_per_token) / args.tokens_per_s
+    print(f"  whole reply (old: every command waited for this)        {total:5.2f} s")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
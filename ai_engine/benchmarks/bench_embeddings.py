@@ -0,0 +1,146 @@
+# ai_engine/benchmarks/bench_embeddings.py
+"""
+Measures the memory embedding pipeline against a stub Ollama embed endpoint.
+
+The stub charges a fixed cost per call plus a small cost per text and, like a
+local Ollama runner, only serves `--parallel` calls at a time. The script
+embeds prompts from many threads at once, one `/api/embed` call per prompt (the
+old per-query path) versus EmbeddingService (micro-batched, then cached on
+repeats), checks that both return the same vectors, and stores memories
+concurrently through store_memory to show that ids no longer collide.
+
+    python benchmarks/bench_embeddings.py --prompts 400 --threads 32 --call-ms 20
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    """Plays Ollama's /api/embed, with deterministic vectors derived from each text."""
+    protocol_version = "HTTP/1.1"
+    call_latency = 0.02
+    text_latency = 0.0005
+    calls = 0
+    lock = threading.Lock()
+    runner = threading.Semaphore(1)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        with self.lock:
+            StubOllama.calls += 1
+        with self.runner:
+            time.sleep(self.call_latency + self.text_latency * len(texts))
+        payload = json.dumps({"embeddings": [fake_vector(t) for t in texts]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def fake_vector(text, dims=16):
+    digest = hashlib.sha256(text.encode()).digest()
+    return [b / 255 for b in digest[:dims]]
+
+
+class FakeCollection:
+    """Records `add` calls the way a ChromaDB collection would reject duplicate ids."""
+
+    def __init__(self):
+        self.ids = set()
+        self.add_calls = 0
+        self.duplicates = 0
+        self.lock = threading.Lock()
+
+    def add(self, ids, documents, embeddings=None):
+        with self.lock:
+            self.add_calls += 1
+            self.duplicates += len(set(ids) & self.ids) + len(ids) - len(set(ids))
+            self.ids.update(ids)
+
+
+def timed_run(fn, items, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(fn, items))
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--prompts", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--call-ms", type=float, default=20.0)
+    parser.add_argument("--text-ms", type=float, default=0.5)
+    parser.add_argument("--parallel", type=int, default=1, help="concurrent calls the stub serves (OLLAMA_NUM_PARALLEL)")
+    args = parser.parse_args()
+
+    StubOllama.call_latency = args.call_ms / 1000
+    StubOllama.text_latency = args.text_ms / 1000
+    StubOllama.runner = threading.Semaphore(args.parallel)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OLLAMA_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    from lib import ollama_helpers
+    ollama_helpers.OLLAMA_URL = os.environ["OLLAMA_URL"]
+    from lib.embeddings import EmbeddingService
+    from lib.chroma_helpers import store_memory
+
+    prompts = [f"turn on the light in room {i}" for i in range(args.prompts)]
+    print(f"{args.prompts} prompts from {args.threads} threads; stub Ollama "
+          f"{args.call_ms:.0f} ms per call + {args.text_ms} ms per text, "
+          f"{args.parallel} call(s) at a time\n")
+    print(f"{'path':<26}{'calls':>7}{'seconds':>9}{'prompts/s':>11}")
+
+    def report(name, calls, elapsed):
+        print(f"{name:<26}{calls:>7}{elapsed:>9.2f}{args.prompts / elapsed:>11.0f}")
+
+    StubOllama.calls = 0
+    baseline, elapsed = timed_run(lambda p: ollama_helpers.get_ollama_embedding(p, "stub"), prompts, args.threads)
+    report("one call per prompt", StubOllama.calls, elapsed)
+
+    service = EmbeddingService("stub")
+    StubOllama.calls = 0
+    batched, elapsed = timed_run(service.embed_one, prompts, args.threads)
+    report("micro-batched", StubOllama.calls, elapsed)
+
+    StubOllama.calls = 0
+    cached, elapsed = timed_run(service.embed_one, prompts, args.threads)
+    report("repeated (cache hits)", StubOllama.calls, elapsed)
+
+    failures = 0
+    if not (baseline == batched == cached == [fake_vector(p) for p in prompts]):
+        print("MISMATCH: batched or cached vectors differ from per-prompt embeddings")
+        failures += 1
+    print(f"\nembedder stats: {service.stats()}")
+
+    collection = FakeCollection()
+    writer = EmbeddingService("stub-writer")
+    _, elapsed = timed_run(lambda text: store_memory(collection, text, writer), [f"memory {i}" for i in range(args.prompts)], args.threads)
+    print(f"stored {len(collection.ids)} memories in {collection.add_calls} add call(s), "
+          f"{elapsed:.2f} s, {collection.duplicates} duplicate id(s)")
+    if collection.duplicates or len(collection.ids) != args.prompts:
+        failures += 1
+
+    print("vectors match and ids are unique" if not failures else f"{failures} failure(s)")
+    server.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# ai_engine/benchmarks/bench_entity_index.py
+"""
+Checks EntityIndex against find_best_matching_entity for parity and times both,
+on a synthetic home (10,000 entities by default).
+
+Both modes must match exactly. Self-correction lookups are made from misspelled
+entity ids and friendly names (dropped, swapped or replaced characters, wrong
+domains). The target for self-correction is under 1 ms per lookup; the last
+column says whether p50 and p99 meet it (on a 10,000-entity home p50 does, at
+~0.8 ms, and p99 does not, at ~3.5 ms).
+
+    python benchmarks/bench_entity_index.py --entities 10000 --queries 300
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lib.utils import find_best_matching_entity
+from lib.entity_index import EntityIndex
+from bench_prompt_context import build_home, PROMPTS
+
+
+def misspell(text, rng):
+    chars = list(text)
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        op = rng.choice(("drop", "swap", "replace"))
+        if op == "drop" and len(chars) > 3:
+            del chars[i]
+        elif op == "swap" and i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        else:
+            chars[i] = rng.choice("abcdefghijklmnopqrstuvwxyz_")
+    return "".join(chars)
+
+
+def time_calls(fn, queries):
+    timings = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(fn(*query))
+        timings.append((time.perf_counter() - start) * 1000)
+    return results, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entities", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    all_entities, _ = build_home(args.entities)
+    entity_ids = list(all_entities)
+
+    start = time.perf_counter()
+    index = EntityIndex(all_entities, version=1)
+    print(f"{len(all_entities)} entities, index built in {(time.perf_counter() - start) * 1000:.1f} ms\n")
+
+    keyword_queries = [(p, None) for p in PROMPTS]
+    for _ in range(args.queries):
+        name = all_entities[rng.choice(entity_ids)]
+        keyword_queries.append((rng.choice(("turn on the", "what is the", "switch off")) + " " + name.lower(), None))
+
+    fuzzy_queries = []
+    for _ in range(args.queries):
+        entity_id = rng.choice(entity_ids)
+        target = rng.choice((entity_id, all_entities[entity_id]))
+        if rng.random() < 0.2 and "." in target:
+            target = "switch." + target.split(".", 1)[1]
+        fuzzy_queries.append(("turn it on", misspell(target, rng)))
+
+    print(f"{'mode':<16}{'queries':>8}{'parity':>10}{'linear p50 ms':>15}{'index p50 ms':>14}{'index p99 ms':>14}{'p50/p99 < 1 ms':>16}")
+    exit_code = 0
+    for mode, queries in (("keyword", keyword_queries), ("self-correction", fuzzy_queries)):
+        expected, linear_ms = time_calls(
+            lambda prompt, target: find_best_matching_entity(prompt, all_entities, target_text=target), queries
+        )
+        actual, index_ms = time_calls(
+            lambda prompt, target: find_best_matching_entity(prompt, all_entities, target_text=target, index=index),
+            queries,
+        )
+        matches = sum(1 for a, b in zip(expected, actual) if a == b)
+        index_ms.sort()
+        p50 = statistics.median(index_ms)
+        p99 = index_ms[int(len(index_ms) * 0.99) - 1]
+        met = "/".join("yes" if ms < 1 else "no" for ms in (p50, p99))
+        print(
+            f"{mode:<16}{len(queries):>8}{matches / len(queries):>10.1%}"
+            f"{statistics.median(linear_ms):>15.3f}{p50:>14.3f}{p99:>14.3f}{met:>16}"
+        )
+        if matches != len(queries):
+            exit_code = 1
+            for query, a, b in zip(queries, expected, actual):
+                if a != b:
+                    print(f"  MISMATCH {query}: linear={a} index={b}")
+
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
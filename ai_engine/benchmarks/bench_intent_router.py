@@ -0,0 +1,174 @@
+# ai_engine/benchmarks/bench_intent_router.py
+"""
+Tunes and checks the intent router against labelled prompts, and times it.
+
+Labelled prompts come from finetuning_data.jsonl (against a small home holding
+the entities its answers use) and from a synthetic home (10,000 entities by
+default) with a command phrased a few ways for each sampled device; a third of
+those drop the device's number, which leaves several devices matching, so they
+are labelled for the LLM. For each ROUTER_MIN_MARGIN in the sweep the script
+reports coverage (device commands planned correctly without the LLM) and wrong
+routes (a routed plan that differs from the label).
+A wrong route acts on the wrong device, so the default margin must have none;
+prompts labelled for the LLM (questions, follow-ups, schedules) must fall back.
+
+    python benchmarks/bench_intent_router.py --entities 10000 --prompts 300
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lib.utils import extract_json_commands
+from lib.entity_index import EntityIndex
+from lib.intent_router import IntentRouter, ROUTER_MIN_MARGIN
+from bench_prompt_context import build_home
+
+FINETUNING_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "finetuning_data.jsonl")
+
+# The devices finetuning_data.jsonl refers to, and their neighbours in the same rooms.
+DATASET_HOME = {
+    "light.house_living_room_floor_left": "Living Room Floor Lamp",
+    "light.house_living_room_ceiling": "Living Room Ceiling",
+    "switch.living_room_tv": "Living Room TV",
+    "sensor.living_room_temperature": "Living Room Temperature",
+    "light.kitchen_main_lights": "Kitchen Main Lights",
+    "light.kitchen_under_cabinet": "Kitchen Under Cabinet",
+    "switch.kitchen_coffee_maker": "Kitchen Coffee Maker",
+    "light.house_master_bedroom_ceiling": "Master Bedroom Ceiling Light",
+    "fan.house_master_bedroom_ceiling": "Master Bedroom Ceiling Fan",
+    "binary_sensor.front_door_contact": "Front Door Contact",
+    "lock.front_door": "Front Door Lock",
+}
+
+# Prompts the router must leave to the LLM, whatever the home.
+LLM_PROMPTS = [
+    "Turn it off",
+    "Turn on the kitchen lights in 10 minutes",
+    "Turn off all the lights",
+    "Turn the living room lights red",
+    "If the front door is unlocked, lock it",
+    "Is the garage door open?",
+    "What's the weather like tomorrow?",
+    "Remember that my birthday is in May",
+    "Turn on the lights",
+]
+
+
+def load_finetuning_data(path):
+    """The file holds concatenated JSON objects rather than one per line."""
+    decoder = json.JSONDecoder()
+    with open(path) as f:
+        text = f.read()
+    examples, pos = [], 0
+    while pos < len(text):
+        if text[pos].isspace():
+            pos += 1
+            continue
+        example, pos = decoder.raw_decode(text, pos)
+        examples.append((example["prompt"], extract_json_commands(example["response"])))
+    return examples
+
+
+def label(commands):
+    """Only plans made purely of execute_task commands are the router's to make."""
+    if commands and all(c.get("action") == "execute_task" for c in commands):
+        return commands
+    return None
+
+
+def synthetic_prompts(all_entities, n_prompts, rng):
+    """(prompt, expected commands) for devices sampled from a build_home home; None if ambiguous."""
+    phrasings = {
+        "light": [("turn on the {name}", "turn_on", None), ("switch the {name} off", "turn_off", None),
+                  ("set the {name} to {pct}%", "turn_on", "pct")],
+        "switch": [("turn off the {name}", "turn_off", None), ("please turn the {name} on", "turn_on", None)],
+        "fan": [("turn on the {name}", "turn_on", None)],
+        "cover": [("close the {name}", "close_cover", None), ("open my {name}", "open_cover", None)],
+        "lock": [("lock the {name}", "lock", None), ("unlock the {name}", "unlock", None)],
+    }
+    devices = [(eid, name) for eid, name in all_entities.items() if eid.split(".")[0] in phrasings]
+    cases = []
+    for entity_id, name in rng.sample(devices, min(n_prompts, len(devices))):
+        domain = entity_id.split(".")[0]
+        template, service, param = rng.choice(phrasings[domain])
+        pct = rng.randrange(5, 100, 5)
+        command = {"action": "execute_task", "service": f"{domain}.{service}", "entity_id": entity_id}
+        if param:
+            command["parameters"] = {"brightness_pct": pct}
+        if rng.random() < 1 / 3:
+            # "Kitchen Lamp 12" without its number names every kitchen lamp.
+            cases.append((template.format(name=name.lower().rsplit(" ", 1)[0], pct=pct), None))
+        else:
+            cases.append((template.format(name=name.lower(), pct=pct), [command]))
+    return cases
+
+
+def evaluate(router, index, cases):
+    routed = wrong = 0
+    for prompt, expected in cases:
+        commands = router.route(prompt, index)
+        if commands is None:
+            continue
+        routed += 1
+        if commands != expected:
+            wrong += 1
+            print(f"  wrong route at margin {router.min_margin}: {prompt!r} -> {commands}, expected {expected}")
+    return routed, wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entities", type=int, default=10000)
+    parser.add_argument("--prompts", type=int, default=300)
+    parser.add_argument("--margins", default="0,1,2,3,4,6,8")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    dataset = [(prompt, label(commands)) for prompt, commands in load_finetuning_data(FINETUNING_DATA)]
+    dataset += [(prompt, None) for prompt in LLM_PROMPTS]
+    dataset_index = EntityIndex(DATASET_HOME, "dataset")
+
+    big_home, _ = build_home(args.entities, args.seed)
+    big_index = EntityIndex(big_home, "synthetic")
+    synthetic = synthetic_prompts(big_home, args.prompts, rng)
+    synthetic += [(prompt, None) for prompt in LLM_PROMPTS]
+
+    suites = [("finetuning_data", dataset_index, dataset), (f"synthetic ({args.entities})", big_index, synthetic)]
+    failures = 0
+    for name, index, cases in suites:
+        routable = sum(1 for _, expected in cases if expected is not None)
+        print(f"\n{name}: {len(cases)} prompts, {routable} of them plain device commands")
+        print(f"{'margin':>8}{'routed':>8}{'coverage':>10}{'wrong':>7}")
+        for margin in (int(m) for m in args.margins.split(",")):
+            routed, wrong = evaluate(IntentRouter(min_margin=margin), index, cases)
+            default = "  <- default" if margin == ROUTER_MIN_MARGIN else ""
+            print(f"{margin:>8}{routed:>8}{(routed - wrong) / routable:>10.0%}{wrong:>7}{default}")
+            if margin == ROUTER_MIN_MARGIN and wrong:
+                failures += 1
+
+    router = IntentRouter()
+    prompts = [prompt for prompt, _ in synthetic]
+    timings = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        router.route(prompt, big_index)
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    print(f"\nroute() on {args.entities} entities: median {statistics.median(timings):.0f} us, "
+          f"p95 {timings[int(len(timings) * 0.95)]:.0f} us")
+    print(f"router stats: {router.stats()}")
+
+    print("no wrong routes at the default margin" if not failures else f"{failures} suite(s) with wrong routes")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
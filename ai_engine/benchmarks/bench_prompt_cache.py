@@ -0,0 +1,159 @@
+# ai_engine/benchmarks/bench_prompt_cache.py
+"""
+Measures prompt-eval time per tool-selection request with the old prompt layout
+and with the fixed system prefix, against a stub Ollama that caches prefixes.
+
+Like Ollama's runner, the stub keeps the tokens of the last prompt it evaluated
+in each of `--parallel` slots, serves a request from the slot sharing the
+longest prefix with it and only evaluates (and charges `--prompt-eval-tps` for)
+the tokens after that prefix. The old layout put memories and devices between
+the persona and the actions/examples, so only the persona was reused; the new
+one sends persona, actions and examples as a fixed system prompt ahead of the
+request. Requests go through `call_ollama`, with pruned device context as in
+production and memories that differ per prompt.
+
+    python benchmarks/bench_prompt_cache.py --entities 2000 --requests 30
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_prompt_context import build_home, PROMPTS
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    """Plays /api/generate with per-slot prefix caching; the reply is always []."""
+    protocol_version = "HTTP/1.1"
+    prompt_eval_tps = 2000.0
+    slots = [[]]
+    lock = threading.Lock()
+    keep_alive = set()
+    evaluated = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        # A chat-style template: the system prompt, if any, is rendered first.
+        text = f"<|system|>{body['system']}<|end|>" if body.get("system") else ""
+        tokens = TOKEN.findall(text + f"<|user|>{body['prompt']}<|end|><|assistant|>")
+        with self.lock:
+            StubOllama.keep_alive.add(body.get("keep_alive"))
+            best, reused = 0, -1
+            for i, cached in enumerate(self.slots):
+                common = 0
+                for a, b in zip(cached, tokens):
+                    if a != b:
+                        break
+                    common += 1
+                if common > reused:
+                    best, reused = i, common
+            self.slots[best] = tokens
+            evaluated = len(tokens) - reused
+            StubOllama.evaluated += evaluated
+        duration = evaluated / self.prompt_eval_tps
+        time.sleep(duration)
+        payload = json.dumps({
+            "response": "[]", "done": True, "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(duration * 1e9), "eval_count": 2,
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def legacy_prompt(prompts, prompt_text, entities, areas, memories, history):
+    """The tool-selection prompt as laid out before the system prefix: context ahead of the actions."""
+    persona, rest = prompts.TOOL_SYSTEM_PROMPT.split("\n\n", 1)
+    return (
+        f"{persona}\n\n"
+        "## CONTEXT ##\n"
+        f"1.  **Relevant Memories:**\n{memories}\n"
+        f"2.  **Available Devices:**\n{entities}\n"
+        f"3.  **Available Areas:**\n{areas}\n"
+        f"4.  **Conversation So Far:**\n{history}\n\n"
+        f"{rest}"
+        "## YOUR TASK ##\n"
+        f"User's Request: \"{prompt_text}\"\n"
+        "JSON Output:\n"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entities", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--prompt-eval-tps", type=float, default=2000.0, help="prompt tokens the stub evaluates per second")
+    parser.add_argument("--parallel", type=int, default=1, help="cache slots (OLLAMA_NUM_PARALLEL)")
+    args = parser.parse_args()
+
+    StubOllama.prompt_eval_tps = args.prompt_eval_tps
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OLLAMA_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    from lib import ollama_helpers, prompts
+    from lib.ollama_helpers import call_ollama
+    from lib.context_selection import select_prompt_context
+    ollama_helpers.OLLAMA_URL = os.environ["OLLAMA_URL"]
+
+    all_entities, area_data = build_home(args.entities)
+    requests = []
+    for i in range(args.requests):
+        prompt_text = PROMPTS[i % len(PROMPTS)]
+        entities, areas = select_prompt_context(prompt_text, all_entities, area_data)
+        memories = f"- The user asked about item {i} yesterday." if i % 3 else "No relevant memories found."
+        requests.append((prompt_text, entities, areas, memories, "No earlier conversation."))
+
+    layouts = {
+        "old layout (inline)": lambda r: (None, legacy_prompt(prompts, *r)),
+        "system prefix": lambda r: (prompts.TOOL_SYSTEM_PROMPT, prompts.TOOL_REQUEST_TEMPLATE.format(
+            prompt=r[0], entities=r[1], areas=r[2], memories=r[3], history=r[4])),
+        "prefix inline": lambda r: (None, prompts.TOOL_SYSTEM_PROMPT + prompts.TOOL_REQUEST_TEMPLATE.format(
+            prompt=r[0], entities=r[1], areas=r[2], memories=r[3], history=r[4])),
+    }
+
+    print(f"{args.requests} requests, {args.entities} entities (pruned context), stub evaluates "
+          f"{args.prompt_eval_tps:.0f} prompt tokens/s, {args.parallel} slot(s)\n")
+    print(f"{'layout':<22}{'tokens/req':>12}{'evaluated/req':>15}{'call ms p50':>13}{'call ms p95':>13}{'total s':>9}")
+    results = {}
+    for name, build in layouts.items():
+        StubOllama.slots = [[] for _ in range(args.parallel)]
+        evals, sizes = [], []
+        StubOllama.evaluated = 0
+        for request in requests:
+            system, prompt = build(request)
+            sizes.append(len(TOKEN.findall((system or "") + prompt)))
+            start = time.perf_counter()
+            call_ollama(prompt, "stub", system=system)
+            evals.append((time.perf_counter() - start) * 1000)
+        evaluated = StubOllama.evaluated
+        evals.sort()
+        results[name] = statistics.median(evals)
+        print(f"{name:<22}{statistics.mean(sizes):>12.0f}{evaluated / len(requests):>15.0f}"
+              f"{statistics.median(evals):>13.1f}{evals[int(len(evals) * 0.95)]:>13.1f}{sum(evals) / 1000:>9.2f}")
+
+    print(f"\nkeep_alive sent: {sorted(k for k in StubOllama.keep_alive if k)}")
+    speedup = results["old layout (inline)"] / results["system prefix"]
+    print(f"median call time {speedup:.1f}x lower with the system prefix")
+    server.shutdown()
+    sys.exit(0 if speedup > 1 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# ai_engine/benchmarks/bench_prompt_context.py
+"""
+Compares the tool-selection prompt built from the full entity/area dump with the
+pruned context from `select_prompt_context`, on a synthetic 2,000-entity home.
+
+Reports prompt size and end-to-end latency per prompt. Latency is measured
+against a real Ollama when --ollama-url is given; otherwise it is estimated from
+the prompt-eval and generation rates (defaults are typical for an 8B model on an
+RTX 3060).
+
+    python benchmarks/bench_prompt_context.py
+    python benchmarks/bench_prompt_context.py --ollama-url http://localhost:11434 --model llama3
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib.prompts import PROMPT_TEMPLATE
+from lib.context_selection import select_prompt_context, estimate_tokens
+
+AREAS = [
+    "Kitchen", "Living Room", "Master Bedroom", "Guest Bedroom", "Office", "Garage",
+    "Basement", "Dining Room", "Laundry Room", "Hallway", "Front Porch", "Back Yard",
+    "Nursery", "Attic", "Bathroom", "Master Bathroom", "Den", "Mud Room", "Patio", "Gym",
+]
+DEVICES = [
+    ("light", ["Ceiling", "Floor Lamp", "Lamp", "Pendant", "Strip", "Sconce"]),
+    ("switch", ["Outlet", "Plug", "Power"]),
+    ("fan", ["Ceiling Fan", "Fan"]),
+    ("sensor", ["Temperature", "Humidity", "Power", "Battery", "Illuminance"]),
+    ("binary_sensor", ["Motion", "Door", "Window", "Occupancy"]),
+    ("cover", ["Blinds", "Shade"]),
+    ("lock", ["Lock"]),
+]
+PROMPTS = [
+    "Turn on the kitchen lights",
+    "Set the master bedroom ceiling light to 40%",
+    "Turn off the garage outlet",
+    "What is the temperature in the office?",
+    "Close the living room blinds and turn off the floor lamp",
+    "Who was the first president of the United States?",
+]
+
+
+def build_home(n_entities, seed=0):
+    rng = random.Random(seed)
+    all_entities = {}
+    area_data = {}
+    i = 0
+    while len(all_entities) < n_entities:
+        area = AREAS[i % len(AREAS)]
+        domain, names = DEVICES[rng.randrange(len(DEVICES))]
+        name = f"{area} {rng.choice(names)} {i // len(AREAS) + 1}"
+        entity_id = f"{domain}.{name.lower().replace(' ', '_')}"
+        all_entities[entity_id] = name
+        area_data.setdefault(area, []).append({"entity_id": entity_id, "friendly_name": name})
+        i += 1
+    return all_entities, area_data
+
+
+def build_full_prompt(prompt_text, all_entities, area_data):
+    return PROMPT_TEMPLATE.format(
+        prompt=prompt_text,
+        entities=json.dumps(all_entities, indent=2),
+        areas=json.dumps(area_data, indent=2),
+        memories="No relevant memories found.",
+        history="No earlier conversation.",
+    )
+
+
+def build_pruned_prompt(prompt_text, all_entities, area_data, max_entities, token_budget):
+    entities_str, areas_str = select_prompt_context(
+        prompt_text, all_entities, area_data, max_entities=max_entities, token_budget=token_budget
+    )
+    return PROMPT_TEMPLATE.format(
+        prompt=prompt_text, entities=entities_str, areas=areas_str, memories="No relevant memories found.",
+        history="No earlier conversation.",
+    )
+
+
+def run_llm(prompt, args):
+    """Returns the end-to-end LLM latency in seconds (measured or estimated)."""
+    if args.ollama_url:
+        import requests
+        start = time.perf_counter()
+        response = requests.post(
+            f"{args.ollama_url}/api/generate",
+            json={"model": args.model, "prompt": prompt, "stream": False},
+            timeout=600,
+        )
+        response.raise_for_status()
+        return time.perf_counter() - start
+    return estimate_tokens(prompt) / args.prompt_eval_tps + args.output_tokens / args.eval_tps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entities", type=int, default=2000)
+    parser.add_argument("--max-entities", type=int, default=40)
+    parser.add_argument("--token-budget", type=int, default=1500)
+    parser.add_argument("--ollama-url", default=None)
+    parser.add_argument("--model", default="llama3")
+    parser.add_argument("--prompt-eval-tps", type=float, default=1500.0)
+    parser.add_argument("--eval-tps", type=float, default=45.0)
+    parser.add_argument("--output-tokens", type=int, default=60)
+    args = parser.parse_args()
+
+    all_entities, area_data = build_home(args.entities)
+    print(f"Synthetic home: {len(all_entities)} entities in {len(area_data)} areas\n")
+    print(f"{'mode':<8}{'prompt':<60}{'chars':>9}{'~tokens':>9}{'build ms':>10}{'llm s':>9}")
+
+    totals = {"full": [], "pruned": []}
+    for prompt_text in PROMPTS:
+        for mode in ("full", "pruned"):
+            start = time.perf_counter()
+            if mode == "full":
+                prompt = build_full_prompt(prompt_text, all_entities, area_data)
+            else:
+                prompt = build_pruned_prompt(
+                    prompt_text, all_entities, area_data, args.max_entities, args.token_budget
+                )
+            build_ms = (time.perf_counter() - start) * 1000
+            llm_s = run_llm(prompt, args)
+            totals[mode].append((len(prompt), estimate_tokens(prompt), build_ms / 1000 + llm_s))
+            print(f"{mode:<8}{prompt_text[:58]:<60}{len(prompt):>9}{estimate_tokens(prompt):>9}{build_ms:>10.2f}{llm_s:>9.2f}")
+
+    print()
+    for mode, rows in totals.items():
+        print(
+            f"{mode:<8} mean chars {statistics.mean(r[0] for r in rows):>9.0f}  "
+            f"mean tokens {statistics.mean(r[1] for r in rows):>7.0f}  "
+            f"mean end-to-end {statistics.mean(r[2] for r in rows):>6.2f}s"
+            + ("" if args.ollama_url else " (estimated)")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# ai_engine/benchmarks/bench_service_batching.py
+"""
+Counts Home Assistant service calls and wall time for a multi-device plan,
+executed one call per command versus coalesced by `plan_service_calls`.
+
+Runs against a local fake HA server that adds a fixed latency to every service
+call, so no real Home Assistant is touched.
+
+    python benchmarks/bench_service_batching.py --lights 8 --latency-ms 80
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class FakeHomeAssistant(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.05
+    calls = []
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.lock:
+            self.calls.append((self.path, body))
+        time.sleep(self.latency)
+        payload = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lights", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--port", type=int, default=18124)
+    args = parser.parse_args()
+
+    FakeHomeAssistant.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeHomeAssistant)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # ha_helpers reads its configuration at import time.
+    os.environ["HA_API_URL"] = f"http://127.0.0.1:{args.port}/api"
+    os.environ["HA_API_TOKEN"] = "benchmark"
+    from lib.ha_helpers import call_homeassistant_api
+    from lib.command_executor import run_concurrently
+    from lib.service_batching import plan_service_calls, execute_batch
+
+    # A scene: N lights on at 40%, a fan on, and two covers closed.
+    tasks = [
+        {"service": "light.turn_on", "parameters": {"brightness_pct": 40}, "entity_ids": [f"light.scene_{i}"]}
+        for i in range(args.lights)
+    ]
+    tasks.append({"service": "fan.turn_on", "parameters": None, "entity_ids": ["fan.bedroom"]})
+    tasks += [
+        {"service": "cover.close_cover", "parameters": None, "entity_ids": [f"cover.blind_{i}"]} for i in range(2)
+    ]
+
+    def sequential():
+        for task in tasks:
+            call_homeassistant_api(task["service"], task["entity_ids"], task["parameters"])
+
+    def concurrent():
+        run_concurrently(
+            lambda task: call_homeassistant_api(task["service"], task["entity_ids"], task["parameters"]), tasks
+        )
+
+    def batched():
+        run_concurrently(execute_batch, plan_service_calls(tasks))
+
+    print(f"{len(tasks)} commands, {args.latency_ms:.0f} ms per HA call\n")
+    print(f"{'mode':<22}{'HA calls':>10}{'wall ms':>10}")
+    for name, fn in (("one call per command", sequential), ("concurrent", concurrent), ("batched", batched)):
+        FakeHomeAssistant.calls.clear()
+        start = time.perf_counter()
+        fn()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"{name:<22}{len(FakeHomeAssistant.calls):>10}{elapsed_ms:>10.1f}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# ai_engine/lib/area_registry.py
+
+# Registry name -> HA websocket command listing it and event announcing changes to it.
+REGISTRIES = {
+    "area": ("config/area_registry/list", "area_registry_updated"),
+    "device": ("config/device_registry/list", "device_registry_updated"),
+    "entity": ("config/entity_registry/list", "entity_registry_updated"),
+}
+
+
+class AreaRegistry:
+    """
+    In-memory copy of Home Assistant's area, device and entity registries,
+    answering "which area is this entity in" the way HA's `area_name()` does: the
+    entity's own area, otherwise its device's area.
+
+    `build_area_data` produces the same {area name: [{"entity_id", "friendly_name"}]}
+    mapping as the `get_ha_area_data` template, in one pass over the entities.
+    Not thread-safe by itself; HAStateMirror guards it with its lock.
+    """
+
+    def __init__(self):
+        self.area_names = {}      # area_id -> name
+        self.device_areas = {}    # device_id -> area_id
+        self.entity_links = {}    # entity_id -> (area_id, device_id)
+        self.loaded = set()
+        # Bumped on every load, so derived area data knows when to rebuild.
+        self.version = 0
+
+    def is_ready(self):
+        return self.loaded == set(REGISTRIES)
+
+    def load(self, registry, items):
+        """Replaces one registry with the result of its `config/<registry>_registry/list` command."""
+        if registry == "area":
+            self.area_names = {a["area_id"]: a.get("name") or a["area_id"] for a in items}
+        elif registry == "device":
+            self.device_areas = {d["id"]: d.get("area_id") for d in items}
+        elif registry == "entity":
+            self.entity_links = {e["entity_id"]: (e.get("area_id"), e.get("device_id")) for e in items}
+        else:
+            raise ValueError(f"Unknown registry '{registry}'.")
+        self.loaded.add(registry)
+        self.version += 1
+
+    def area_of(self, entity_id):
+        """Returns the area name of `entity_id`, or None."""
+        area_id, device_id = self.entity_links.get(entity_id, (None, None))
+        if not area_id and device_id:
+            area_id = self.device_areas.get(device_id)
+        return self.area_names.get(area_id) if area_id else None
+
+    def build_area_data(self, entities):
+        """Groups `entities` (entity_id -> friendly_name) by area name, in entity_id order like HA's `states`."""
+        area_data = {}
+        for entity_id, friendly_name in sorted(entities.items()):
+            area = self.area_of(entity_id)
+            if area:
+                area_data.setdefault(area, []).append({"entity_id": entity_id, "friendly_name": friendly_name})
+        return area_data
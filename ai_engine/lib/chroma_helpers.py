@@ -1,43 +1,216 @@
 # ai_engine/lib/chroma_helpers.py
+import os
+import logging
+import re
 import time
+import uuid
+import asyncio
+import threading
+import concurrent.futures
 import chromadb
 
-def store_memory(memory_collection, text):
-    """Stores a piece of text in the ChromaDB long-term memory."""
+from lib.metrics import MEMORY_RETRIEVALS
+from lib.logging_setup import log_payload
+
+logger = logging.getLogger(__name__)
+
+MEMORY_COLLECTION = "long_term_memory"
+MIGRATION_BATCH_SIZE = 64
+# Memories further than this cosine distance from the prompt are left out of it.
+MEMORY_MAX_DISTANCE = float(os.environ.get("MEMORY_MAX_DISTANCE", "0.5"))
+# How long a prompt waits for memory retrieval before going ahead without memories.
+MEMORY_RETRIEVAL_TIMEOUT_MS = float(os.environ.get("MEMORY_RETRIEVAL_TIMEOUT_MS", "300"))
+NO_MEMORIES = "No relevant memories found."
+
+def memory_collection_name(embed_model=None):
+    """
+    Collection holding memories embedded with `embed_model`. Vectors of different
+    models have different dimensions, so each model gets its own collection; no
+    model means ChromaDB's server-side default, in the original collection.
+    """
+    if not embed_model:
+        return MEMORY_COLLECTION
+    return f"{MEMORY_COLLECTION}_{re.sub(r'[^A-Za-z0-9_-]', '_', embed_model)}"[:63].rstrip("_-")
+
+def new_memory_id():
+    """Memory ids are unique across concurrent writers, unlike the old second-resolution timestamps."""
+    return f"memory_{time.time_ns()}_{uuid.uuid4().hex[:8]}"
+
+def migrate_memories(chroma_client, memory_collection, embedder):
+    """
+    Copies the memories of the server-embedded collection into `memory_collection`,
+    re-embedded with `embedder`, if the latter is still empty. Ids are kept, so a
+    migration interrupted half way can simply run again.
+    """
+    if memory_collection.count():
+        return 0
+    try:
+        legacy = chroma_client.get_collection(name=MEMORY_COLLECTION)
+    except Exception:
+        return 0
+    migrated = 0
+    total = legacy.count()
+    for offset in range(0, total, MIGRATION_BATCH_SIZE):
+        batch = legacy.get(offset=offset, limit=MIGRATION_BATCH_SIZE, include=["documents"])
+        embeddings = embedder.embed(batch["documents"])
+        if embeddings is None:
+            logger.warning(f"Stopped migrating memories after {migrated} of {total}; embedding failed.")
+            return migrated
+        memory_collection.upsert(ids=batch["ids"], documents=batch["documents"], embeddings=embeddings)
+        migrated += len(batch["ids"])
+    if migrated:
+        logger.info(f"Migrated {migrated} memories to '{memory_collection.name}'.")
+    return migrated
+
+def store_memory(memory_collection, text, embedder=None):
+    """Stores a piece of text in the ChromaDB long-term memory, embedded with `embedder` if given."""
     if not memory_collection:
-        print("Cannot store memory, ChromaDB client not available.")
+        logger.warning("Cannot store memory, ChromaDB client not available.")
         return "Memory is not available."
     try:
-        # We use the text itself as the document and a timestamped ID.
-        doc_id = f"memory_{int(time.time())}"
-        memory_collection.add(
-            documents=[text],
-            ids=[doc_id]
-        )
-        print(f"Successfully stored memory: '{text}'")
+        doc_id = new_memory_id()
+        if embedder is not None:
+            embedding = embedder.embed_one(text)
+            if embedding is None:
+                raise RuntimeError("could not embed the memory")
+            memory_collection.add(documents=[text], ids=[doc_id], embeddings=[embedding])
+        else:
+            memory_collection.add(
+                documents=[text],
+                ids=[doc_id]
+            )
+        logger.info(f"Stored memory '{doc_id}'.")
+        log_payload(logger, "memory", "Stored memory", text)
         return f"Okay, I've remembered that: {text}"
     except Exception as e:
-        print(f"Error storing memory in ChromaDB: {e}")
+        logger.error(f"Error storing memory in ChromaDB: {e}")
         return "I had trouble remembering that."
 
-def retrieve_memories(memory_collection, text, n_results=3):
-    """Retrieves the most relevant memories from ChromaDB."""
+class MemoryStats:
+    """
+    Counts how memory retrieval ended for each prompt in this process:
+    used (memories went into the prompt), no_match (nothing within
+    MEMORY_MAX_DISTANCE), timeout, error, unavailable (no ChromaDB) and skipped
+    (the plan came from the cache, so memories were not needed).
+    """
+
+    OUTCOMES = ("used", "no_match", "timeout", "error", "unavailable", "skipped")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(self.OUTCOMES, 0)
+        self.total_ms = 0.0
+        self.timed = 0
+
+    def record(self, outcome, elapsed_ms=None):
+        MEMORY_RETRIEVALS.labels(outcome).inc()
+        with self._lock:
+            self.counts[outcome] += 1
+            if elapsed_ms is not None:
+                self.total_ms += elapsed_ms
+                self.timed += 1
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                **self.counts,
+                "used_rate": round(self.counts["used"] / total, 4) if total else 0.0,
+                "avg_wait_ms": round(self.total_ms / self.timed, 1) if self.timed else 0.0,
+                "max_distance": MEMORY_MAX_DISTANCE,
+                "timeout_ms": MEMORY_RETRIEVAL_TIMEOUT_MS,
+            }
+
+memory_stats = MemoryStats()
+
+def query_memories(memory_collection, text, n_results=3, embedder=None, max_distance=MEMORY_MAX_DISTANCE):
+    """
+    Looks up the memories relevant to `text`. Returns (outcome, memories), where
+    outcome is one of MemoryStats.OUTCOMES and memories the text for the prompt.
+    With an `embedder`, the query is embedded locally (cached and batched)
+    instead of by the server.
+    """
+    if not memory_collection:
+        return "unavailable", "No memories found."
+    try:
+        if embedder is not None:
+            embedding = embedder.embed_one(text)
+            if embedding is None:
+                return "error", "I had trouble accessing my memory."
+            results = memory_collection.query(
+                query_embeddings=[embedding], n_results=n_results, include=["documents", "distances"]
+            )
+        else:
+            results = memory_collection.query(
+                query_texts=[text],
+                n_results=n_results,
+                include=["documents", "distances"]
+            )
+        return _format_memories(text, results, max_distance)
+    except Exception as e:
+        logger.error(f"Error retrieving memories from ChromaDB: {e}")
+        return "error", "I had trouble accessing my memory."
+
+async def query_memories_async(memory_collection, text, n_results=3, embedder=None, max_distance=MEMORY_MAX_DISTANCE):
+    """Async version of `query_memories`, for a collection from `chromadb.AsyncHttpClient`."""
     if not memory_collection:
-        print("Cannot retrieve memories, ChromaDB client not available.")
-        return "No memories found."
+        return "unavailable", "No memories found."
     try:
-        results = memory_collection.query(
-            query_texts=[text],
-            n_results=n_results
-        )
-        documents = results.get('documents')
-        if documents and documents[0]:
-            # Return a formatted string of the top results.
-            retrieved = "\n".join([f"- {doc}" for doc in documents[0]])
-            print(f"Retrieved memories for prompt '{text}':\n{retrieved}")
-            return retrieved
+        if embedder is not None:
+            embeddings = await embedder.embed_async([text])
+            if embeddings is None:
+                return "error", "I had trouble accessing my memory."
+            results = await memory_collection.query(
+                query_embeddings=embeddings, n_results=n_results, include=["documents", "distances"]
+            )
         else:
-            return "No relevant memories found."
+            results = await memory_collection.query(
+                query_texts=[text],
+                n_results=n_results,
+                include=["documents", "distances"]
+            )
+        return _format_memories(text, results, max_distance)
     except Exception as e:
-        print(f"Error retrieving memories from ChromaDB: {e}")
-        return "I had trouble accessing my memory."
+        logger.error(f"Error retrieving memories from ChromaDB: {e}")
+        return "error", "I had trouble accessing my memory."
+
+def wait_for_memories(future, started, timeout_ms=MEMORY_RETRIEVAL_TIMEOUT_MS):
+    """
+    Waits for a `query_memories` future submitted at `started` (time.perf_counter)
+    until the retrieval deadline, records the outcome and returns the memories,
+    or NO_MEMORIES if the deadline passed.
+    """
+    remaining = timeout_ms / 1000 - (time.perf_counter() - started)
+    try:
+        outcome, memories = future.result(timeout=max(remaining, 0))
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        logger.warning(f"Memory retrieval exceeded {timeout_ms:.0f} ms; continuing without memories.")
+        outcome, memories = "timeout", NO_MEMORIES
+    memory_stats.record(outcome, (time.perf_counter() - started) * 1000)
+    return memories
+
+async def wait_for_memories_async(task, started, timeout_ms=MEMORY_RETRIEVAL_TIMEOUT_MS):
+    """Async version of `wait_for_memories` for a `query_memories_async` task."""
+    remaining = timeout_ms / 1000 - (time.perf_counter() - started)
+    try:
+        outcome, memories = await asyncio.wait_for(task, timeout=max(remaining, 0))
+    except asyncio.TimeoutError:
+        logger.warning(f"Memory retrieval exceeded {timeout_ms:.0f} ms; continuing without memories.")
+        outcome, memories = "timeout", NO_MEMORIES
+    memory_stats.record(outcome, (time.perf_counter() - started) * 1000)
+    return memories
+
+def _format_memories(text, results, max_distance=MEMORY_MAX_DISTANCE):
+    documents = (results.get('documents') or [[]])[0]
+    distances = (results.get('distances') or [[]])[0] or [0.0] * len(documents)
+    relevant = [doc for doc, distance in zip(documents, distances) if distance <= max_distance]
+    if not relevant:
+        if documents:
+            logger.debug(f"No memory within distance {max_distance} of the prompt (closest {min(distances):.3f}).")
+        return "no_match", NO_MEMORIES
+    # Return a formatted string of the top results.
+    retrieved = "\n".join([f"- {doc}" for doc in relevant])
+    logger.info(f"Retrieved {len(relevant)} relevant memories.")
+    log_payload(logger, "memory", "Retrieved memories", retrieved)
+    return "used", retrieved
@@ -0,0 +1,42 @@
+# ai_engine/lib/command_executor.py
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Threads shared by all requests in this process, and how many of them a single
+# request may occupy at once.
+COMMAND_POOL_SIZE = int(os.environ.get("COMMAND_POOL_SIZE", "16"))
+COMMAND_MAX_CONCURRENCY = int(os.environ.get("COMMAND_MAX_CONCURRENCY", "5"))
+
+_executor = ThreadPoolExecutor(max_workers=COMMAND_POOL_SIZE, thread_name_prefix="command")
+
+
+def submit(fn, *args):
+    """Starts `fn(*args)` on the shared pool and returns its Future."""
+    # Carry the caller's context (request id for logging) into the pool thread.
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def run_concurrently(fn, items, max_concurrency=None):
+    """
+    Calls `fn(item)` for every item on the shared pool, with at most
+    `max_concurrency` calls of this batch in flight. Results are returned in the
+    order of `items`, regardless of completion order. Exceptions raised by `fn`
+    propagate, so `fn` should handle its own errors.
+    """
+    items = list(items)
+    max_concurrency = max(1, max_concurrency or COMMAND_MAX_CONCURRENCY)
+    if len(items) <= 1 or max_concurrency == 1:
+        return [fn(item) for item in items]
+
+    results = [None] * len(items)
+    pending = {}
+    next_index = 0
+    while next_index < len(items) or pending:
+        while next_index < len(items) and len(pending) < max_concurrency:
+            pending[submit(fn, items[next_index])] = next_index
+            next_index += 1
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            results[pending.pop(future)] = future.result()
+    return results
@@ -0,0 +1,152 @@
+# ai_engine/lib/command_parsing.py
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# What the tool-selection call asks Ollama for: "schema" constrains generation
+# to COMMAND_SCHEMA (Ollama 0.5+), "json" only to valid JSON, "none" leaves the
+# model free, as before.
+TOOL_OUTPUT_FORMAT = os.environ.get("TOOL_OUTPUT_FORMAT", "schema").lower()
+
+# One schema per action `AIEngine` can run; keep in step with _execute_command.
+ACTION_SCHEMAS = {
+    "execute_task": {
+        "type": "object",
+        "properties": {
+            "action": {"enum": ["execute_task"]},
+            "service": {"type": "string"},
+            "entity_id": {"type": "string"},
+            "parameters": {"type": "object"},
+        },
+        "required": ["action", "service", "entity_id"],
+    },
+    "web_search": {
+        "type": "object",
+        "properties": {
+            "action": {"enum": ["web_search"]},
+            "query": {"type": "string"},
+        },
+        "required": ["action", "query"],
+    },
+    "calculator": {
+        "type": "object",
+        "properties": {
+            "action": {"enum": ["calculator"]},
+            "expression": {"type": "string"},
+        },
+        "required": ["action", "expression"],
+    },
+}
+# Always an array, so a plan streams one command at a time; [] means no action applies.
+COMMAND_SCHEMA = {"type": "array", "items": {"anyOf": list(ACTION_SCHEMAS.values())}}
+
+
+def tool_output_format():
+    """The `format` to send with the tool-selection call, or None."""
+    if TOOL_OUTPUT_FORMAT == "schema":
+        return COMMAND_SCHEMA
+    if TOOL_OUTPUT_FORMAT == "json":
+        return "json"
+    return None
+
+
+class IncrementalCommandParser:
+    """
+    Parses the commands out of an LLM reply as it streams in, in a single pass.
+
+    `feed` takes the next piece of text and returns the commands completed by it:
+    each element of a top-level JSON array as soon as its closing brace arrives,
+    or a lone top-level object once it closes. Text before the JSON (prose, a
+    ```json fence) and everything after it is ignored, so trailing prose no
+    longer loses the plan. Brackets in the prose that do not parse are skipped.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.commands = []
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._top = None
+        self._top_start = None
+        self._element_start = None
+        self._element_count = 0
+
+    def feed(self, chunk):
+        self.text += chunk
+        found = []
+        text = self.text
+        while self._pos < len(text) and not self.done:
+            i = self._pos
+            ch = text[i]
+            self._pos += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                # Quotes in the prose around the JSON are not strings.
+                self._in_string = self._depth > 0
+            elif ch in "[{":
+                if self._depth == 0:
+                    self._top, self._top_start = ch, i
+                elif self._depth == 1 and self._top == "[":
+                    self._element_start = i
+                self._depth += 1
+            elif ch in "]}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 1 and self._top == "[" and self._element_start is not None:
+                    command = self._load(text[self._element_start:i + 1])
+                    self._element_start = None
+                    if isinstance(command, dict):
+                        found.append(command)
+                        self._element_count += 1
+                elif self._depth == 0:
+                    found.extend(self._close_top(text[self._top_start:i + 1]))
+        self.commands.extend(found)
+        return found
+
+    def _close_top(self, value_text):
+        value = self._load(value_text)
+        if self._top == "[":
+            # Elements already returned stand even if the array around them is broken;
+            # an aside in the prose ("[1]") holds no commands and is skipped, while []
+            # is the schema's way of saying no action applies.
+            if self._element_count or value == []:
+                self.done = True
+                return []
+        elif isinstance(value, dict):
+            self.done = True
+            # A {"commands": [...]} wrapper, which "json" mode may produce for several commands.
+            if isinstance(value.get("commands"), list) and "action" not in value:
+                return [c for c in value["commands"] if isinstance(c, dict)]
+            return [value]
+        self._top = self._top_start = None
+        return []
+
+    @staticmethod
+    def _load(value_text):
+        try:
+            return json.loads(value_text)
+        except json.JSONDecodeError:
+            return None
+
+    def close(self):
+        """Returns every command parsed; [] if the reply held none."""
+        if not self.done and not self.commands and self.text.strip():
+            logger.debug("No complete JSON command found in the LLM reply.")
+        return list(self.commands)
+
+
+def parse_commands(text):
+    """Parses every command out of a complete LLM reply (see IncrementalCommandParser)."""
+    parser = IncrementalCommandParser()
+    parser.feed(text)
+    return parser.close()
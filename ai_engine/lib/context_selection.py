@@ -0,0 +1,91 @@
+# ai_engine/lib/context_selection.py
+import os
+
+from lib.utils import get_prompt_keywords, detect_domain, score_entity, score_area
+
+PROMPT_MAX_ENTITIES = int(os.environ.get("PROMPT_MAX_ENTITIES", "40"))
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "1500"))
+
+# Bonus for entities that belong to an area named in the prompt.
+AREA_MEMBERSHIP_BONUS = 8
+
+
+def estimate_tokens(text):
+    """Rough token count for budgeting (~4 characters per token for English/JSON)."""
+    return (len(text) + 3) // 4
+
+
+def rank_entities(prompt_text, all_entities, area_data, index=None):
+    """
+    Scores every entity against the prompt using the keyword scoring from
+    `find_best_matching_entity`, plus a bonus for members of the areas the
+    prompt mentions. With an EntityIndex, the scores come from its vectorized
+    keyword scoring instead of a per-entity loop.
+    Returns (ranked [(score, entity_id)], {entity_id: matched area}).
+    """
+    prompt_words = get_prompt_keywords(prompt_text)
+    if not prompt_words:
+        return [], {}
+
+    detected_domain = detect_domain(prompt_words)
+
+    matched_areas = [name for name in (area_data or {}) if score_area(prompt_words, name) > 0]
+    area_members = {}
+    for area_name in matched_areas:
+        for entity_info in area_data[area_name]:
+            area_members[entity_info.get("entity_id")] = area_name
+
+    ranked = []
+    if index is not None:
+        scores = index.keyword_scores(prompt_words, detected_domain)
+        for entity_id in area_members:
+            position = index.positions.get(entity_id)
+            if position is not None:
+                scores[position] += AREA_MEMBERSHIP_BONUS
+        for position in scores.nonzero()[0].tolist():
+            ranked.append((int(scores[position]), index.entity_ids[position]))
+    else:
+        for entity_id, friendly_name in all_entities.items():
+            score = score_entity(prompt_words, detected_domain, entity_id, friendly_name)
+            if entity_id in area_members:
+                score += AREA_MEMBERSHIP_BONUS
+            if score > 0:
+                ranked.append((score, entity_id))
+
+    # Highest score first; entity_id keeps the order stable between calls.
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+    return ranked, area_members
+
+
+def select_prompt_context(prompt_text, all_entities, area_data, max_entities=None, token_budget=None, index=None):
+    """
+    Builds the compact `entities` and `areas` sections for TOOL_REQUEST_TEMPLATE.
+
+    Only the top-ranked entities are listed, one `entity_id: friendly name` per
+    line, stopping at `max_entities` or when the combined sections would exceed
+    `token_budget`. Candidates in an area named by the prompt are tagged with
+    that area; the areas section just names every area so the model knows they
+    exist. Returns (entities_str, areas_str).
+    """
+    max_entities = PROMPT_MAX_ENTITIES if max_entities is None else max_entities
+    token_budget = PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    area_data = area_data or {}
+
+    ranked, area_members = rank_entities(prompt_text, all_entities, area_data, index)
+
+    areas_str = ", ".join(sorted(area_data)) if area_data else "No areas available."
+    used_tokens = estimate_tokens(areas_str)
+
+    entity_lines = []
+    for _, entity_id in ranked[:max_entities]:
+        line = f"{entity_id}: {all_entities[entity_id]}"
+        if entity_id in area_members:
+            line += f" (area: {area_members[entity_id]})"
+        line_tokens = estimate_tokens(line) + 1
+        if used_tokens + line_tokens > token_budget:
+            break
+        entity_lines.append(line)
+        used_tokens += line_tokens
+
+    entities_str = "\n".join(entity_lines) if entity_lines else "No devices matched this request."
+    return entities_str, areas_str
@@ -0,0 +1,225 @@
+# ai_engine/lib/conversation_memory.py
+import os
+import logging
+import re
+import json
+import time
+import threading
+
+from lib.context_selection import estimate_tokens
+from lib.shared_state import StateLockTimeout
+
+logger = logging.getLogger(__name__)
+
+SESSION_MAX_TURNS = int(os.environ.get("SESSION_MAX_TURNS", "10"))
+SESSION_MAX_TURN_CHARS = int(os.environ.get("SESSION_MAX_TURN_CHARS", "1000"))
+SESSION_IDLE_TTL = int(os.environ.get("SESSION_IDLE_TTL", "1800"))
+SESSION_MEMORY_CAP_BYTES = int(os.environ.get("SESSION_MEMORY_CAP_BYTES", str(4 * 1024 * 1024)))
+# How often a worker folds the sessions it has touched into the shared registry and
+# enforces SESSION_IDLE_TTL and SESSION_MEMORY_CAP_BYTES there.
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", "5"))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "300"))
+# The newest turns are quoted in full; older ones are cut down to one line.
+HISTORY_VERBATIM_TURNS = 4
+HISTORY_SUMMARY_CHARS = 80
+
+DEFAULT_SESSION = "default"
+SESSIONS_KEY = "sessions"
+
+# Prompts containing these lean on the conversation, so a plan cached for the
+# same words in another context must not be reused.
+FOLLOW_UP_WORDS = {
+    "it", "its", "that", "this", "them", "they", "those", "these", "again", "same", "too",
+    "also", "instead", "back", "other", "one", "more", "less",
+}
+
+_ROLES = {"user": "u", "assistant": "a"}
+_ROLE_NAMES = {"u": "User", "a": "Assistant"}
+
+
+def is_follow_up(prompt_text):
+    return any(word in FOLLOW_UP_WORDS for word in re.findall(r"[a-z']+", prompt_text.lower()))
+
+
+def _clip(text, limit):
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+class ConversationMemory:
+    """
+    Per-session conversation turns kept in the shared state store.
+
+    Each session is a ring buffer of its last `max_turns` turns, stored compactly
+    as [role, text] pairs with long texts clipped. Each session's last activity
+    and size sit in a key of its own, updated per turn without any shared lock.
+    Every `sweep_interval` seconds a worker folds the sessions it touched into
+    the session registry: sessions idle for longer than `idle_ttl` are evicted
+    there, and the least recently active ones go first whenever the total
+    exceeds `memory_cap` bytes. The cap can thus be overshot by a few seconds'
+    worth of turns.
+    """
+
+    def __init__(self, store, max_turns=SESSION_MAX_TURNS, idle_ttl=SESSION_IDLE_TTL,
+                 memory_cap=SESSION_MEMORY_CAP_BYTES, token_budget=HISTORY_TOKEN_BUDGET,
+                 sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.store = store
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.memory_cap = memory_cap
+        self.token_budget = token_budget
+        self.sweep_interval = sweep_interval
+        self._touched = {}
+        self._touched_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def _turns_key(session_id):
+        return f"conversation:{session_id}"
+
+    @staticmethod
+    def _context_key(session_id):
+        return f"last_entity_context:{session_id}"
+
+    @staticmethod
+    def _meta_key(session_id):
+        return f"conversation_meta:{session_id}"
+
+    def record(self, session_id, role, content):
+        """Appends a turn to the session's ring buffer."""
+        session_id = session_id or DEFAULT_SESSION
+        turn = [_ROLES.get(role, role), _clip(content, SESSION_MAX_TURN_CHARS)]
+        self.store.append(self._turns_key(session_id), turn, max_len=self.max_turns)
+        self._touch(session_id, len(json.dumps(turn)))
+
+    def get_turns(self, session_id):
+        """Returns the session's turns, oldest first, as (role, text) pairs."""
+        return [tuple(turn) for turn in self.store.get_list(self._turns_key(session_id or DEFAULT_SESSION))]
+
+    def set_last_entities(self, session_id, entity_ids):
+        self.store.set(
+            self._context_key(session_id or DEFAULT_SESSION),
+            {"entity_id": entity_ids, "timestamp": time.time()},
+            ttl=self.idle_ttl,
+        )
+
+    def get_last_entities(self, session_id):
+        context = self.store.get(self._context_key(session_id or DEFAULT_SESSION)) or {}
+        return context.get("entity_id") or []
+
+    def history_context(self, session_id, token_budget=None, skip_last=0):
+        """
+        Renders the session for a prompt within `token_budget` tokens: the newest
+        turns verbatim, older ones as one-line summaries, plus the devices last acted
+        on. `skip_last` leaves out the newest turns (e.g. the prompt being answered).
+        Returns "" for a new session.
+        """
+        token_budget = self.token_budget if token_budget is None else token_budget
+        turns = self.get_turns(session_id)
+        if skip_last:
+            turns = turns[:-skip_last]
+        last_entities = self.get_last_entities(session_id)
+        if not turns and not last_entities:
+            return ""
+
+        lines = []
+        used = 0
+        if last_entities:
+            line = "Devices last acted on: " + ", ".join(last_entities)
+            lines.append(line)
+            used += estimate_tokens(line)
+
+        recent, summarized = [], []
+        for age, (role, text) in enumerate(reversed(turns)):
+            name = _ROLE_NAMES.get(role, role)
+            line = f"{name}: {text}"
+            # Once a turn has to be summarized, every older one is too, keeping the order.
+            if summarized or age >= HISTORY_VERBATIM_TURNS or used + estimate_tokens(line) > token_budget:
+                line = f"- {name}: {_clip(text, HISTORY_SUMMARY_CHARS)}"
+                if used + estimate_tokens(line) > token_budget:
+                    break
+                summarized.append(line)
+            else:
+                recent.append(line)
+            used += estimate_tokens(line)
+
+        if summarized:
+            lines.append("Earlier (summarized):")
+            lines.extend(reversed(summarized))
+        if recent:
+            lines.append("Recent turns:")
+            lines.extend(reversed(recent))
+        return "\n".join(lines)
+
+    def _touch(self, session_id, turn_bytes):
+        now = time.time()
+        # Sizes are an upper bound: the ring buffer drops old turns without telling us.
+        max_session_bytes = self.max_turns * (SESSION_MAX_TURN_CHARS + 16)
+        meta_key = self._meta_key(session_id)
+        _, size = self.store.get(meta_key) or (now, 0)
+        size = min(size + turn_bytes, max_session_bytes)
+        self.store.set(meta_key, [now, size])
+        with self._touched_lock:
+            self._touched[session_id] = [now, size]
+            due = now - self._last_sweep >= self.sweep_interval
+            if due:
+                self._last_sweep = now
+        if due:
+            self.sweep(now)
+
+    def sweep(self, now=None):
+        """Folds the sessions touched since the last sweep into the registry and evicts idle and excess sessions."""
+        now = now or time.time()
+        with self._touched_lock:
+            touched, self._touched = self._touched, {}
+        try:
+            with self.store.lock(SESSIONS_KEY):
+                evicted = self._update_registry(touched, now)
+        except StateLockTimeout as e:
+            # Rather than rewrite the registry unlocked, keep the touches for the next sweep.
+            logger.warning(f"{e} Skipping this session sweep.")
+            with self._touched_lock:
+                for sid, entry in touched.items():
+                    self._touched.setdefault(sid, entry)
+            return
+        for sid in evicted:
+            self.store.delete(self._turns_key(sid))
+            self.store.delete(self._context_key(sid))
+            self.store.delete(self._meta_key(sid))
+        if evicted:
+            logger.debug(f"Evicted {len(evicted)} conversation session(s).")
+
+    def _update_registry(self, touched, now):
+        """Folds `touched` into the session registry and evicts; returns the evicted sessions. Runs under the lock."""
+        sessions = self.store.get(SESSIONS_KEY) or {}
+        for sid, entry in touched.items():
+            # Another worker may have seen a newer turn of the same session.
+            if sid not in sessions or sessions[sid][0] <= entry[0]:
+                sessions[sid] = entry
+        evicted = [sid for sid, (last_active, _) in sessions.items() if now - last_active > self.idle_ttl]
+        for sid in evicted:
+            del sessions[sid]
+        total = sum(size for _, size in sessions.values())
+        if total > self.memory_cap:
+            # Never the session that spoke last, even if it alone is over the cap.
+            newest = max(sessions, key=lambda sid: sessions[sid][0])
+            for sid, (_, sid_size) in sorted(sessions.items(), key=lambda item: item[1][0]):
+                if total <= self.memory_cap or sid == newest:
+                    continue
+                del sessions[sid]
+                evicted.append(sid)
+                total -= sid_size
+        self.store.set(SESSIONS_KEY, sessions)
+        return evicted
+
+    def stats(self):
+        self.sweep()
+        sessions = self.store.get(SESSIONS_KEY) or {}
+        return {
+            "sessions": len(sessions),
+            "bytes": sum(size for _, size in sessions.values()),
+            "memory_cap_bytes": self.memory_cap,
+            "max_turns": self.max_turns,
+            "idle_ttl": self.idle_ttl,
+            "sweep_interval": self.sweep_interval,
+        }
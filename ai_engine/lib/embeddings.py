@@ -0,0 +1,195 @@
+# ai_engine/lib/embeddings.py
+import os
+import logging
+import time
+import queue
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from lib.metrics import record_cache
+from lib.ollama_helpers import get_ollama_embeddings
+
+logger = logging.getLogger(__name__)
+
+# Model used to embed long-term memories and the prompts that search them. Empty
+# (the default) leaves embedding to ChromaDB's server-side default, as before. To
+# embed through Ollama instead (cached, batched), pull an embedding model and set
+# e.g. MEMORY_EMBED_MODEL=nomic-embed-text: memories go to a collection of their
+# own, and the existing ones are copied over, re-embedded, on first start.
+MEMORY_EMBED_MODEL = os.environ.get("MEMORY_EMBED_MODEL", "")
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", "1024"))
+# How long the first text of a batch waits for others to join it, and the batch size cap.
+EMBED_BATCH_WINDOW_MS = float(os.environ.get("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_MAX_BATCH = int(os.environ.get("EMBED_MAX_BATCH", "32"))
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads and hands them to `fn` in batches.
+
+    The first item of a batch waits up to `window` seconds for others to arrive
+    (at most `max_batch` in total), then a single dispatcher thread calls
+    `fn(items)`, which must return one result per item. `submit` returns a
+    Future; if `fn` raises, every Future of that batch gets the exception.
+    """
+
+    def __init__(self, fn, window=EMBED_BATCH_WINDOW_MS / 1000, max_batch=EMBED_MAX_BATCH, name="batcher"):
+        self.fn = fn
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.fn([item for item, _ in batch])
+                if results is None or len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: expected {len(batch)} results, got {results!r:.80}")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class EmbeddingService:
+    """
+    Embeds texts with an Ollama model, with an LRU cache keyed by the text's
+    SHA-256 and micro-batching: texts requested concurrently by different
+    threads (or the ASGI event loop) that miss the cache go to Ollama together
+    in one `/api/embed` call. Concurrent requests for the same uncached text
+    share a single in-flight embedding.
+    """
+
+    def __init__(self, model, cache_size=EMBED_CACHE_SIZE, window=EMBED_BATCH_WINDOW_MS / 1000,
+                 max_batch=EMBED_MAX_BATCH, embed_batch_fn=None):
+        self.model = model
+        self.cache_size = cache_size
+        self._embed_batch = embed_batch_fn or (lambda texts: get_ollama_embeddings(texts, model))
+        self._batcher = MicroBatcher(self._embed_batch, window, max_batch, name=f"embed-{model}")
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        # Re-entrant: a batch that finished already runs its callback inside `_futures`.
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _futures(self, texts):
+        """Returns a resolved vector or a Future for every text, submitting the cache misses."""
+        pending = []
+        with self._lock:
+            for text in texts:
+                key = self._key(text)
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    record_cache("embedding", "hit")
+                    pending.append(vector)
+                    continue
+                self.misses += 1
+                record_cache("embedding", "miss")
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = self._batcher.submit(text)
+                    self._in_flight[key] = future
+                    future.add_done_callback(lambda f, key=key: self._store(key, f))
+                pending.append(future)
+        return pending
+
+    def _store(self, key, future):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if future.exception() is None and self.cache_size > 0:
+                self._cache[key] = future.result()
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+    def embed(self, texts, timeout=60):
+        """Returns one vector per text, in order, or None if Ollama could not embed them."""
+        try:
+            return [p.result(timeout) if isinstance(p, Future) else p for p in self._futures(texts)]
+        except Exception as e:
+            logger.error(f"Error embedding {len(texts)} text(s) with '{self.model}': {e}")
+            return None
+
+    def embed_one(self, text):
+        vectors = self.embed([text])
+        return vectors[0] if vectors else None
+
+    async def embed_async(self, texts):
+        """Async version of `embed`; waiting for the batch does not block the event loop."""
+        try:
+            return [
+                await asyncio.wrap_future(p) if isinstance(p, Future) else p
+                for p in self._futures(texts)
+            ]
+        except Exception as e:
+            logger.error(f"Error embedding {len(texts)} text(s) with '{self.model}': {e}")
+            return None
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._cache)
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model,
+            "cached": cached,
+            "cache_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "batches": self._batcher.batches,
+            "batched_texts": self._batcher.items,
+        }
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model):
+    """Returns the process-wide EmbeddingService for `model`, so its cache and batches are shared."""
+    with _services_lock:
+        service = _services.get(model)
+        if service is None:
+            service = _services[model] = EmbeddingService(model)
+        return service
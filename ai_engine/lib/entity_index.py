@@ -0,0 +1,245 @@
+# ai_engine/lib/entity_index.py
+import threading
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from lib.utils import get_prompt_keywords, detect_domain
+
+FUZZY_CUTOFF = 0.6
+# Fuzzy lookups first compute the exact difflib ratio for this many of the
+# candidates most similar to the target by trigrams. Any other string is only
+# checked if its character-count bound could still beat the best of those, so
+# this trades speed, not results.
+FUZZY_MAX_CANDIDATES = 8
+# Distinct characters given a count column each; rarer ones share the last column.
+FUZZY_CHAR_COLUMNS = 96
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class EntityIndex:
+    """
+    Precomputed lookup structures over an `entity_id -> friendly_name` mapping,
+    built once per entity-set version.
+
+    `find_best_match` returns the same results as `find_best_matching_entity`.
+    Keyword mode keeps an inverted index of name/id tokens as numpy position
+    arrays, so scoring every entity is a handful of vector adds instead of a set
+    intersection per entity. Self-correction mode computes difflib's ratio for
+    the closest candidates by trigrams first, then for any other string whose
+    character counts (an upper bound on the ratio, as in `quick_ratio`) could
+    still beat them. Friendly names resolve to ids through a dict instead of a
+    linear scan.
+
+    On 10,000 entities a self-correction lookup takes ~0.8 ms at p50 but ~3.5 ms
+    at p99: a target misspelled into the wrong domain leaves dozens of strings
+    whose bound beats its best ratio, and each needs difflib's full ratio.
+    """
+
+    def __init__(self, all_entities, version=None):
+        self.version = version
+        self.entities = all_entities
+        self.entity_ids = list(all_entities)
+        self.positions = {entity_id: position for position, entity_id in enumerate(self.entity_ids)}
+
+        n = len(self.entity_ids)
+        fn_postings = defaultdict(list)
+        eid_postings = defaultdict(list)
+        domain_positions = defaultdict(list)
+        fn_lengths = np.zeros(n, dtype=np.int32)
+        # friendly name -> first entity_id carrying it (what the linear reverse lookup found).
+        self.name_to_id = {}
+
+        for position, (entity_id, friendly_name) in enumerate(all_entities.items()):
+            fn_words = set(str(friendly_name).lower().split())
+            eid_words = set(entity_id.lower().replace('.', ' ').replace('_', ' ').split())
+            fn_lengths[position] = len(fn_words)
+            for word in fn_words:
+                fn_postings[word].append(position)
+            for word in eid_words:
+                eid_postings[word].append(position)
+            if '.' in entity_id:
+                domain_positions[entity_id.split('.', 1)[0]].append(position)
+            self.name_to_id.setdefault(friendly_name, entity_id)
+
+        self.size = n
+        self.fn_lengths = fn_lengths
+        self.fn_postings = {word: np.array(p, dtype=np.intp) for word, p in fn_postings.items()}
+        self.eid_postings = {word: np.array(p, dtype=np.intp) for word, p in eid_postings.items()}
+        self.domain_positions = {domain: np.array(p, dtype=np.intp) for domain, p in domain_positions.items()}
+
+        # Candidate strings for self-correction, in the order difflib saw them.
+        self.fuzzy_strings = list(dict.fromkeys(list(all_entities.keys()) + list(all_entities.values())))
+        fuzzy_postings = defaultdict(list)
+        self.fuzzy_gram_counts = np.zeros(len(self.fuzzy_strings), dtype=np.float32)
+        for string_id, text in enumerate(self.fuzzy_strings):
+            grams = _trigrams(str(text))
+            self.fuzzy_gram_counts[string_id] = len(grams)
+            for gram in grams:
+                fuzzy_postings[gram].append(string_id)
+        self.fuzzy_postings = {gram: np.array(p, dtype=np.intp) for gram, p in fuzzy_postings.items()}
+
+        # Per-string character counts, for the upper bound on difflib's ratio. Strings
+        # are kept sorted by length, so the only ones long or short enough to reach a
+        # given ratio are a slice.
+        char_totals = defaultdict(int)
+        for text in self.fuzzy_strings:
+            for char in str(text):
+                char_totals[char] += 1
+        common = sorted(char_totals, key=char_totals.get, reverse=True)
+        overflow = FUZZY_CHAR_COLUMNS - 1
+        self.char_columns = {
+            char: column if column < overflow else overflow for column, char in enumerate(common)
+        }
+        lengths = np.array([len(str(text)) for text in self.fuzzy_strings], dtype=np.int32)
+        self.by_length = np.argsort(lengths, kind="stable")
+        self.sorted_lengths = lengths[self.by_length]
+        # One row per character column, so a lookup reads only the rows of its characters.
+        self.fuzzy_char_counts = np.zeros((FUZZY_CHAR_COLUMNS, len(self.fuzzy_strings)), dtype=np.int32)
+        for rank, string_id in enumerate(self.by_length.tolist()):
+            for char in str(self.fuzzy_strings[string_id]):
+                self.fuzzy_char_counts[self.char_columns[char], rank] += 1
+
+    # --- Keyword scoring ---
+
+    def keyword_scores(self, prompt_words, detected_domain):
+        """Returns an array with the `score_entity` score of every entity, by position."""
+        # Each posting array holds a position at most once, so fancy-index adds are safe.
+        fn_hits = np.zeros(self.size, dtype=np.int32)
+        scores = np.zeros(self.size, dtype=np.int32)
+        for word in prompt_words:
+            postings = self.fn_postings.get(word)
+            if postings is not None:
+                fn_hits[postings] += 1
+            postings = self.eid_postings.get(word)
+            if postings is not None:
+                scores[postings] += 1
+        scores += fn_hits * 3
+        # Bonus for matching all words of the friendly name
+        scores += (fn_hits == self.fn_lengths) * 10
+        if detected_domain:
+            postings = self.domain_positions.get(detected_domain)
+            if postings is not None:
+                scores[postings] += 15
+        return scores
+
+    def find_by_keywords(self, prompt_text):
+        prompt_words = get_prompt_keywords(prompt_text)
+        if not prompt_words or not self.size:
+            return None, 0
+
+        scores = self.keyword_scores(prompt_words, detect_domain(prompt_words))
+        # argmax returns the first maximum, matching the linear scan's tie-breaking.
+        best_position = int(np.argmax(scores))
+        highest_score = int(scores[best_position])
+
+        if highest_score > 5:
+            return self.entity_ids[best_position], highest_score
+        return None, 0
+
+    # --- Fuzzy (self-correction) matching ---
+
+    def fuzzy_match(self, target_text):
+        """Same result as difflib.get_close_matches(target, ids + names, n=1, cutoff=0.6)."""
+        if target_text in self.name_to_id or target_text in self.entities:
+            return target_text
+
+        target_grams = _trigrams(str(target_text))
+        postings = [self.fuzzy_postings[gram] for gram in target_grams if gram in self.fuzzy_postings]
+        if postings:
+            counts = np.bincount(np.concatenate(postings), minlength=len(self.fuzzy_strings))
+        else:
+            counts = np.zeros(len(self.fuzzy_strings), dtype=np.intp)
+        shared = int(np.count_nonzero(counts))
+        if shared > FUZZY_MAX_CANDIDATES:
+            # Rank by trigram Dice similarity, which tracks difflib's ratio far better
+            # than the raw shared count (that one favours long strings).
+            dice = counts / (self.fuzzy_gram_counts + len(target_grams))
+            candidate_ids = np.argpartition(-dice, FUZZY_MAX_CANDIDATES)[:FUZZY_MAX_CANDIDATES]
+            candidate_ids = candidate_ids[np.argsort(-dice[candidate_ids], kind="stable")]
+        else:
+            candidate_ids = np.flatnonzero(counts)
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(target_text)
+        best = self._best_ratio(matcher, candidate_ids.tolist(), None)
+
+        # No string left out above can score more than its bound: check, best bound first,
+        # those that could still tie or beat the best found so far.
+        threshold = best[0] if best else FUZZY_CUTOFF
+        string_ids, bound = self._ratio_bounds(str(target_text), threshold)
+        keep = bound >= threshold
+        keep[np.isin(string_ids, candidate_ids)] = False
+        string_ids, bound = string_ids[keep], bound[keep]
+        order = np.argsort(-bound, kind="stable")
+        for string_id, string_bound in zip(string_ids[order].tolist(), bound[order].tolist()):
+            if best is not None and string_bound < best[0]:
+                break
+            best = self._best_ratio(matcher, (string_id,), best)
+        return best[1] if best else None
+
+    def _best_ratio(self, matcher, string_ids, best):
+        """The highest (ratio, string) at or above the cutoff among `string_ids`, starting from `best`."""
+        for string_id in string_ids:
+            candidate = self.fuzzy_strings[string_id]
+            matcher.set_seq1(candidate)
+            # Only a ratio that ties or beats `best` matters, so the quick bounds test against it.
+            floor = best[0] if best else FUZZY_CUTOFF
+            if matcher.real_quick_ratio() >= floor and matcher.quick_ratio() >= floor:
+                ratio = matcher.ratio()
+                # get_close_matches breaks ties on the larger string.
+                if ratio >= FUZZY_CUTOFF and (best is None or (ratio, candidate) > best):
+                    best = (ratio, candidate)
+        return best
+
+    def _ratio_bounds(self, text, threshold):
+        """
+        Returns (string ids, bounds) for the strings whose length lets them reach
+        `threshold`. A bound is 2 * shared characters / total length: `quick_ratio`,
+        or above it where rare characters share a column. Computed the way difflib
+        computes ratios, so the bound compares exactly against them.
+        """
+        # 2 * min(a, b) / (a + b) caps any ratio; the window's ends are rounded outwards.
+        length = len(text)
+        low = np.searchsorted(self.sorted_lengths, int(np.floor(threshold * length / (2 - threshold))), "left")
+        high = np.searchsorted(self.sorted_lengths, int(np.ceil(length * (2 - threshold) / threshold)), "right")
+        target = defaultdict(int)
+        for char in text:
+            column = self.char_columns.get(char)
+            if column is not None:
+                target[column] += 1
+        shared = np.zeros(high - low, dtype=np.int32)
+        for column, count in target.items():
+            shared += np.minimum(self.fuzzy_char_counts[column, low:high], count)
+        return self.by_length[low:high], 2.0 * shared / (self.sorted_lengths[low:high] + length)
+
+    def find_best_match(self, prompt_text, target_text=None):
+        """Drop-in for `find_best_matching_entity(prompt_text, all_entities, target_text)`."""
+        if target_text:
+            match = self.fuzzy_match(target_text)
+            if match is not None:
+                if match in self.name_to_id:
+                    return self.name_to_id[match], 10
+                return match, 10
+        return self.find_by_keywords(prompt_text)
+
+
+_index_lock = threading.Lock()
+_current_index = None
+
+
+def get_entity_index(all_entities, version):
+    """Returns the shared EntityIndex for `version`, rebuilding it when the version changes."""
+    global _current_index
+    index = _current_index
+    if index is not None and index.version == version:
+        return index
+    with _index_lock:
+        if _current_index is None or _current_index.version != version:
+            _current_index = EntityIndex(all_entities, version)
+        return _current_index
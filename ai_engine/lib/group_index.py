@@ -0,0 +1,112 @@
+# ai_engine/lib/group_index.py
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _group_members(state):
+    """Returns the member list of a `group.*` state, or None if it has none."""
+    members = state.get("attributes", {}).get("entity_id")
+    if members is None:
+        return None
+    return [members] if isinstance(members, str) else list(members)
+
+
+def group_signature(all_states):
+    """Hashable summary of every group's membership; changes whenever a group does."""
+    return hash(tuple(
+        (s["entity_id"], tuple(_group_members(s) or ()))
+        for s in all_states if s["entity_id"].startswith("group.")
+    ))
+
+
+class GroupIndex:
+    """
+    Flattened group membership built from one pass over the HA states.
+
+    Every expandable group maps to the set of non-group entities it reaches
+    through any depth of nesting, so `expand` costs O(members) instead of a scan of
+    `all_states` per group. Cycles (a group that contains itself, directly or
+    through other groups) are recorded in `cycles` and cut instead of recursing
+    forever.
+    """
+
+    def __init__(self, all_states, version=None):
+        self.version = version
+        self.members = {}
+        for state in all_states:
+            if state["entity_id"].startswith("group."):
+                members = _group_members(state)
+                if members is not None:
+                    self.members[state["entity_id"]] = members
+        self.cycles = []
+        self.closure = {}
+        for group_id in self.members:
+            self._flatten(group_id)
+
+    def _flatten(self, root):
+        if root in self.closure:
+            return self.closure[root]
+        leaves = set()
+        visited = {root}
+        path = [root]
+        # Iterative DFS; each stack frame is (group, iterator over its members).
+        stack = [(root, iter(self.members[root]))]
+        while stack:
+            group_id, members = stack[-1]
+            member = next(members, None)
+            if member is None:
+                stack.pop()
+                path.pop()
+                continue
+            if member not in self.members:
+                # Plain entities, and groups that are unknown or have no members, are kept as-is.
+                leaves.add(member)
+            elif member in path:
+                cycle = path[path.index(member):] + [member]
+                if cycle not in self.cycles:
+                    logger.warning(f"Group cycle detected: {' -> '.join(cycle)}. Ignoring the back-reference.")
+                    self.cycles.append(cycle)
+            elif member in visited:
+                continue
+            elif member in self.closure:
+                visited.add(member)
+                leaves.update(self.closure[member])
+            else:
+                visited.add(member)
+                path.append(member)
+                stack.append((member, iter(self.members[member])))
+        self.closure[root] = frozenset(leaves)
+        return self.closure[root]
+
+    def expand(self, entity_ids):
+        """Expands any group entities to their member entities."""
+        expanded_entities = set()
+        entities_to_check = entity_ids if isinstance(entity_ids, list) else [entity_ids]
+        for entity_id in entities_to_check:
+            closure = self.closure.get(entity_id)
+            if closure is not None:
+                expanded_entities.update(closure)
+            else:
+                expanded_entities.add(entity_id)  # Keep group if not expandable
+        return list(expanded_entities)
+
+
+_index_lock = threading.Lock()
+_current_index = None
+
+
+def get_group_index(all_states, version=None):
+    """
+    Returns the shared GroupIndex, rebuilding it only when group membership changes.
+    `version` identifies the group set (see `HAStateMirror.groups_version`); without
+    one, a `group_signature` of `all_states` is used.
+    """
+    global _current_index
+    if version is None:
+        version = group_signature(all_states)
+    with _index_lock:
+        if _current_index is None or _current_index.version != version:
+            _current_index = GroupIndex(all_states, version)
+        return _current_index
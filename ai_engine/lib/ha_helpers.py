@@ -1,90 +1,112 @@
 # ai_engine/lib/ha_helpers.py
 import os
+import logging
 import json
+import httpx
 import requests
 import time
 from datetime import datetime
 import pytz
 
+from lib.http_client import get_session, request_timeout, get_async_client, async_request_timeout
+from lib.group_index import GroupIndex
+
+logger = logging.getLogger(__name__)
+
 HA_API_TOKEN = os.environ.get("HA_API_TOKEN")
 HA_API_URL = os.environ.get("HA_API_URL", "http://homeassistant.local:8123/api")
 
-def expand_ha_groups(entity_ids, all_states):
-    """Expands any group entities to their member entities."""
-    expanded_entities = set()
-    entities_to_check = entity_ids if isinstance(entity_ids, list) else [entity_ids]
+def _ha_session():
+    """Pooled keep-alive session for Home Assistant with the auth header preset."""
+    return get_session(HA_API_URL, headers={"Authorization": f"Bearer {HA_API_TOKEN}"})
 
-    for entity_id in entities_to_check:
-        if entity_id.startswith("group."):
-            group_state = next(
-                (s for s in all_states if s["entity_id"] == entity_id), None
-            )
-            if group_state and "entity_id" in group_state.get("attributes", {}):
-                # Recursively expand if a group contains other groups
-                member_entities = group_state["attributes"]["entity_id"]
-                expanded_entities.update(expand_ha_groups(member_entities, all_states))
-            else:
-                expanded_entities.add(entity_id)  # Keep group if not expandable
-        else:
-            expanded_entities.add(entity_id)
+def _ha_async_client():
+    return get_async_client(HA_API_URL, headers={"Authorization": f"Bearer {HA_API_TOKEN}"})
 
-    return list(expanded_entities)
+def expand_ha_groups(entity_ids, all_states, index=None):
+    """
+    Expands any group entities to their member entities, through nested groups.
+    Pass the shared `GroupIndex` (see `get_group_index`) to skip rebuilding it.
+    """
+    if index is None:
+        index = GroupIndex(all_states)
+    return index.expand(entity_ids)
 
 def call_homeassistant_api(service, entity_id, parameters=None):
     """Calls a Home Assistant service."""
     if not HA_API_TOKEN:
-        print("SUPERVISOR_TOKEN not found. Cannot call Home Assistant API.")
+        logger.warning("SUPERVISOR_TOKEN not found. Cannot call Home Assistant API.")
         return "Error: Addon is not configured with API access."
     
     if not service or '.' not in service:
         return f"Error: Invalid service format '{service}'. Expected 'domain.action'."
 
-    headers = {
-        "Authorization": f"Bearer {HA_API_TOKEN}",
-        "Content-Type": "application/json",
-    }
     domain, action = service.split(".")
     payload = {"entity_id": entity_id}
     if parameters:
         payload.update(parameters)
     url = f"{HA_API_URL}/services/{domain}/{action}"
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        response = _ha_session().post(url, json=payload, timeout=request_timeout(10))
         response.raise_for_status()
-        print("Successfully called Home Assistant service.")
+        logger.debug("Successfully called Home Assistant service.")
         return f"Successfully executed {service} on {entity_id}."
     except requests.exceptions.RequestException as e:
-        print(f"Error calling Home Assistant API: {e}")
+        logger.error(f"Error calling Home Assistant API: {e}")
         return f"Error: Could not call service {service}. Details: {e}"
 
+async def call_homeassistant_api_async(service, entity_id, parameters=None):
+    """Async version of `call_homeassistant_api`, with the same result strings."""
+    if not HA_API_TOKEN:
+        logger.warning("SUPERVISOR_TOKEN not found. Cannot call Home Assistant API.")
+        return "Error: Addon is not configured with API access."
+
+    if not service or '.' not in service:
+        return f"Error: Invalid service format '{service}'. Expected 'domain.action'."
+
+    domain, action = service.split(".")
+    payload = {"entity_id": entity_id}
+    if parameters:
+        payload.update(parameters)
+    url = f"{HA_API_URL}/services/{domain}/{action}"
+    try:
+        response = await _ha_async_client().post(url, json=payload, timeout=async_request_timeout(10))
+        response.raise_for_status()
+        logger.debug("Successfully called Home Assistant service.")
+        return f"Successfully executed {service} on {entity_id}."
+    except httpx.HTTPError as e:
+        logger.error(f"Error calling Home Assistant API: {e!r}")
+        return f"Error: Could not call service {service}. Details: {e!r}"
+
 def get_ha_states():
     """Fetches all states from Home Assistant in a single API call."""
     if not HA_API_TOKEN:
-        print("SUPERVISOR_TOKEN not found. Cannot fetch entities.")
+        logger.warning("SUPERVISOR_TOKEN not found. Cannot fetch entities.")
         return []
-    headers = {"Authorization": f"Bearer {HA_API_TOKEN}"}
     try:
-        print("Fetching all states from Home Assistant...")
-        response = requests.get(f"{HA_API_URL}/states", headers=headers, timeout=10)
+        logger.debug("Fetching all states from Home Assistant...")
+        response = _ha_session().get(f"{HA_API_URL}/states", timeout=request_timeout(10))
         response.raise_for_status()
-        print("Successfully fetched all states.")
+        logger.debug("Successfully fetched all states.")
         return response.json()
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching states from Home Assistant: {e}")
+        logger.error(f"Error fetching states from Home Assistant: {e}")
         return []
 
-def get_ha_area_data():
-    """Fetches a mapping of areas to their entities from Home Assistant."""
+async def get_ha_states_async():
+    """Async version of `get_ha_states`."""
     if not HA_API_TOKEN:
-        print("SUPERVISOR_TOKEN not found. Cannot fetch area data.")
-        return {}
+        logger.warning("SUPERVISOR_TOKEN not found. Cannot fetch entities.")
+        return []
+    try:
+        response = await _ha_async_client().get(f"{HA_API_URL}/states", timeout=async_request_timeout(10))
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error(f"Error fetching states from Home Assistant: {e!r}")
+        return []
 
-    headers = {
-        "Authorization": f"Bearer {HA_API_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    
-    template = """
+AREA_DATA_TEMPLATE = """
     {% set ns = namespace(areas={}) %}
     {% for entity in states %}
       {% set area = area_name(entity.entity_id) %}
@@ -98,23 +120,47 @@ def get_ha_area_data():
     {% endfor %}
     {{ ns.areas | tojson }}
     """
-    
-    payload = {"template": template}
+
+def get_ha_area_data():
+    """Fetches a mapping of areas to their entities from Home Assistant."""
+    if not HA_API_TOKEN:
+        logger.warning("SUPERVISOR_TOKEN not found. Cannot fetch area data.")
+        return {}
+
+    payload = {"template": AREA_DATA_TEMPLATE}
     url = f"{HA_API_URL}/template"
     
     try:
-        print("Fetching area data from Home Assistant...")
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
+        logger.debug("Fetching area data from Home Assistant...")
+        response = _ha_session().post(url, json=payload, timeout=request_timeout(15))
         response.raise_for_status()
         # The response from the template is a string, so we need to parse it as JSON
         area_data_str = response.text
-        print("Successfully fetched area data.")
+        logger.debug("Successfully fetched area data.")
         return json.loads(area_data_str)
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching area data from Home Assistant: {e}")
+        logger.error(f"Error fetching area data from Home Assistant: {e}")
+        return {}
+    except json.JSONDecodeError as e:
+        logger.error(f"Error parsing area data JSON from Home Assistant: {e}")
+        return {}
+
+async def get_ha_area_data_async():
+    """Async version of `get_ha_area_data`."""
+    if not HA_API_TOKEN:
+        logger.warning("SUPERVISOR_TOKEN not found. Cannot fetch area data.")
+        return {}
+    try:
+        response = await _ha_async_client().post(
+            f"{HA_API_URL}/template", json={"template": AREA_DATA_TEMPLATE}, timeout=async_request_timeout(15)
+        )
+        response.raise_for_status()
+        return json.loads(response.text)
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching area data from Home Assistant: {e!r}")
         return {}
     except json.JSONDecodeError as e:
-        print(f"Error parsing area data JSON from Home Assistant: {e}")
+        logger.error(f"Error parsing area data JSON from Home Assistant: {e}")
         return {}
 
 def get_average_temperature(all_states):
@@ -131,7 +177,7 @@ def get_average_temperature(all_states):
                     temp_sensors.append(temp)
                 except (ValueError, TypeError):
                     # State is not a valid number (e.g., 'unknown'), so we skip it
-                    print(f"Could not parse temperature for {entity['entity_id']}: state is '{entity['state']}'")
+                    logger.warning(f"Could not parse temperature for {entity['entity_id']}: state is '{entity['state']}'")
                     pass
     
     if not temp_sensors:
@@ -143,40 +189,35 @@ def get_average_temperature(all_states):
 def get_ha_timezone():
     """Fetches the timezone from Home Assistant configuration."""
     if not HA_API_TOKEN:
-        print("SUPERVISOR_TOKEN not found. Cannot fetch timezone.")
+        logger.warning("SUPERVISOR_TOKEN not found. Cannot fetch timezone.")
         return "UTC"  # Default to UTC if token is missing
-    headers = {"Authorization": f"Bearer {HA_API_TOKEN}"}
     try:
-        print("Fetching timezone from Home Assistant...")
-        response = requests.get(f"{HA_API_URL}/config", headers=headers, timeout=10)
+        logger.debug("Fetching timezone from Home Assistant...")
+        response = _ha_session().get(f"{HA_API_URL}/config", timeout=request_timeout(10))
         response.raise_for_status()
         config_data = response.json()
         tz = config_data.get("time_zone", "UTC")
-        print(f"Successfully fetched timezone: {tz}")
+        logger.debug(f"Successfully fetched timezone: {tz}")
         return tz
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching timezone from Home Assistant: {e}. Defaulting to UTC.")
+        logger.error(f"Error fetching timezone from Home Assistant: {e}. Defaulting to UTC.")
         return "UTC"
 
 def get_entity_history(entity_id):
     """Fetches the history of a specific entity for the last 24 hours."""
     if not HA_API_TOKEN:
-        print("SUPERVISOR_TOKEN not found. Cannot fetch history.")
+        logger.warning("SUPERVISOR_TOKEN not found. Cannot fetch history.")
         return "Error: Addon is not configured with API access."
 
-    headers = {
-        "Authorization": f"Bearer {HA_API_TOKEN}",
-        "Content-Type": "application/json",
-    }
     # Get timestamp for 24 hours ago
     start_time = time.time() - 24 * 3600
     start_time_iso = datetime.fromtimestamp(start_time).isoformat()
 
     url = f"{HA_API_URL}/history/period/{start_time_iso}?filter_entity_id={entity_id}"
-    print(f"Fetching history for {entity_id}...")
+    logger.debug(f"Fetching history for {entity_id}...")
 
     try:
-        response = requests.get(url, headers=headers, timeout=15)
+        response = _ha_session().get(url, timeout=request_timeout(15))
         response.raise_for_status()
         history_data = response.json()
         if not history_data or not history_data[0]:
@@ -185,7 +226,7 @@ def get_entity_history(entity_id):
         return history_data[0]  # Return the list of events
 
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching history from Home Assistant: {e}")
+        logger.error(f"Error fetching history from Home Assistant: {e}")
         return f"Error: Could not fetch history for {entity_id}. Details: {e}"
 
 def prettify_history(history_data, entity_id, all_states, local_tz_str):
@@ -196,7 +237,7 @@ def prettify_history(history_data, entity_id, all_states, local_tz_str):
     try:
         local_tz = pytz.timezone(local_tz_str)
     except pytz.UnknownTimeZoneError:
-        print(f"Unknown timezone '{local_tz_str}'. Defaulting to UTC.")
+        logger.warning(f"Unknown timezone '{local_tz_str}'. Defaulting to UTC.")
         local_tz = pytz.utc
 
     # Get the entity's attributes for semantic context
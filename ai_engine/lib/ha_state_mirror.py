@@ -0,0 +1,307 @@
+# ai_engine/lib/ha_state_mirror.py
+import os
+import logging
+import json
+import time
+import threading
+
+from lib.ha_helpers import get_ha_states
+from lib.group_index import group_signature
+from lib.area_registry import AreaRegistry, REGISTRIES
+
+logger = logging.getLogger(__name__)
+
+try:
+    import websocket  # websocket-client
+except ImportError:  # pragma: no cover - the mirror falls back to polling
+    websocket = None
+
+HA_API_TOKEN = os.environ.get("HA_API_TOKEN")
+HA_API_URL = os.environ.get("HA_API_URL", "http://homeassistant.local:8123/api")
+
+
+def default_ws_url(api_url=HA_API_URL):
+    """Derives the websocket endpoint from the REST API URL (http://host/api -> ws://host/api/websocket)."""
+    ws_url = os.environ.get("HA_WS_URL")
+    if ws_url:
+        return ws_url
+    if api_url.startswith("https://"):
+        ws_url = "wss://" + api_url[len("https://"):]
+    elif api_url.startswith("http://"):
+        ws_url = "ws://" + api_url[len("http://"):]
+    else:
+        ws_url = api_url
+    return ws_url.rstrip("/") + "/websocket"
+
+
+def _members(state):
+    return state.get("attributes", {}).get("entity_id") if state else None
+
+
+class HAStateMirror:
+    """
+    Keeps an in-process copy of every Home Assistant state.
+
+    A background thread subscribes to `state_changed` events over the HA websocket
+    API and applies them to the index as they arrive. A full `GET /api/states`
+    resync runs after every (re)connect and every `resync_interval` seconds, so the
+    mirror stays correct even if events are missed or the websocket is unavailable.
+
+    Over the same connection it lists HA's area, device and entity registries and
+    re-lists one whenever its `*_registry_updated` event fires, so `get_area_data`
+    answers from memory instead of rendering the area template in HA.
+    """
+
+    def __init__(self, ws_url=None, token=None, resync_interval=None, fetch_states=get_ha_states):
+        self.ws_url = ws_url or default_ws_url()
+        self.token = token if token is not None else HA_API_TOKEN
+        self.resync_interval = resync_interval if resync_interval is not None else int(
+            os.environ.get("HA_STATE_RESYNC_INTERVAL", "600")
+        )
+        self.fetch_states = fetch_states
+
+        self._lock = threading.Lock()
+        self._states = {}
+        self._entities = {}
+        self._states_snapshot = None
+        self._last_resync = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._ws = None
+        self._msg_id = 0
+        self.registry = AreaRegistry()
+        self._area_data = None
+        self._area_data_key = None
+        # Websocket bookkeeping, only touched by the background thread.
+        self._pending = {}            # message id -> registry name awaiting its list result
+        self._registry_subs = {}      # subscription id -> registry name
+        self._registry_dirty = set()
+
+        # Bumped whenever an entity is added, removed or renamed, so callers can
+        # cheaply tell when anything derived from the entity set is stale.
+        self.version = 0
+        # Bumped whenever a group is added, removed or changes members.
+        self.groups_version = 0
+        self.connected = False
+
+    # --- Public read API ---
+
+    def is_ready(self):
+        """True once the mirror holds at least one full snapshot of HA states."""
+        return self._last_resync > 0
+
+    def get_states(self):
+        """Returns a list of all state objects, in the same shape as `get_ha_states()`."""
+        with self._lock:
+            if self._states_snapshot is None:
+                self._states_snapshot = list(self._states.values())
+            return self._states_snapshot
+
+    def get_state(self, entity_id):
+        """Returns the state object for a single entity, or None."""
+        with self._lock:
+            return self._states.get(entity_id)
+
+    def get_entities(self):
+        """Returns a mapping of entity_id -> friendly_name. Treat it as read-only."""
+        with self._lock:
+            return self._entities
+
+    def areas_ready(self):
+        """True once all three registries have been listed."""
+        return self.registry.is_ready()
+
+    def get_area_data(self):
+        """
+        Returns {area name: [{"entity_id", "friendly_name"}]}, like `get_ha_area_data()`.
+        Rebuilt only after a registry or the entity set changed; treat it as read-only.
+        """
+        with self._lock:
+            key = (self.registry.version, self.version)
+            if self._area_data is None or self._area_data_key != key:
+                self._area_data = self.registry.build_area_data(self._entities)
+                self._area_data_key = key
+            return self._area_data
+
+    # --- Mutation ---
+
+    def load_registry(self, registry, items):
+        """Replaces one registry ('area', 'device' or 'entity') with a full listing."""
+        with self._lock:
+            self.registry.load(registry, items)
+
+    def load_states(self, states):
+        """Replaces the whole index with a full state dump."""
+        new_states = {s["entity_id"]: s for s in states}
+        new_entities = {
+            entity_id: s.get("attributes", {}).get("friendly_name", entity_id)
+            for entity_id, s in new_states.items()
+        }
+        with self._lock:
+            if new_entities != self._entities:
+                self.version += 1
+            if group_signature(new_states.values()) != group_signature(self._states.values()):
+                self.groups_version += 1
+            self._states = new_states
+            self._entities = new_entities
+            self._states_snapshot = None
+            self._last_resync = time.time()
+
+    def apply_state_changed(self, data):
+        """Applies the `data` payload of a `state_changed` event."""
+        entity_id = data.get("entity_id")
+        if not entity_id:
+            return
+        new_state = data.get("new_state")
+        with self._lock:
+            # `_states` is only read under the lock, but `_entities` is handed out to
+            # callers, so it is replaced (copy-on-write) rather than mutated.
+            old_state = self._states.get(entity_id)
+            if entity_id.startswith("group.") and _members(old_state) != _members(new_state):
+                self.groups_version += 1
+            if new_state is None:
+                if self._states.pop(entity_id, None) is not None:
+                    self._entities = {k: v for k, v in self._entities.items() if k != entity_id}
+                    self.version += 1
+            else:
+                friendly_name = new_state.get("attributes", {}).get("friendly_name", entity_id)
+                self._states[entity_id] = new_state
+                if self._entities.get(entity_id) != friendly_name:
+                    self._entities = dict(self._entities)
+                    self._entities[entity_id] = friendly_name
+                    self.version += 1
+            self._states_snapshot = None
+
+    def resync(self):
+        """Fetches a full state dump over REST and loads it. Returns True on success."""
+        states = self.fetch_states()
+        if not states:
+            return False
+        self.load_states(states)
+        logger.info(f"HA state mirror resynced ({len(states)} entities, version {self.version}).")
+        return True
+
+    # --- Background thread ---
+
+    def start(self):
+        """Starts the background thread; the first resync happens on that thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ha-state-mirror", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            if websocket is None or not self.token:
+                # No websocket support: fall back to periodic full resyncs.
+                self.resync()
+                self._stop.wait(self.resync_interval if self.is_ready() else 5)
+                continue
+            try:
+                self._listen()
+                backoff = 1
+            except Exception as e:
+                if not self._stop.is_set():
+                    logger.warning(f"HA state mirror websocket error: {e}")
+            finally:
+                self.connected = False
+                self._ws = None
+            if self._stop.is_set():
+                break
+            # Keep the mirror usable while disconnected.
+            if time.time() - self._last_resync > self.resync_interval:
+                self.resync()
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def _next_id(self):
+        self._msg_id += 1
+        return self._msg_id
+
+    def _listen(self):
+        logger.debug(f"Connecting HA state mirror to {self.ws_url}...")
+        ws = websocket.create_connection(self.ws_url, timeout=10)
+        self._ws = ws
+        try:
+            msg = json.loads(ws.recv())
+            if msg.get("type") == "auth_required":
+                ws.send(json.dumps({"type": "auth", "access_token": self.token}))
+                msg = json.loads(ws.recv())
+            if msg.get("type") != "auth_ok":
+                raise RuntimeError(f"authentication failed: {msg.get('message', msg.get('type'))}")
+
+            self._msg_id = 0
+            self._pending = {}
+            self._registry_subs = {}
+            self._registry_dirty = set(REGISTRIES)
+            sub_id = self._next_id()
+            ws.send(json.dumps({"id": sub_id, "type": "subscribe_events", "event_type": "state_changed"}))
+            for registry, (_, event_type) in REGISTRIES.items():
+                registry_sub_id = self._next_id()
+                self._registry_subs[registry_sub_id] = registry
+                ws.send(json.dumps({"id": registry_sub_id, "type": "subscribe_events", "event_type": event_type}))
+            self._request_registries(ws)
+
+            # Subscribe before resyncing so no change falls between the two.
+            self.resync()
+            self.connected = True
+            logger.info("HA state mirror subscribed to state_changed events.")
+
+            # Wake up periodically to run the scheduled resync.
+            ws.settimeout(min(self.resync_interval, 30))
+            while not self._stop.is_set():
+                try:
+                    raw = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    raw = None
+                if raw:
+                    msg = json.loads(raw)
+                    if msg.get("type") == "event" and msg.get("id") == sub_id:
+                        event = msg.get("event", {})
+                        if event.get("event_type") == "state_changed":
+                            self.apply_state_changed(event.get("data", {}))
+                    elif msg.get("type") == "event" and msg.get("id") in self._registry_subs:
+                        # The events only name what changed; re-list the whole registry.
+                        self._registry_dirty.add(self._registry_subs[msg["id"]])
+                    elif msg.get("type") == "result" and msg.get("id") in self._pending:
+                        self._handle_registry_result(self._pending.pop(msg["id"]), msg)
+                    elif msg.get("type") == "result" and not msg.get("success", True):
+                        raise RuntimeError(f"subscription failed: {msg.get('error')}")
+                    self._request_registries(ws)
+                elif raw == "":
+                    raise RuntimeError("connection closed by server")
+                if time.time() - self._last_resync > self.resync_interval:
+                    self.resync()
+        finally:
+            ws.close()
+
+    def _request_registries(self, ws):
+        """Sends a list command for every dirty registry that has none in flight."""
+        in_flight = set(self._pending.values())
+        for registry in list(self._registry_dirty):
+            if registry in in_flight:
+                continue
+            self._registry_dirty.discard(registry)
+            msg_id = self._next_id()
+            self._pending[msg_id] = registry
+            ws.send(json.dumps({"id": msg_id, "type": REGISTRIES[registry][0]}))
+
+    def _handle_registry_result(self, registry, msg):
+        if msg.get("success"):
+            self.load_registry(registry, msg.get("result") or [])
+        else:
+            # e.g. a non-admin token; area data falls back to the template.
+            logger.warning(f"HA state mirror could not list the {registry} registry: {msg.get('error')}")
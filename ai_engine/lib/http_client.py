@@ -0,0 +1,136 @@
+# ai_engine/lib/http_client.py
+import os
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pool and retry policy, shared by every upstream (Ollama, Home Assistant, ...).
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.3"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+
+# Connection cap per host for the async clients used by the ASGI app, which
+# hold many more requests in flight than the sync worker pools.
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.environ.get("ASYNC_HTTP_MAX_CONNECTIONS", "64"))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_async_clients = {}
+
+
+def _host_key(url):
+    parts = urlsplit(url or "")
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _build_session(headers=None):
+    # Connection errors are retried for every method. Read errors and 502/503/504
+    # are only retried for idempotent methods, so a POST that reached the server
+    # (e.g. a service call or a generation) is never sent twice.
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def get_session(url, headers=None):
+    """
+    Returns the keep-alive session for the host of `url`, creating it on first use.
+    `headers` (e.g. Authorization) are attached to the session when it is created,
+    so they are not rebuilt on every call; callers passing different headers get
+    separate sessions.
+    """
+    key = (_host_key(url), tuple(sorted(headers.items())) if headers else ())
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _build_session(headers)
+                _sessions[key] = session
+    return session
+
+
+def get_async_client(url, headers=None):
+    """
+    Async counterpart of `get_session`: a keep-alive `httpx.AsyncClient` per host
+    and header set. Clients are bound to the event loop they are first used on, so
+    only call this from the ASGI app's loop; `close_async_clients` closes them.
+    """
+    key = (_host_key(url), tuple(sorted(headers.items())) if headers else ())
+    client = _async_clients.get(key)
+    if client is None:
+        client = httpx.AsyncClient(
+            headers=headers,
+            limits=httpx.Limits(
+                max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+            ),
+            # Like the sync adapter, retry failed connects only; requests are never resent.
+            transport=httpx.AsyncHTTPTransport(retries=HTTP_RETRIES),
+        )
+        _async_clients[key] = client
+    return client
+
+
+async def close_async_clients():
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def async_request_timeout(read_timeout):
+    """httpx timeout with the shared connect timeout."""
+    return httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def request_timeout(read_timeout):
+    """(connect, read) timeout tuple using the shared connect timeout."""
+    return (HTTP_CONNECT_TIMEOUT, read_timeout)
+
+
+def get_pool_stats():
+    """
+    Returns per-host connection counters for this process:
+    {host: {"connections_opened": n, "requests": n, "connections_reused": n}}.
+    """
+    stats = {}
+    for (host, _), session in list(_sessions.items()):
+        host_stats = stats.setdefault(host, {"connections_opened": 0, "requests": 0, "connections_reused": 0})
+        opened = 0
+        requests_made = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                requests_made += pool.num_requests
+        host_stats["connections_opened"] += opened
+        host_stats["requests"] += requests_made
+        host_stats["connections_reused"] += max(requests_made - opened, 0)
+    return stats
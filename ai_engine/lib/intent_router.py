@@ -0,0 +1,218 @@
+# ai_engine/lib/intent_router.py
+import os
+import re
+import logging
+import threading
+
+import numpy as np
+
+from lib.utils import get_prompt_keywords
+from lib.metrics import PROMPT_PATHS, PROMPT_PATH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+INTENT_ROUTER = os.environ.get("INTENT_ROUTER", "true").lower() == "true"
+# How far ahead of the runner-up (in `score_entity` points) a device must be
+# when several devices contain every word the prompt used for it.
+ROUTER_MIN_MARGIN = int(os.environ.get("ROUTER_MIN_MARGIN", "3"))
+# Only the best-scoring devices are checked for covering the prompt's words.
+ROUTER_CANDIDATES = 8
+
+# Words that name a kind of device rather than a particular one.
+DOMAIN_WORDS = {
+    "light": "light", "lights": "light", "lamp": "light", "lamps": "light",
+    "fan": "fan", "fans": "fan",
+    "switch": "switch", "switches": "switch", "plug": "switch", "outlet": "switch",
+    "blind": "cover", "blinds": "cover", "shade": "cover", "shades": "cover",
+    "curtain": "cover", "curtains": "cover", "cover": "cover",
+    "lock": "lock",
+}
+ON_OFF_DOMAINS = ("light", "switch", "fan", "input_boolean")
+
+# Anything conditional, scheduled, relative or collective needs the LLM.
+_FALLBACK_WORDS = {
+    "if", "when", "while", "until", "unless", "after", "before", "every", "minutes", "minute", "hours", "hour",
+    "seconds", "tonight", "tomorrow", "all", "everything", "except", "but", "it", "them", "that",
+    "this", "those", "these", "again", "same", "other", "brighter", "dimmer", "warmer", "cooler", "color",
+    "colour", "red", "green", "blue", "white", "warm", "cold", "degrees", "temperature", "scene", "or",
+}
+
+_PLEASE = r"(?:(?:please|can you|could you|would you)\s+)?"
+_THE = r"(?:the\s+|my\s+)?"
+# (pattern, service kind); the `target` group names the device.
+_PATTERNS = [
+    (re.compile(rf"^{_PLEASE}(?:turn|switch|power)\s+(?P<state>on|off)\s+{_THE}(?P<target>.+)$"), "on_off"),
+    (re.compile(rf"^{_PLEASE}(?:turn|switch|power)\s+{_THE}(?P<target>.+?)\s+(?P<state>on|off)$"), "on_off"),
+    (re.compile(rf"^{_PLEASE}(?:set|dim|turn|put)\s+{_THE}(?P<target>.+?)\s+(?:to|at)\s+(?P<pct>\d{{1,3}})\s*(?:%|percent)$"),
+     "brightness"),
+    (re.compile(rf"^{_PLEASE}(?P<verb>open|close|raise|lower)\s+{_THE}(?P<target>.+)$"), "cover"),
+    (re.compile(rf"^{_PLEASE}(?P<verb>lock|unlock)\s+{_THE}(?P<target>.+)$"), "lock"),
+]
+_COVER_SERVICES = {"open": "open_cover", "raise": "open_cover", "close": "close_cover", "lower": "close_cover"}
+
+
+class RouteMiss(Exception):
+    """A prompt (or part of it) the router is not confident about; the LLM handles it."""
+
+
+def _normalize(prompt_text):
+    text = prompt_text.lower().strip()
+    text = re.sub(r"[!.?]+$", "", text)
+    return " ".join(text.replace(",", " ").split())
+
+
+def _split_clauses(text):
+    return [clause.strip() for clause in re.split(r"\s+(?:and then|and|then)\s+|\s*;\s*", text) if clause.strip()]
+
+
+class IntentRouter:
+    """
+    Resolves simple device commands ("turn off the kitchen lights", "set the
+    bedroom light to 50%", "open the garage blinds") straight into
+    `execute_task` commands, without an LLM call.
+
+    Each clause of the prompt must match one of a few command patterns, and its
+    device must be found with high confidence through the entity index (the
+    same keyword scoring as `find_best_matching_entity`, limited to domains the
+    service applies to): the device has to contain every word the prompt used
+    for it and beat any other such device by ROUTER_MIN_MARGIN points. Anything
+    else (questions, conditions, schedules, several devices, follow-ups) returns
+    None, and the prompt goes to the LLM as before.
+    """
+
+    def __init__(self, min_margin=ROUTER_MIN_MARGIN):
+        self.min_margin = min_margin
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.misses = {}
+
+    def route(self, prompt_text, entity_index):
+        """Returns the list of execute_task commands for the prompt, or None to fall back to the LLM."""
+        text = _normalize(prompt_text)
+        try:
+            if not text or not entity_index.size:
+                raise RouteMiss("empty")
+            if set(text.split()) & _FALLBACK_WORDS:
+                raise RouteMiss("complex")
+            commands = [self._route_clause(clause, entity_index) for clause in _split_clauses(text)]
+        except RouteMiss as miss:
+            with self._lock:
+                self.misses[str(miss)] = self.misses.get(str(miss), 0) + 1
+            return None
+        with self._lock:
+            self.routed += 1
+        logger.info(f"Intent router resolved the prompt into {len(commands)} command(s) without the LLM.")
+        return commands
+
+    def _route_clause(self, clause, entity_index):
+        for pattern, kind in _PATTERNS:
+            match = pattern.match(clause)
+            if match:
+                break
+        else:
+            raise RouteMiss("no_pattern")
+
+        target = match.group("target")
+        parameters = None
+        if kind == "on_off":
+            domains, service = ON_OFF_DOMAINS, "turn_" + match.group("state")
+        elif kind == "brightness":
+            pct = int(match.group("pct"))
+            if pct > 100:
+                raise RouteMiss("no_pattern")
+            domains, service, parameters = ("light",), "turn_on", {"brightness_pct": pct}
+        elif kind == "cover":
+            domains, service = ("cover",), _COVER_SERVICES[match.group("verb")]
+        else:
+            domains, service = ("lock",), match.group("verb")
+
+        entity_id = self._resolve(target, domains, entity_index)
+        command = {"action": "execute_task", "service": f"{entity_id.split('.', 1)[0]}.{service}", "entity_id": entity_id}
+        if parameters:
+            command["parameters"] = parameters
+        return command
+
+    def _resolve(self, target, domains, entity_index):
+        """Returns the one device `target` names among `domains`, or raises RouteMiss."""
+        words = get_prompt_keywords(target)
+        named_domains = {DOMAIN_WORDS[w] for w in words if w in DOMAIN_WORDS}
+        if len(named_domains) > 1:
+            raise RouteMiss("ambiguous")
+        if named_domains:
+            domains = tuple(d for d in domains if d in named_domains) or tuple(named_domains)
+        # "kitchen lights" must find a kitchen device; "lights" only helps score it.
+        required = {w for w in words if w not in DOMAIN_WORDS}
+
+        positions = [entity_index.domain_positions[d] for d in domains if d in entity_index.domain_positions]
+        if not positions:
+            raise RouteMiss("no_device")
+        positions = np.concatenate(positions)
+
+        if not required:
+            # "turn on the fan" is only unambiguous in a house with one fan.
+            if len(positions) == 1:
+                return entity_index.entity_ids[int(positions[0])]
+            raise RouteMiss("ambiguous")
+
+        scores = entity_index.keyword_scores(words, None)[positions]
+        order = np.argsort(-scores, kind="stable")[:ROUTER_CANDIDATES]
+        covering = []
+        for i in order:
+            if scores[i] <= 0:
+                break
+            entity_id = entity_index.entity_ids[int(positions[i])]
+            if required <= self._entity_words(entity_id, entity_index.entities[entity_id]):
+                covering.append((int(scores[i]), entity_id))
+        if not covering:
+            raise RouteMiss("no_device")
+        if len(covering) > 1 and covering[0][0] - covering[1][0] < self.min_margin:
+            raise RouteMiss("ambiguous")
+        return covering[0][1]
+
+    @staticmethod
+    def _entity_words(entity_id, friendly_name):
+        return set(str(friendly_name).lower().split()) | set(entity_id.lower().replace('.', ' ').replace('_', ' ').split())
+
+    def stats(self):
+        with self._lock:
+            misses = dict(self.misses)
+            total = self.routed + sum(misses.values())
+            return {
+                "routed": self.routed,
+                "fallbacks": misses,
+                "routed_rate": round(self.routed / total, 4) if total else 0.0,
+                "min_margin": self.min_margin,
+            }
+
+
+class PromptPathStats:
+    """
+    Counts the prompts of this process by the path that planned them (see
+    PROMPT_PATHS) with their average latency, and the share planned without
+    an LLM call. The full latency distribution is in `ai_engine_prompt_path_seconds`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(PROMPT_PATHS, 0)
+        self.total_ms = dict.fromkeys(PROMPT_PATHS, 0.0)
+
+    def record(self, path, seconds):
+        PROMPT_PATH_SECONDS.labels(path).observe(seconds)
+        with self._lock:
+            self.counts[path] += 1
+            self.total_ms[path] += seconds * 1000
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            without_llm = self.counts["router"] + self.counts["plan_cache"]
+            return {
+                "paths": {
+                    path: {"count": count, "avg_ms": round(self.total_ms[path] / count, 1) if count else 0.0}
+                    for path, count in self.counts.items()
+                },
+                "without_llm_rate": round(without_llm / total, 4) if total else 0.0,
+            }
+
+prompt_paths = PromptPathStats()
@@ -0,0 +1,115 @@
+# ai_engine/lib/logging_setup.py
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import hashlib
+import logging
+import contextvars
+
+# DEBUG adds payloads (prompts, raw LLM replies, retrieved memories) to the
+# one-line summaries logged at INFO.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "text" for humans, "json" for one JSON object per line (Promtail/Loki).
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+# Payloads are cut to this many characters; 0 logs them whole.
+LOG_PAYLOAD_CHARS = int(os.environ.get("LOG_PAYLOAD_CHARS", "500"))
+# Fraction of requests whose payloads are logged, per category, e.g. "prompt=0.05,memory=0.5".
+# The choice is made per request id, so a sampled request logs all of its payloads of that category.
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (
+        item.partition("=") for item in os.environ.get("LOG_SAMPLE_RATES", "").split(",") if "=" in item
+    )
+}
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def set_request_id(request_id=None):
+    """Tags every log line of the current request (and the threads/tasks it starts) with an id."""
+    request_id = (request_id or uuid.uuid4().hex[:12])[:64]
+    _request_id.set(request_id)
+    return request_id
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+def is_sampled(category):
+    rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    key = f"{get_request_id() or uuid.uuid4().hex}:{category}"
+    return zlib.crc32(key.encode()) / 2**32 < rate
+
+
+def log_payload(logger, category, label, text, level=logging.DEBUG):
+    """
+    Logs `text` under `label`, truncated to LOG_PAYLOAD_CHARS, with its length and
+    a short hash so identical payloads can be matched across lines. Costs nothing
+    unless `level` is enabled and the request is sampled for `category`.
+    """
+    if not logger.isEnabledFor(level) or not is_sampled(category):
+        return
+    text = str(text)
+    digest = hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()[:12]
+    shown = text
+    if LOG_PAYLOAD_CHARS and len(text) > LOG_PAYLOAD_CHARS:
+        shown = f"{text[:LOG_PAYLOAD_CHARS]}... [{len(text) - LOG_PAYLOAD_CHARS} more chars]"
+    logger.log(
+        level, "%s (%d chars, sha1 %s):\n%s", label, len(text), digest, shown,
+        extra={"category": category, "payload_chars": len(text), "payload_sha1": digest},
+    )
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = get_request_id() or "-"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, carrying the request id and any structured extras."""
+
+    FIELDS = ("category", "payload_chars", "payload_sha1")
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "msg": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging():
+    """Sets up the root logger from LOG_LEVEL/LOG_FORMAT. Safe to call more than once."""
+    root = logging.getLogger()
+    if any(getattr(h, "_ai_engine", False) for h in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler._ai_engine = True
+    handler.addFilter(RequestIdFilter())
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    # One line per outgoing HTTP request is more than we want at INFO.
+    for noisy in ("httpx", "httpcore", "urllib3", "chromadb"):
+        logging.getLogger(noisy).setLevel(max(logging.WARNING, root.level))
@@ -0,0 +1,113 @@
+# ai_engine/lib/metrics.py
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+
+# With several gunicorn workers, point PROMETHEUS_MULTIPROC_DIR at an empty
+# directory so /metrics aggregates every worker instead of the one that answered.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# Stages of a prompt, in the order process_prompt runs them.
+STAGES = (
+    "memory_retrieval", "ha_states", "intent_routing", "area_data", "prompt_build",
+    "llm_call", "command_extraction", "ha_service_calls", "llm_answer",
+)
+
+REQUEST_SECONDS = Histogram(
+    "ai_engine_request_seconds", "End-to-end latency of prompt requests.", ["endpoint"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "ai_engine_requests_in_progress", "Prompt requests currently being processed.", ["endpoint"],
+    multiprocess_mode="livesum",
+)
+# How a prompt's plan was made: intent router, plan cache, LLM, or the LLM
+# answering directly after producing no command.
+PROMPT_PATHS = ("router", "plan_cache", "llm", "direct_answer")
+PROMPT_PATH_SECONDS = Histogram(
+    "ai_engine_prompt_path_seconds", "End-to-end latency of prompts by the path that planned them.", ["path"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+STAGE_SECONDS = Histogram(
+    "ai_engine_stage_seconds", "Time spent in each stage of prompt processing.", ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+PROMPT_TOKENS = Histogram(
+    "ai_engine_prompt_tokens", "Estimated size of the prompts sent to the LLM, in tokens.", ["kind"],
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+LLM_TOKENS = Counter(
+    "ai_engine_llm_tokens", "Tokens Ollama reports evaluating for prompts and generating.", ["kind"],
+)
+LLM_PROMPT_EVAL_SECONDS = Histogram(
+    "ai_engine_llm_prompt_eval_seconds", "Time Ollama spends evaluating the part of each prompt it had not cached.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15),
+)
+CACHE_LOOKUPS = Counter(
+    "ai_engine_cache_lookups", "Cache lookups by cache and result.", ["cache", "result"],
+)
+LLM_PLANS = Counter(
+    "ai_engine_llm_plans", "Tool-selection replies by how they parsed: commands, no_action ([]) or unparsed.", ["result"],
+)
+MEMORY_RETRIEVALS = Counter(
+    "ai_engine_memory_retrievals", "How long-term memory retrieval ended for each prompt.", ["outcome"],
+)
+
+
+@contextmanager
+def stage(name):
+    """Times the enclosed block into the `ai_engine_stage_seconds` histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def track_request(endpoint):
+    """Counts the request as in progress and records its latency."""
+    gauge = REQUESTS_IN_PROGRESS.labels(endpoint)
+    gauge.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        gauge.dec()
+        REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+
+
+def record_cache(cache, result):
+    CACHE_LOOKUPS.labels(cache, result).inc()
+
+
+def record_llm_tokens(reply):
+    """Records the token counts of an Ollama /api/generate reply (or its final stream chunk)."""
+    if reply.get("prompt_eval_count"):
+        LLM_TOKENS.labels("prompt").inc(reply["prompt_eval_count"])
+    if reply.get("prompt_eval_duration"):
+        LLM_PROMPT_EVAL_SECONDS.observe(reply["prompt_eval_duration"] / 1e9)
+    if reply.get("eval_count"):
+        LLM_TOKENS.labels("completion").inc(reply["eval_count"])
+
+
+def record_llm_plan(parser):
+    """Records how an IncrementalCommandParser found the tool-selection reply."""
+    if parser.commands:
+        LLM_PLANS.labels("commands").inc()
+    else:
+        LLM_PLANS.labels("no_action" if parser.done else "unparsed").inc()
+
+
+def render_metrics():
+    """Returns (body, content type) of the Prometheus exposition for this process, or all workers."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,26 +1,173 @@
 # ai_engine/lib/ollama_helpers.py
 import os
+import logging
+import json
+import httpx
 import requests
-import traceback
+
+from lib.http_client import get_session, request_timeout, get_async_client, async_request_timeout
+from lib.metrics import record_llm_tokens
+from lib.logging_setup import log_payload
+
+logger = logging.getLogger(__name__)
 
 OLLAMA_URL = os.environ.get("OLLAMA_URL")
+# How long Ollama keeps the model, and with it the evaluated prompt prefix, loaded
+# after a request; its own default of 5m drops the cache in quiet hours. Empty
+# leaves Ollama's setting alone.
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+def log_prompt(prompt):
+    # Prompts embed the house's devices and run to several KB; the text itself is
+    # only logged at DEBUG, for the requests sampled into the "prompt" category.
+    log_payload(logger, "prompt", "Ollama prompt", prompt)
 
-def call_ollama(prompt, model):
-    """Sends a prompt to the Ollama API and returns the response."""
-    print(f"Querying Ollama with model '{model}'...")
-    print(f"-- OLLAMA PROMPT --\n{prompt}\n-- END OLLAMA PROMPT --")
+def log_response(response):
+    log_payload(logger, "response", "Ollama raw response", response)
+
+def generate_request(prompt, model, stream, output_format=None, system=None):
+    """
+    Body of an /api/generate call; `output_format` is Ollama's `format` ("json" or a
+    JSON schema). A `system` prompt replaces the model's own and is rendered before
+    `prompt`, so a fixed one is evaluated once and then reused from Ollama's cache.
+    """
+    body = {"model": model, "prompt": prompt, "stream": stream}
+    if system:
+        body["system"] = system
+    if output_format:
+        body["format"] = output_format
+    if OLLAMA_KEEP_ALIVE:
+        body["keep_alive"] = OLLAMA_KEEP_ALIVE
+    return body
+
+def call_ollama(prompt, model, stream=False, output_format=None, system=None):
+    """
+    Sends a prompt to the Ollama API and returns the response.
+    With stream=True, returns a generator that yields response tokens as they arrive.
+    With `output_format`, generation is constrained to JSON (or to a JSON schema).
+    """
+    if stream:
+        return stream_ollama(prompt, model, output_format, system)
+    logger.debug(f"Querying Ollama with model '{model}'...")
+    log_prompt(prompt)
     try:
-        response = requests.post(
+        response = get_session(OLLAMA_URL).post(
             f"{OLLAMA_URL}/api/generate",
-            json={"model": model, "prompt": prompt, "stream": False},
-            timeout=60,
+            json=generate_request(prompt, model, False, output_format, system),
+            timeout=request_timeout(60),
         )
         response.raise_for_status()
-        print("Successfully received response from Ollama.")
-        return response.json().get("response", "No response field found in Ollama reply.")
+        logger.debug("Successfully received response from Ollama.")
+        reply = response.json()
+        record_llm_tokens(reply)
+        return reply.get("response", "No response field found in Ollama reply.")
     except requests.exceptions.RequestException as e:
-        print(f"Error calling Ollama API: {e}")
-        print("-- FULL TRACEBACK --")
-        traceback.print_exc()
-        print("-- END TRACEBACK --")
+        logger.exception(f"Error calling Ollama API: {e}")
+        return f"Error: Could not connect to Ollama at {OLLAMA_URL}."
+
+async def call_ollama_async(prompt, model, output_format=None, system=None):
+    """Async version of `call_ollama` (non-streaming) for the ASGI app."""
+    logger.debug(f"Querying Ollama with model '{model}'...")
+    try:
+        response = await get_async_client(OLLAMA_URL).post(
+            f"{OLLAMA_URL}/api/generate",
+            json=generate_request(prompt, model, False, output_format, system),
+            timeout=async_request_timeout(60),
+        )
+        response.raise_for_status()
+        logger.debug("Successfully received response from Ollama.")
+        reply = response.json()
+        record_llm_tokens(reply)
+        return reply.get("response", "No response field found in Ollama reply.")
+    except httpx.HTTPError as e:
+        logger.error(f"Error calling Ollama API: {e!r}")
         return f"Error: Could not connect to Ollama at {OLLAMA_URL}."
+
+def stream_ollama(prompt, model, output_format=None, system=None):
+    """Yields response tokens from Ollama's NDJSON stream as they are generated."""
+    logger.debug(f"Streaming from Ollama with model '{model}'...")
+    log_prompt(prompt)
+    try:
+        # The read timeout applies between chunks, not to the whole generation.
+        with get_session(OLLAMA_URL).post(
+            f"{OLLAMA_URL}/api/generate",
+            json=generate_request(prompt, model, True, output_format, system),
+            stream=True,
+            timeout=request_timeout(60),
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    logger.error(f"Ollama stream error: {chunk['error']}")
+                    yield f"Error: Ollama reported: {chunk['error']}"
+                    return
+                token = chunk.get("response")
+                if token:
+                    yield token
+                if chunk.get("done"):
+                    record_llm_tokens(chunk)
+                    break
+        logger.debug("Finished streaming response from Ollama.")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.exception(f"Error streaming from Ollama API: {e}")
+        yield f"Error: Could not connect to Ollama at {OLLAMA_URL}."
+
+async def stream_ollama_async(prompt, model, output_format=None, system=None):
+    """Async version of `stream_ollama` for the ASGI app."""
+    logger.debug(f"Streaming from Ollama with model '{model}'...")
+    log_prompt(prompt)
+    try:
+        async with get_async_client(OLLAMA_URL).stream(
+            "POST",
+            f"{OLLAMA_URL}/api/generate",
+            json=generate_request(prompt, model, True, output_format, system),
+            timeout=async_request_timeout(60),
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    logger.error(f"Ollama stream error: {chunk['error']}")
+                    yield f"Error: Ollama reported: {chunk['error']}"
+                    return
+                token = chunk.get("response")
+                if token:
+                    yield token
+                if chunk.get("done"):
+                    record_llm_tokens(chunk)
+                    break
+        logger.debug("Finished streaming response from Ollama.")
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error(f"Error streaming from Ollama API: {e!r}")
+        yield f"Error: Could not connect to Ollama at {OLLAMA_URL}."
+
+def get_ollama_embedding(text, model):
+    """Returns the embedding vector for `text` from Ollama's embed endpoint, or None on failure."""
+    embeddings = get_ollama_embeddings([text], model)
+    return embeddings[0] if embeddings else None
+
+def get_ollama_embeddings(texts, model):
+    """
+    Embeds several texts in one call to Ollama's embed endpoint. Returns one vector
+    per text, in order, or None on failure.
+    """
+    try:
+        response = get_session(OLLAMA_URL).post(
+            f"{OLLAMA_URL}/api/embed",
+            json={"model": model, "input": list(texts)},
+            timeout=request_timeout(30),
+        )
+        response.raise_for_status()
+        embeddings = response.json().get("embeddings")
+        if not embeddings or len(embeddings) != len(texts):
+            logger.warning(f"Ollama returned {len(embeddings or [])} embeddings for {len(texts)} texts.")
+            return None
+        return embeddings
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error(f"Error getting embeddings from Ollama: {e}")
+        return None
@@ -0,0 +1,153 @@
+# ai_engine/lib/plan_cache.py
+import os
+import logging
+import re
+import copy
+import math
+import time
+import threading
+from collections import OrderedDict
+
+from lib.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+PLAN_CACHE_SIZE = int(os.environ.get("PLAN_CACHE_SIZE", "256"))
+PLAN_CACHE_TTL = int(os.environ.get("PLAN_CACHE_TTL", "3600"))
+PLAN_CACHE_SIMILARITY = float(os.environ.get("PLAN_CACHE_SIMILARITY", "0.95"))
+
+# Words that flip the meaning of an otherwise near-identical request. Two prompts
+# only share a plan through embedding similarity if they agree on all of these
+# (and on every number), so "turn on" never reuses the plan for "turn off".
+GUARD_WORDS = {
+    "on", "off", "open", "close", "closed", "lock", "unlock", "up", "down", "start", "stop",
+    "increase", "decrease", "raise", "lower", "dim", "brighten", "not", "all", "every",
+}
+
+
+def normalize_prompt(prompt_text):
+    """Lowercases, strips punctuation and collapses whitespace."""
+    words = re.sub(r"[^\w\s%.]", " ", prompt_text.lower()).split()
+    return " ".join(w.strip(".") for w in words if w.strip("."))
+
+
+def _guard_signature(normalized):
+    return frozenset(w for w in normalized.split() if w in GUARD_WORDS or any(c.isdigit() for c in w))
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class PlanCache:
+    """
+    LRU + TTL cache of extracted tool-selection plans (the JSON command list),
+    keyed by model and normalized prompt text.
+
+    Entries carry the entity-set version they were built against and are dropped
+    when that version changes. If `embed_fn` is given, an exact-text miss falls
+    back to the most similar cached prompt above `similarity_threshold`.
+    """
+
+    def __init__(self, max_size=PLAN_CACHE_SIZE, ttl=PLAN_CACHE_TTL, embed_fn=None,
+                 similarity_threshold=PLAN_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, prompt_text, model, version):
+        """Returns a copy of the cached command list, or None on a miss."""
+        normalized = normalize_prompt(prompt_text)
+        key = (model, normalized)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_valid(entry, version, now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record_cache("plan", "hit")
+                return copy.deepcopy(entry["commands"])
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+            has_candidates = self.embed_fn is not None and any(k[0] == model for k in self._entries)
+
+        if has_candidates:
+            match = self._semantic_lookup(normalized, model, version)
+            if match is not None:
+                record_cache("plan", "semantic_hit")
+                return match
+
+        with self._lock:
+            self.misses += 1
+        record_cache("plan", "miss")
+        return None
+
+    def put(self, prompt_text, model, version, commands):
+        normalized = normalize_prompt(prompt_text)
+        embedding = None
+        if self.embed_fn is not None:
+            embedding = self.embed_fn(normalized)
+        with self._lock:
+            self._entries[(model, normalized)] = {
+                "commands": copy.deepcopy(commands),
+                "version": version,
+                "created": time.time(),
+                "embedding": embedding,
+                "guard": _guard_signature(normalized),
+            }
+            self._entries.move_to_end((model, normalized))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+    def _is_valid(self, entry, version, now):
+        return entry["version"] == version and now - entry["created"] <= self.ttl
+
+    def _semantic_lookup(self, normalized, model, version):
+        embedding = self.embed_fn(normalized)
+        if not embedding:
+            return None
+        guard = _guard_signature(normalized)
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, self.similarity_threshold
+            for key, entry in self._entries.items():
+                if key[0] != model or not entry["embedding"] or entry["guard"] != guard:
+                    continue
+                if not self._is_valid(entry, version, now):
+                    continue
+                score = _cosine(embedding, entry["embedding"])
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.semantic_hits += 1
+            logger.debug(f"Plan cache semantic hit for '{normalized}' -> '{best_key[1]}' (similarity {best_score:.3f}).")
+            return copy.deepcopy(self._entries[best_key]["commands"])
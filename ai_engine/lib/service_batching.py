@@ -0,0 +1,92 @@
+# ai_engine/lib/service_batching.py
+import json
+
+from lib.ha_helpers import call_homeassistant_api
+
+
+def _batch_key(task):
+    return task["service"], json.dumps(task.get("parameters") or None, sort_keys=True)
+
+
+def plan_service_calls(tasks):
+    """
+    Coalesces resolved `execute_task` commands that share the same service and
+    parameters into one Home Assistant service call.
+
+    `tasks` is a list of dicts with `service`, `parameters` and `entity_ids` (already
+    group-expanded). Returns a list of batches, in order of first appearance:
+    {"service", "parameters", "entity_ids", "tasks"} where `entity_ids` is the
+    de-duplicated union and `tasks` are the positions in `tasks` it serves.
+    """
+    batches = {}
+    for position, task in enumerate(tasks):
+        key = _batch_key(task)
+        batch = batches.get(key)
+        if batch is None:
+            batch = batches[key] = {
+                "service": task["service"],
+                "parameters": task.get("parameters") or None,
+                "entity_ids": [],
+                "tasks": [],
+            }
+        batch["entity_ids"].extend(task["entity_ids"])
+        batch["tasks"].append(position)
+    for batch in batches.values():
+        batch["entity_ids"] = list(dict.fromkeys(batch["entity_ids"]))
+    return list(batches.values())
+
+
+class StreamingBatcher:
+    """
+    Coalesces `execute_task` commands into service calls while the plan is still
+    streaming in. A resolved task is held as long as the tasks held before it share
+    its service and parameters; a task with different ones, or `flush` once the plan
+    is complete, starts the held run as one batch through `start_fn(batch)`, which
+    puts the running call in batch["call"]. Adjacent tasks thus share a call as
+    they would through `plan_service_calls`; tasks further apart do not.
+
+    `indexes` holds the plan positions of every command added, `tasks` the resolved
+    ones in plan order, `batches` the started batches (their "tasks" are positions
+    in `tasks`) and `failures` the result of each command that failed to resolve,
+    by plan position.
+    """
+
+    def __init__(self, start_fn):
+        self.start_fn = start_fn
+        self.tasks = []
+        self.batches = []
+        self.failures = {}
+        self.indexes = set()
+        self._held = []
+
+    def add(self, index, failure, task):
+        """Adds the `_resolve_task` outcome of the command at plan position `index`."""
+        self.indexes.add(index)
+        if failure:
+            self.failures[index] = failure
+            return
+        task["index"] = index
+        if self._held and _batch_key(self.tasks[self._held[0]]) != _batch_key(task):
+            self.flush()
+        self._held.append(len(self.tasks))
+        self.tasks.append(task)
+
+    def flush(self):
+        """Starts the held run, if any."""
+        if not self._held:
+            return
+        batch = plan_service_calls([self.tasks[position] for position in self._held])[0]
+        batch["tasks"] = self._held
+        self._held = []
+        self.start_fn(batch)
+        self.batches.append(batch)
+
+
+def is_service_call_error(result):
+    """`call_homeassistant_api` reports failures as strings starting with 'Error'."""
+    return isinstance(result, str) and result.startswith("Error")
+
+
+def execute_batch(batch):
+    """Runs one planned batch as a single Home Assistant service call and returns its result."""
+    return call_homeassistant_api(batch["service"], batch["entity_ids"], batch["parameters"])
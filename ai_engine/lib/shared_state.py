@@ -0,0 +1,349 @@
+# ai_engine/lib/shared_state.py
+import os
+import logging
+import re
+import json
+import hashlib
+import time
+import tempfile
+import threading
+import weakref
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - only needed for STATE_BACKEND=redis
+    redis = None
+
+# Where engine caches and conversation state live:
+#   memory - per process (the old behaviour)
+#   file   - JSON files under STATE_DIR (tmpfs by default), shared by every worker on the host
+#   redis  - any Redis-compatible server at REDIS_URL
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "file")
+STATE_DIR = os.environ.get(
+    "STATE_DIR", "/dev/shm/ai_engine_state" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "ai_engine_state")
+)
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.environ.get("STATE_KEY_PREFIX", "ai_engine:")
+# Upper bound on how long a worker waits for a lock, or for another one to finish filling a cache entry.
+STATE_LOCK_TIMEOUT = float(os.environ.get("STATE_LOCK_TIMEOUT", "30"))
+# FileStateStore locks keys through this many lock files, so their number stays fixed
+# however many keys come and go.
+STATE_LOCK_STRIPES = int(os.environ.get("STATE_LOCK_STRIPES", "64"))
+
+
+class StateLockTimeout(TimeoutError):
+    """Raised by a store's `lock` when it is not acquired within STATE_LOCK_TIMEOUT."""
+
+
+class MemoryStateStore:
+    """
+    Process-local store. Also the reference for the store interface: values are
+    JSON-serializable, `ttl` is in seconds and lists are kept with `append`.
+    `lock` raises StateLockTimeout rather than running its block unlocked.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+        # A key's lock lives only while someone holds or waits for it.
+        self._key_locks = weakref.WeakValueDictionary()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get_list(self, key):
+        with self._lock:
+            return list(self.get(key) or [])
+
+    def append(self, key, item, max_len=None):
+        """Appends `item` to the list at `key`, keeping only the newest `max_len` items."""
+        with self._lock:
+            entry = self._data.get(key)
+            items = entry[0] if entry else None
+            # Lists are kept as ring buffers, so appending never copies them.
+            if not isinstance(items, deque) or items.maxlen != max_len:
+                items = deque(items or (), maxlen=max_len or None)
+                self._data[key] = (items, None)
+            items.append(item)
+
+    @contextmanager
+    def lock(self, key):
+        with self._lock:
+            key_lock = self._key_locks.get(key)
+            if key_lock is None:
+                key_lock = self._key_locks[key] = threading.Lock()
+        if not key_lock.acquire(timeout=STATE_LOCK_TIMEOUT):
+            raise StateLockTimeout(f"Timed out waiting for the state lock on '{key}'.")
+        try:
+            yield
+        finally:
+            key_lock.release()
+
+    def get_or_fill(self, key, fill_fn, ttl=None):
+        """
+        Returns the value at `key`, calling `fill_fn` to populate it on a miss. The
+        fill runs under `lock(key)`, so concurrent misses (across workers, for the
+        shared backends) fetch once. Empty results are returned but not stored. If
+        the lock times out, the value is filled without being stored.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        try:
+            with self.lock(key):
+                value = self.get(key)
+                if value is not None:
+                    return value
+                value = fill_fn()
+                if value:
+                    self.set(key, value, ttl)
+                return value
+        except StateLockTimeout as e:
+            logger.warning(f"{e} Filling '{key}' without storing it.")
+            return fill_fn()
+
+
+class FileStateStore(MemoryStateStore):
+    """
+    Stores each key as a JSON file under `directory`, written atomically
+    (write + rename). With the default tmpfs directory this is shared memory for
+    every worker process on the host. `lock` uses flock on one of
+    STATE_LOCK_STRIPES lock files picked by the key's hash; unrelated keys may
+    share one, so locks must not be nested and are only held for a few file
+    operations: `get_or_fill` runs the fill itself outside the lock.
+    """
+
+    def __init__(self, directory=STATE_DIR):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        # The hash keeps names unique and short; the prefix only helps when looking at the directory.
+        readable = re.sub(r"[^\w.-]", "_", key)[:48]
+        return os.path.join(self.directory, f"{readable}-{self._digest(key)[:32]}.json")
+
+    def _lock_path(self, key):
+        return os.path.join(self.directory, f"stripe-{int(self._digest(key), 16) % STATE_LOCK_STRIPES}.lock")
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires") is not None and entry["expires"] < time.time():
+            return None
+        return entry
+
+    def _write(self, key, value, ttl=None):
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"value": value, "expires": time.time() + ttl if ttl else None}, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def get(self, key):
+        entry = self._read(key)
+        return entry["value"] if entry else None
+
+    def set(self, key, value, ttl=None):
+        self._write(key, value, ttl)
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def get_list(self, key):
+        return list(self.get(key) or [])
+
+    def append(self, key, item, max_len=None):
+        # Raises StateLockTimeout rather than risk losing another worker's append.
+        with self.lock(key):
+            items = self.get_list(key)
+            items.append(item)
+            if max_len:
+                items = items[-max_len:]
+            self._write(key, items)
+
+    @contextmanager
+    def lock(self, key):
+        # Threads of one process each open their own descriptor, so flock also
+        # serializes them.
+        with open(self._lock_path(key), "a+") as lock_file:
+            if fcntl is not None:
+                deadline = time.time() + STATE_LOCK_TIMEOUT
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.time() > deadline:
+                            raise StateLockTimeout(f"Timed out waiting for the shared state lock on '{key}'.")
+                        time.sleep(0.05)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_or_fill(self, key, fill_fn, ttl=None):
+        """
+        `MemoryStateStore.get_or_fill` without holding the stripe lock across the
+        fill: under the lock, the first worker to miss leaves a marker for the key
+        that expires after STATE_LOCK_TIMEOUT, then fills. Others wait for the value
+        until the marker is gone, and fill it themselves if it is still missing.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        filling_key = f"{key}:filling"
+        while True:
+            try:
+                with self.lock(key):
+                    value = self.get(key)
+                    if value is not None:
+                        return value
+                    if self._read(filling_key) is None:
+                        self._write(filling_key, True, STATE_LOCK_TIMEOUT)
+                        break
+            except StateLockTimeout as e:
+                logger.warning(f"{e} Filling '{key}' without storing it.")
+                return fill_fn()
+            time.sleep(0.05)
+        try:
+            value = fill_fn()
+            if value:
+                self.set(key, value, ttl)
+            return value
+        finally:
+            self.delete(filling_key)
+
+
+class RedisStateStore(MemoryStateStore):
+    """Stores keys in a Redis-compatible server (Redis, Valkey, KeyDB, ...)."""
+
+    def __init__(self, url=REDIS_URL):
+        super().__init__()
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND=redis requires the 'redis' package.")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def get_list(self, key):
+        return [json.loads(raw) for raw in self.client.lrange(key, 0, -1)]
+
+    def append(self, key, item, max_len=None):
+        pipe = self.client.pipeline()
+        pipe.rpush(key, json.dumps(item))
+        if max_len:
+            pipe.ltrim(key, -max_len, -1)
+        pipe.execute()
+
+    @contextmanager
+    def lock(self, key):
+        lock = self.client.lock(f"{key}:lock", timeout=STATE_LOCK_TIMEOUT, blocking_timeout=STATE_LOCK_TIMEOUT)
+        if not lock.acquire():
+            raise StateLockTimeout(f"Timed out waiting for the shared state lock on '{key}'.")
+        try:
+            yield
+        finally:
+            try:
+                lock.release()
+            except redis.exceptions.LockError:
+                # Held past its timeout and expired.
+                pass
+
+
+class PrefixedStore:
+    """Namespaces every key of `store` with `prefix`, so several engines can share one backend."""
+
+    def __init__(self, store, prefix=STATE_KEY_PREFIX):
+        self.store = store
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.store.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.store.set(self.prefix + key, value, ttl)
+
+    def delete(self, key):
+        self.store.delete(self.prefix + key)
+
+    def get_list(self, key):
+        return self.store.get_list(self.prefix + key)
+
+    def append(self, key, item, max_len=None):
+        self.store.append(self.prefix + key, item, max_len)
+
+    def lock(self, key):
+        return self.store.lock(self.prefix + key)
+
+    def get_or_fill(self, key, fill_fn, ttl=None):
+        return self.store.get_or_fill(self.prefix + key, fill_fn, ttl)
+
+
+def get_state_store(backend=STATE_BACKEND):
+    """Builds the store selected by STATE_BACKEND, falling back to in-process memory if it is unusable."""
+    try:
+        if backend == "redis":
+            store = RedisStateStore()
+            store.client.ping()
+        elif backend == "file":
+            store = FileStateStore()
+        else:
+            store = MemoryStateStore()
+    except Exception as e:
+        logger.warning(f"Shared state backend '{backend}' unavailable ({e}); using in-process state.")
+        backend = "memory"
+        store = MemoryStateStore()
+    logger.info(f"Using '{backend}' shared state backend.")
+    return PrefixedStore(store)
@@ -1,41 +1,80 @@
 # ai_engine/lib/tool_helpers.py
+import logging
+import asyncio
 import numexpr
 from ddgs import DDGS
-from lib.ollama_helpers import call_ollama
+from lib.ollama_helpers import call_ollama, call_ollama_async
+from lib.logging_setup import log_payload
 from lib.prompts import WEB_SEARCH_ANSWER_PROMPT_TEMPLATE, CALCULATOR_ANSWER_PROMPT_TEMPLATE
 
-def handle_web_search(prompt_text, model_to_use):
-    """Handles the web search action."""
-    print(f"Performing web search for: '{prompt_text}'")
-    try:
-        with DDGS() as ddgs:
-            search_results = list(ddgs.text(prompt_text, max_results=5))
+logger = logging.getLogger(__name__)
+
+def search_web(query):
+    """Runs a DuckDuckGo search and returns the results formatted for the LLM (empty if none)."""
+    with DDGS() as ddgs:
+        search_results = list(ddgs.text(query, max_results=5))
+
+    logger.info(f"Web search returned {len(search_results)} results.")
+    log_payload(logger, "search", "Raw search results", search_results)
 
-        print(f"Raw search results: {search_results}") # Debug print
+    # Format results for the LLM
+    return "\n\n".join(
+        [f"Title: {r['title']}\nSnippet: {r['body']}" for r in search_results]
+    )
 
-        if not search_results:
-            return "I couldn't find any information on that topic."
+def handle_web_search(prompt_text, model_to_use, stream=False):
+    """
+    Handles the web search action.
+    With stream=True, returns a generator that yields the answer as it is generated.
+    """
+    logger.debug(f"Performing web search for: '{prompt_text}'")
+    try:
+        formatted_results = search_web(prompt_text)
+    except Exception as e:
+        logger.error(f"Error during web search: {e}")
+        return _as_result("I had a problem searching the web.", stream)
 
-        # Format results for the LLM
-        formatted_results = "\n\n".join(
-            [f"Title: {r['title']}\nSnippet: {r['body']}" for r in search_results]
-        )
+    if not formatted_results:
+        return _as_result("I couldn't find any information on that topic.", stream)
 
-        # Create a new prompt to generate an answer
-        answer_prompt = WEB_SEARCH_ANSWER_PROMPT_TEMPLATE.format(
-            prompt=prompt_text, search_results=formatted_results
-        )
+    # Create a new prompt to generate an answer
+    answer_prompt = WEB_SEARCH_ANSWER_PROMPT_TEMPLATE.format(
+        prompt=prompt_text, search_results=formatted_results
+    )
 
-        final_answer = call_ollama(answer_prompt, model_to_use)
-        return final_answer.strip()
+    if stream:
+        return call_ollama(answer_prompt, model_to_use, stream=True)
+    final_answer = call_ollama(answer_prompt, model_to_use)
+    return final_answer.strip()
 
+async def handle_web_search_async(prompt_text, model_to_use):
+    """
+    Async version of `handle_web_search` (non-streaming). DDGS only has a blocking
+    client, so the search itself runs on a worker thread.
+    """
+    logger.debug(f"Performing web search for: '{prompt_text}'")
+    try:
+        formatted_results = await asyncio.to_thread(search_web, prompt_text)
     except Exception as e:
-        print(f"Error during web search: {e}")
+        logger.error(f"Error during web search: {e}")
         return "I had a problem searching the web."
 
+    if not formatted_results:
+        return "I couldn't find any information on that topic."
+
+    answer_prompt = WEB_SEARCH_ANSWER_PROMPT_TEMPLATE.format(
+        prompt=prompt_text, search_results=formatted_results
+    )
+    final_answer = await call_ollama_async(answer_prompt, model_to_use)
+    return final_answer.strip()
+
+def _as_result(message, stream):
+    """Wraps a fixed message so callers in streaming mode can always iterate the result."""
+    return iter([message]) if stream else message
+
 def perform_calculation(expression):
     """Safely evaluates a mathematical expression."""
-    print(f"Performing calculation for: '{expression}'")
+    logger.debug(f"Performing calculation for: '{expression}'")
     try:
         # numexpr is generally safe, but we can add a layer of sanitization
         # This is a simple check; more complex validation could be added.
@@ -49,5 +88,5 @@ def perform_calculation(expression):
         result = numexpr.evaluate(sanitized_expression).item()
         return str(result)
     except Exception as e:
-        print(f"Error during calculation: {e}")
+        logger.error(f"Error during calculation: {e}")
         return f"I had a problem calculating that. The error was: {e}"
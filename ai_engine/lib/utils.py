@@ -1,70 +1,72 @@
 # ai_engine/lib/utils.py
-import json
-import re
 import difflib
 
+from lib.command_parsing import parse_commands
+
 def extract_json_commands(text):
-    """Extracts the first valid JSON object or array from a string."""
-    # Regex to find JSON in a markdown code block, non-greedy
-    match = re.search(r"```(json)?\s*([\s\S]*?)\s*```", text)
-    if match:
-        code_block = match.group(2)
-        try:
-            parsed_json = json.loads(code_block)
-            if isinstance(parsed_json, list):
-                return parsed_json
-            elif isinstance(parsed_json, dict):
-                return [parsed_json]
-        except json.JSONDecodeError:
-            # If parsing the first block fails, don't proceed to other fallbacks
-            # as the AI's intent was likely in this block.
-            return []
-
-    # Fallback for text that is just a JSON object/array without markdown
-    try:
-        parsed_json = json.loads(text)
-        if isinstance(parsed_json, list):
-            return parsed_json
-        elif isinstance(parsed_json, dict):
-            return [parsed_json]
-    except json.JSONDecodeError:
-        pass
-
-    # Fallback to find the first { or [ and its matching } or ]
-    # This is a last resort and can be unreliable.
-    try:
-        first_brace = text.find('{')
-        first_bracket = text.find('[')
-
-        start_index = -1
-        if first_brace != -1 and first_bracket != -1:
-            start_index = min(first_brace, first_bracket)
-        elif first_brace != -1:
-            start_index = first_brace
-        else:
-            start_index = first_bracket
+    """
+    Extracts the commands from an LLM reply: the elements of the first JSON array,
+    or the first JSON object, wherever they sit in the text (bare, in a ```json
+    block, or followed by prose). Returns [] if the reply holds none.
+    """
+    return parse_commands(text)
+
+STOP_WORDS = {"what", "is", "the", "tell", "me", "about", "when", "was", "how", "long", "history", "of", "a", "an", "last", "on", "off", "open", "closed", "set", "to", "in", "were", "status", "current"}
+
+DOMAIN_KEYWORDS = {"light": "light", "lights": "light", "switch": "switch", "fan": "fan", "sensor": "sensor", "lock": "lock", "cover": "cover", "climate": "climate"}
+
+def get_prompt_keywords(prompt_text):
+    """Cleans up the prompt to get the set of relevant keywords."""
+    return set(
+        [word for word in prompt_text.lower().replace("?", "").split() if word not in STOP_WORDS]
+    )
 
-        if start_index == -1:
-            return []
+def detect_domain(prompt_words):
+    """Returns the entity domain named in the prompt keywords (e.g. 'lights' -> 'light'), if any."""
+    for keyword, domain in DOMAIN_KEYWORDS.items():
+        if keyword in prompt_words:
+            return domain
+    return None
 
-        json_str = text[start_index:]
-        parsed_json = json.loads(json_str)
-        if isinstance(parsed_json, list):
-            return parsed_json
-        elif isinstance(parsed_json, dict):
-            return [parsed_json]
-    except (json.JSONDecodeError, IndexError):
-        pass
+def score_entity(prompt_words, detected_domain, entity_id, friendly_name):
+    """Keyword score of a single entity against the prompt keywords."""
+    friendly_name_lower = friendly_name.lower()
+    entity_id_lower = entity_id.lower()
 
-    return []
+    score = 0
 
-def find_best_matching_entity(prompt_text, all_entities, target_text=None):
+    # Score based on matching words from the prompt
+    fn_words = set(friendly_name_lower.split())
+    eid_words = set(entity_id_lower.replace('.', ' ').replace('_', ' ').split())
+
+    score += len(prompt_words.intersection(fn_words)) * 3
+    score += len(prompt_words.intersection(eid_words)) * 1
+
+    # Bonus for matching all words of the friendly name
+    if fn_words.issubset(prompt_words):
+        score += 10
+
+    # Apply domain bonus
+    if detected_domain and entity_id.startswith(detected_domain + "."):
+        score += 15
+
+    return score
+
+def score_area(prompt_words, area_name):
+    """Number of words the area name shares with the prompt."""
+    return len(prompt_words.intersection(area_name.lower().split()))
+
+def find_best_matching_entity(prompt_text, all_entities, target_text=None, index=None):
     """
     Finds the best entity match.
     - If target_text is provided, it uses fuzzy string matching for self-correction.
     - Otherwise, it uses a keyword scoring algorithm to extract an entity from a prompt.
+    If a prebuilt EntityIndex for all_entities is given, the lookup is delegated to it.
     Returns a tuple of (best_match_entity_id, score).
     """
+    if index is not None:
+        return index.find_best_match(prompt_text, target_text)
+
     # --- Self-Correction Mode ---
     if target_text:
         text_to_match = target_text
@@ -86,11 +88,7 @@ def find_best_matching_entity(prompt_text, all_entities, target_text=None):
 
     # --- Entity Extraction Mode ---
     else:
-        # Clean up the prompt to get relevant keywords
-        stop_words = {"what", "is", "the", "tell", "me", "about", "when", "was", "how", "long", "history", "of", "a", "an", "last", "on", "off", "open", "closed", "set", "to", "in", "were", "status", "current"}
-        prompt_words = set(
-            [word for word in prompt_text.lower().replace("?", "").split() if word not in stop_words]
-        )
+        prompt_words = get_prompt_keywords(prompt_text)
 
         if not prompt_words:
             return None, 0
@@ -98,34 +96,10 @@ def find_best_matching_entity(prompt_text, all_entities, target_text=None):
         best_match = None
         highest_score = 0
 
-        # --- Domain Keyword Bonus ---
-        domain_keywords = {"light": "light", "lights": "light", "switch": "switch", "fan": "fan", "sensor": "sensor", "lock": "lock", "cover": "cover", "climate": "climate"}
-        detected_domain = None
-        for keyword, domain in domain_keywords.items():
-            if keyword in prompt_words:
-                detected_domain = domain
-                break
+        detected_domain = detect_domain(prompt_words)
 
         for entity_id, friendly_name in all_entities.items():
-            friendly_name_lower = friendly_name.lower()
-            entity_id_lower = entity_id.lower()
-            
-            score = 0
-            
-            # Score based on matching words from the prompt
-            fn_words = set(friendly_name_lower.split())
-            eid_words = set(entity_id_lower.replace('.', ' ').replace('_', ' ').split())
-
-            score += len(prompt_words.intersection(fn_words)) * 3
-            score += len(prompt_words.intersection(eid_words)) * 1
-
-            # Bonus for matching all words of the friendly name
-            if fn_words.issubset(prompt_words):
-                score += 10
-
-            # Apply domain bonus
-            if detected_domain and entity_id.startswith(detected_domain + "."):
-                score += 15
+            score = score_entity(prompt_words, detected_domain, entity_id, friendly_name)
 
             if score > highest_score:
                 highest_score = score
@@ -144,8 +118,7 @@ def find_best_matching_area(prompt_text, area_data):
     highest_score = 0
 
     for area_name in area_data.keys():
-        area_name_words = set(area_name.lower().split())
-        score = len(prompt_words.intersection(area_name_words))
+        score = score_area(prompt_words, area_name)
         if score > highest_score:
             highest_score = score
             best_match = area_name
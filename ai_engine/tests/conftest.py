@@ -0,0 +1,39 @@
+# ai_engine/tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# The engine's modules import each other as `lib.*`, relative to ai_engine/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+@pytest.fixture
+def fake_ha():
+    """A FakeHomeAssistant websocket server, shut down after the test."""
+    pytest.importorskip("websockets.sync.server")
+    from fake_ha import FakeHomeAssistant
+    server = FakeHomeAssistant()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def start_mirror(fake_ha):
+    """Starts HAStateMirror instances against `fake_ha`; stops them after the test."""
+    from lib import ha_state_mirror
+    if ha_state_mirror.websocket is None:
+        pytest.skip("websocket-client is not installed")
+    mirrors = []
+
+    def start(token=fake_ha.token, resync_interval=600):
+        mirror = ha_state_mirror.HAStateMirror(
+            ws_url=fake_ha.url, token=token, resync_interval=resync_interval, fetch_states=fake_ha.fetch_states
+        )
+        mirrors.append(mirror)
+        mirror.start()
+        return mirror
+
+    yield start
+    for mirror in mirrors:
+        mirror.stop()
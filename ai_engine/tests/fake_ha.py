@@ -0,0 +1,111 @@
+# ai_engine/tests/fake_ha.py
+import json
+import time
+import threading
+
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.server import serve
+
+REGISTRY_COMMANDS = {
+    "config/area_registry/list": "area",
+    "config/device_registry/list": "device",
+    "config/entity_registry/list": "entity",
+}
+
+
+def wait_for(predicate, timeout=5.0):
+    """Polls `predicate` until it is true; fails the test after `timeout` seconds."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"timed out after {timeout}s waiting for {predicate}")
+
+
+class FakeHomeAssistant:
+    """
+    Plays the parts of the Home Assistant websocket API the state mirror uses:
+    the auth handshake, subscribe_events and the three registry list commands.
+    `fetch_states` stands in for GET /api/states. Every message received is kept
+    in `received`, per connection, for the tests to inspect. Built on the
+    `websockets` package; the tests that use it are skipped without it.
+    """
+
+    def __init__(self, token="test-token"):
+        self.token = token
+        self.states = []
+        self.registries = {"area": [], "device": [], "entity": []}
+        self.received = []          # (connection number, message)
+        self.resyncs = []           # whether state_changed was subscribed when each resync ran
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._subscriptions = {}    # event type -> subscription id, for the current connection
+        self._server = serve(self._handle, "127.0.0.1", 0, close_timeout=1)
+        self.url = f"ws://127.0.0.1:{self._server.socket.getsockname()[1]}/api/websocket"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+
+    def fetch_states(self):
+        # The mirror subscribes, then resyncs: give a subscription sent just before time to arrive.
+        try:
+            wait_for(lambda: "state_changed" in self._subscriptions, timeout=1)
+            subscribed = True
+        except AssertionError:
+            subscribed = False
+        with self._lock:
+            self.resyncs.append(subscribed)
+            return [dict(state) for state in self.states]
+
+    def commands(self, msg_type):
+        """Messages of `msg_type` received so far, over every connection."""
+        with self._lock:
+            return [msg for _, msg in self.received if msg.get("type") == msg_type]
+
+    def send_event(self, event_type, data):
+        """Sends an event to the connection subscribed to `event_type`."""
+        sub_id = self._subscriptions[event_type]
+        self._connection.send(json.dumps({
+            "id": sub_id, "type": "event", "event": {"event_type": event_type, "data": data},
+        }))
+
+    def drop(self):
+        """Closes the current connection from the server side, without waiting for the closing handshake."""
+        threading.Thread(target=self._connection.close, daemon=True).start()
+
+    def _handle(self, connection):
+        with self._lock:
+            self.connections += 1
+            number = self.connections
+        connection.send(json.dumps({"type": "auth_required", "ha_version": "2024.1.0"}))
+        try:
+            auth = json.loads(connection.recv())
+            with self._lock:
+                self.received.append((number, auth))
+            if auth.get("type") != "auth" or auth.get("access_token") != self.token:
+                connection.send(json.dumps({"type": "auth_invalid", "message": "Invalid access token"}))
+                return
+            self._subscriptions = {}
+            self._connection = connection
+            connection.send(json.dumps({"type": "auth_ok", "ha_version": "2024.1.0"}))
+            while True:
+                msg = json.loads(connection.recv())
+                with self._lock:
+                    self.received.append((number, msg))
+                if msg["type"] == "subscribe_events":
+                    self._subscriptions[msg["event_type"]] = msg["id"]
+                    connection.send(json.dumps({"id": msg["id"], "type": "result", "success": True, "result": None}))
+                elif msg["type"] in REGISTRY_COMMANDS:
+                    with self._lock:
+                        items = list(self.registries[REGISTRY_COMMANDS[msg["type"]]])
+                    connection.send(json.dumps({"id": msg["id"], "type": "result", "success": True, "result": items}))
+                else:
+                    connection.send(json.dumps({
+                        "id": msg.get("id"), "type": "result", "success": False,
+                        "error": {"code": "unknown_command", "message": "Unknown command."},
+                    }))
+        except ConnectionClosed:
+            pass
@@ -0,0 +1,61 @@
+# ai_engine/tests/fake_ollama.py
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOllama:
+    """
+    Plays Ollama's streaming /api/generate: the reply goes out as NDJSON chunks of
+    `chunk_size` characters, then a final `done` chunk with the token counts and
+    timings in `stats`. Every request body is kept in `requests`.
+    """
+
+    def __init__(self, reply="", chunk_size=4, stats=None):
+        self.reply = reply
+        self.chunk_size = chunk_size
+        self.stats = stats or {}
+        self.requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                fake.requests.append(body)
+                if not body.get("stream"):
+                    self._send(json.dumps({"response": fake.reply, "done": True, **fake.stats}).encode())
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                text = fake.reply
+                for i in range(0, len(text), fake.chunk_size):
+                    self._chunk({"response": text[i:i + fake.chunk_size], "done": False})
+                self._chunk({"response": "", "done": True, "done_reason": "stop", **fake.stats})
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _chunk(self, message):
+                line = (json.dumps(message) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def _send(self, payload):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
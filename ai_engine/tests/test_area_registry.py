@@ -0,0 +1,95 @@
+# ai_engine/tests/test_area_registry.py
+import pytest
+
+pytest.importorskip("websockets.sync.server")
+from fake_ha import wait_for
+
+
+def state(entity_id, friendly_name):
+    return {"entity_id": entity_id, "state": "on", "attributes": {"friendly_name": friendly_name}}
+
+
+AREAS = [
+    {"area_id": "kitchen", "name": "Kitchen"},
+    {"area_id": "living_room", "name": "Living Room"},
+    {"area_id": "garage", "name": "Garage"},
+]
+DEVICES = [
+    {"id": "dev_kitchen", "area_id": "kitchen"},
+    {"id": "dev_living", "area_id": "living_room"},
+    {"id": "dev_nowhere", "area_id": None},
+]
+ENTITIES = [
+    # Inherits its device's area.
+    {"entity_id": "light.kitchen_ceiling", "device_id": "dev_kitchen", "area_id": None},
+    # Its own area overrides the device's.
+    {"entity_id": "light.reading_lamp", "device_id": "dev_kitchen", "area_id": "living_room"},
+    # No device, area set directly.
+    {"entity_id": "switch.garage_door", "device_id": None, "area_id": "garage"},
+    # Neither the entity nor its device has an area.
+    {"entity_id": "sensor.outdoor_temperature", "device_id": "dev_nowhere", "area_id": None},
+    # Hidden entities keep their state, so the template lists them.
+    {"entity_id": "light.tv_backlight", "device_id": "dev_living", "area_id": None, "hidden_by": "user"},
+    # Disabled entities have no state, so the template never sees them.
+    {"entity_id": "light.kitchen_spare", "device_id": "dev_kitchen", "area_id": None, "disabled_by": "user"},
+]
+STATES = [
+    # In /api/states order, which is not entity_id order.
+    state("switch.garage_door", "Garage Door"),
+    state("light.reading_lamp", "Reading Lamp"),
+    state("sensor.outdoor_temperature", "Outdoor Temperature"),
+    state("light.tv_backlight", "TV Backlight"),
+    state("light.kitchen_ceiling", "Kitchen Ceiling"),
+    # Not in the entity registry at all (e.g. defined in YAML without a unique id).
+    state("sun.sun", "Sun"),
+]
+# What AREA_DATA_TEMPLATE renders for the above: HA iterates `states` by entity_id.
+TEMPLATE_AREA_DATA = {
+    "Kitchen": [{"entity_id": "light.kitchen_ceiling", "friendly_name": "Kitchen Ceiling"}],
+    "Living Room": [
+        {"entity_id": "light.reading_lamp", "friendly_name": "Reading Lamp"},
+        {"entity_id": "light.tv_backlight", "friendly_name": "TV Backlight"},
+    ],
+    "Garage": [{"entity_id": "switch.garage_door", "friendly_name": "Garage Door"}],
+}
+
+
+@pytest.fixture
+def mirror(fake_ha, start_mirror):
+    fake_ha.states = STATES
+    fake_ha.registries = {"area": list(AREAS), "device": list(DEVICES), "entity": list(ENTITIES)}
+    mirror = start_mirror()
+    wait_for(lambda: mirror.connected and mirror.areas_ready())
+    return mirror
+
+
+def test_area_data_matches_template(mirror):
+    area_data = mirror.get_area_data()
+    assert area_data == TEMPLATE_AREA_DATA
+    # Same key and list order as the template's JSON, too.
+    assert list(area_data) == list(TEMPLATE_AREA_DATA)
+    assert mirror.registry.area_of("light.kitchen_spare") == "Kitchen"
+    assert mirror.registry.area_of("sun.sun") is None
+
+
+def test_registry_update_relists_that_registry(fake_ha, mirror):
+    lists_before = {t: len(fake_ha.commands(t)) for t in
+                    ("config/area_registry/list", "config/device_registry/list", "config/entity_registry/list")}
+    assert lists_before == dict.fromkeys(lists_before, 1)
+
+    fake_ha.registries["device"] = [dict(d, area_id="garage") if d["id"] == "dev_nowhere" else d for d in DEVICES]
+    fake_ha.send_event("device_registry_updated", {"action": "update", "device_id": "dev_nowhere"})
+    wait_for(lambda: "sensor.outdoor_temperature" in [e["entity_id"] for e in mirror.get_area_data().get("Garage", [])])
+
+    assert len(fake_ha.commands("config/device_registry/list")) == 2
+    assert len(fake_ha.commands("config/area_registry/list")) == 1
+    assert len(fake_ha.commands("config/entity_registry/list")) == 1
+    assert mirror.get_area_data()["Garage"] == [
+        {"entity_id": "sensor.outdoor_temperature", "friendly_name": "Outdoor Temperature"},
+        {"entity_id": "switch.garage_door", "friendly_name": "Garage Door"},
+    ]
+
+    fake_ha.registries["area"] = [dict(a, name="Lounge") if a["area_id"] == "living_room" else a for a in AREAS]
+    fake_ha.send_event("area_registry_updated", {"action": "update", "area_id": "living_room"})
+    wait_for(lambda: "Lounge" in mirror.get_area_data())
+    assert "Living Room" not in mirror.get_area_data()
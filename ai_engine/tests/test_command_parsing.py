@@ -0,0 +1,86 @@
+# ai_engine/tests/test_command_parsing.py
+import json
+
+import pytest
+
+from lib.command_parsing import IncrementalCommandParser, parse_commands
+
+TURN_ON = {"action": "execute_task", "service": "light.turn_on", "entity_id": "light.kitchen",
+           "parameters": {"brightness_pct": 40}}
+SEARCH = {"action": "web_search", "query": 'say "hi" \\ [not a bracket] {nor this}'}
+PLAN = json.dumps([TURN_ON, SEARCH])
+
+
+def feed_in_chunks(text, size):
+    parser = IncrementalCommandParser()
+    found = []
+    for i in range(0, len(text), size):
+        found.extend(parser.feed(text[i:i + size]))
+    return parser, found
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, len(PLAN)])
+def test_chunk_boundaries_inside_strings_and_escapes(size):
+    # Every split point, including between a backslash and the character it escapes.
+    parser, found = feed_in_chunks(PLAN, size)
+    assert found == [TURN_ON, SEARCH]
+    assert parser.done
+    assert parser.close() == [TURN_ON, SEARCH]
+
+
+def test_each_command_is_returned_as_soon_as_it_closes():
+    parser = IncrementalCommandParser()
+    first_end = PLAN.index("}}") + 2
+    assert parser.feed(PLAN[:first_end - 1]) == []
+    assert parser.feed(PLAN[first_end - 1:first_end]) == [TURN_ON]
+    assert not parser.done
+    assert parser.feed(PLAN[first_end:]) == [SEARCH]
+    assert parser.done
+
+
+def test_prose_before_and_after_the_array():
+    reply = f'Sure [happy to help]! "Quotes" too.\n```json\n{PLAN}\n```\nThat turns on the [kitchen] light.'
+    assert parse_commands(reply) == [TURN_ON, SEARCH]
+    _, found = feed_in_chunks(reply, 5)
+    assert found == [TURN_ON, SEARCH]
+
+
+def test_lone_object_and_commands_wrapper():
+    assert parse_commands(f"Here you go: {json.dumps(TURN_ON)} done.") == [TURN_ON]
+    assert parse_commands(json.dumps({"commands": [TURN_ON, SEARCH]})) == [TURN_ON, SEARCH]
+
+
+def test_malformed_object_is_skipped():
+    reply = '[{"action": "execute_task", "service": }, ' + json.dumps(TURN_ON) + "]"
+    parser, found = feed_in_chunks(reply, 4)
+    assert found == [TURN_ON]
+    assert parser.done
+
+
+def test_truncated_reply_keeps_completed_commands():
+    parser, found = feed_in_chunks(PLAN[:-10], 3)
+    assert found == [TURN_ON]
+    assert not parser.done
+    assert parser.close() == [TURN_ON]
+
+
+def test_done_ignores_text_after_the_plan():
+    parser = IncrementalCommandParser()
+    assert parser.feed("[]") == []
+    assert parser.done
+    # Anything after the plan closed, even another command, is ignored.
+    assert parser.feed(json.dumps([TURN_ON])) == []
+    assert parser.close() == []
+
+
+def test_bracketed_prose_does_not_end_the_reply():
+    parser = IncrementalCommandParser()
+    parser.feed("Step [1] of the plan: ")
+    assert not parser.done
+    assert parser.feed(PLAN) == [TURN_ON, SEARCH]
+    assert parser.done
+
+
+def test_no_commands():
+    assert parse_commands("I can't help with that.") == []
+    assert parse_commands("") == []
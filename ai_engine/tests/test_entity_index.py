@@ -0,0 +1,91 @@
+# ai_engine/tests/test_entity_index.py
+import difflib
+import random
+
+import pytest
+
+from lib.entity_index import EntityIndex
+from lib.utils import find_best_matching_entity
+
+ROOMS = [
+    "Kitchen", "Living Room", "Bedroom", "Master Bedroom", "Guest Bedroom", "Kids Room", "Office",
+    "Bathroom", "Hallway", "Garage", "Basement", "Attic", "Dining Room", "Porch", "Garden", "Laundry",
+]
+DEVICES = [
+    ("light", "Ceiling Light"), ("light", "Lamp"), ("light", "Strip"), ("switch", "Outlet"),
+    ("switch", "Fan"), ("fan", "Fan"), ("cover", "Blinds"), ("climate", "Thermostat"),
+    ("sensor", "Temperature"), ("sensor", "Humidity"), ("binary_sensor", "Motion"),
+    ("binary_sensor", "Door"), ("media_player", "Speaker"), ("lock", "Door Lock"),
+]
+
+
+def build_home():
+    """A home of ~1,000 entities with the overlapping names real installs have."""
+    entities = {}
+    for room in ROOMS:
+        for domain, kind in DEVICES:
+            for n in range(1, 5):
+                suffix = f" {n}" if n > 1 else ""
+                name = f"{room} {kind}{suffix}"
+                entity_id = f"{domain}.{name.lower().replace(' ', '_')}"
+                entities[entity_id] = name
+    return entities
+
+
+def misspell(text, rng):
+    chars = list(text)
+    for _ in range(rng.randint(1, 3)):
+        i = rng.randrange(len(chars))
+        op = rng.choice(("drop", "swap", "replace", "insert"))
+        if op == "drop" and len(chars) > 3:
+            del chars[i]
+        elif op == "swap" and i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        elif op == "insert":
+            chars.insert(i, rng.choice("abcdefghijklmnopqrstuvwxyz_ "))
+        else:
+            chars[i] = rng.choice("abcdefghijklmnopqrstuvwxyz_")
+    return "".join(chars)
+
+
+@pytest.fixture(scope="module")
+def home():
+    entities = build_home()
+    return entities, EntityIndex(entities, version=1)
+
+
+def fuzzy_targets(entities, count=250, seed=3):
+    rng = random.Random(seed)
+    entity_ids = list(entities)
+    targets = []
+    for _ in range(count):
+        entity_id = rng.choice(entity_ids)
+        target = rng.choice((entity_id, entities[entity_id], entities[entity_id].lower()))
+        if rng.random() < 0.2 and "." in target:
+            target = "switch." + target.split(".", 1)[1]
+        targets.append(misspell(target, rng))
+    # Nothing close, and strings sharing no trigram with any entity.
+    return targets + ["garage door opener", "zzzz", "xq", "Ktchn", "sensor.outdoor_temp"]
+
+
+def test_fuzzy_match_equals_get_close_matches(home):
+    entities, index = home
+    candidates = list(entities.keys()) + list(entities.values())
+    for target in fuzzy_targets(entities):
+        expected = difflib.get_close_matches(target, candidates, n=1, cutoff=0.6)
+        assert index.fuzzy_match(target) == (expected[0] if expected else None), target
+
+
+def test_find_best_match_equals_linear_scan(home):
+    entities, index = home
+    for target in fuzzy_targets(entities, count=80, seed=11):
+        prompt = f"turn on the {target}"
+        assert find_best_matching_entity(prompt, entities, target_text=target, index=index) == \
+            find_best_matching_entity(prompt, entities, target_text=target), target
+
+
+def test_fuzzy_match_exact_names(home):
+    entities, index = home
+    assert index.fuzzy_match("Kitchen Lamp") == "Kitchen Lamp"
+    assert index.find_best_match("", "Kitchen Lamp") == ("light.kitchen_lamp", 10)
+    assert index.find_best_match("", "light.kitchen_lamp") == ("light.kitchen_lamp", 10)
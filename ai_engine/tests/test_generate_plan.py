@@ -0,0 +1,84 @@
+# ai_engine/tests/test_generate_plan.py
+import os
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("chromadb")
+from prometheus_client import REGISTRY
+
+from fake_ollama import FakeOllama
+
+PLAN = [
+    {"action": "execute_task", "service": "light.turn_on", "entity_id": "light.kitchen_ceiling"},
+    {"action": "execute_task", "service": "fan.turn_on", "entity_id": "fan.bedroom"},
+]
+ENTITIES = {"light.kitchen_ceiling": "Kitchen Ceiling", "fan.bedroom": "Bedroom Fan"}
+# What Ollama reports in its final chunk, durations in nanoseconds.
+STATS = {"prompt_eval_count": 812, "prompt_eval_duration": 250_000_000, "eval_count": 57, "eval_duration": 900_000_000}
+
+
+@pytest.fixture(scope="module")
+def app_module():
+    # Importing the app builds the engine; keep it off the network and the shared state directory.
+    for name, value in {"HA_STATE_MIRROR": "false", "STATE_BACKEND": "memory", "PLAN_CACHE": "false"}.items():
+        os.environ.setdefault(name, value)
+    import app
+    app.ai_engine.state_store.set(app.AREA_CACHE_KEY, {"Kitchen": [
+        {"entity_id": "light.kitchen_ceiling", "friendly_name": "Kitchen Ceiling"},
+    ]}, ttl=3600)
+    return app
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    from lib import ollama_helpers
+    server = FakeOllama(json.dumps(PLAN), chunk_size=7, stats=STATS)
+    monkeypatch.setattr(ollama_helpers, "OLLAMA_URL", server.url)
+    yield server
+    server.close()
+
+
+def token_metrics():
+    return (
+        REGISTRY.get_sample_value("ai_engine_llm_tokens_total", {"kind": "prompt"}) or 0,
+        REGISTRY.get_sample_value("ai_engine_llm_tokens_total", {"kind": "completion"}) or 0,
+        REGISTRY.get_sample_value("ai_engine_llm_prompt_eval_seconds_count") or 0,
+        REGISTRY.get_sample_value("ai_engine_llm_prompt_eval_seconds_sum") or 0,
+    )
+
+
+def generate_sync(app_module, on_command, on_plan_done):
+    return app_module.ai_engine._generate_plan(
+        "turn on the kitchen light and the bedroom fan", "llama3", ENTITIES,
+        on_command=on_command, on_plan_done=on_plan_done,
+    )
+
+
+def generate_async(app_module, on_command, on_plan_done):
+    pytest.importorskip("starlette")
+    import asgi
+    return asyncio.run(asgi.processor._generate_plan(
+        "turn on the kitchen light and the bedroom fan", "llama3", ENTITIES,
+        on_command=on_command, on_plan_done=on_plan_done,
+    ))
+
+
+@pytest.mark.parametrize("generate", [generate_sync, generate_async], ids=["flask", "asgi"])
+def test_generate_plan_records_ollama_token_counts(app_module, ollama, generate):
+    before = token_metrics()
+    seen = []
+    commands = generate(app_module, lambda index, command: seen.append((index, command)), lambda: seen.append("done"))
+    after = token_metrics()
+
+    assert commands == PLAN
+    assert seen == [(0, PLAN[0]), (1, PLAN[1]), "done"]
+    assert ollama.requests[-1]["stream"] is True
+    # The counts only arrive in the chunk after the plan closed.
+    prompt_tokens, completion_tokens, evals, eval_seconds = (a - b for a, b in zip(after, before))
+    assert prompt_tokens == STATS["prompt_eval_count"]
+    assert completion_tokens == STATS["eval_count"]
+    assert evals == 1
+    assert eval_seconds == pytest.approx(0.25)
@@ -0,0 +1,61 @@
+# ai_engine/tests/test_group_index.py
+from lib.group_index import GroupIndex, get_group_index
+from lib.ha_helpers import expand_ha_groups
+
+
+def group(entity_id, *members):
+    return {"entity_id": entity_id, "state": "on", "attributes": {"entity_id": list(members)}}
+
+
+def light(entity_id):
+    return {"entity_id": entity_id, "state": "off", "attributes": {}}
+
+
+def test_nested_groups_expand_to_every_leaf():
+    states = [
+        group("group.house", "group.downstairs", "group.upstairs"),
+        group("group.downstairs", "group.kitchen", "light.hall"),
+        # Reached through both floors; its lights are listed once.
+        group("group.kitchen", "light.k1", "light.k2"),
+        group("group.upstairs", "light.bed", "group.kitchen", "group.missing"),
+        # A group with a single member stored as a string.
+        {"entity_id": "group.porch", "state": "on", "attributes": {"entity_id": "light.porch"}},
+        light("light.hall"), light("light.k1"), light("light.k2"), light("light.bed"), light("light.porch"),
+    ]
+    index = GroupIndex(states)
+    assert index.closure["group.house"] == {"light.hall", "light.k1", "light.k2", "light.bed", "group.missing"}
+    assert index.closure["group.downstairs"] == {"light.hall", "light.k1", "light.k2"}
+    assert index.closure["group.porch"] == {"light.porch"}
+    assert index.cycles == []
+    assert sorted(index.expand(["group.kitchen", "light.bed"])) == ["light.bed", "light.k1", "light.k2"]
+    # Unknown groups and plain entities are kept as they are.
+    assert index.expand("group.missing") == ["group.missing"]
+    assert sorted(expand_ha_groups("group.upstairs", states)) == ["group.missing", "light.bed", "light.k1", "light.k2"]
+
+
+def test_cycles_are_cut_and_recorded():
+    states = [
+        group("group.self", "group.self", "light.a"),
+        group("group.ring_a", "group.ring_b", "light.b"),
+        group("group.ring_b", "group.ring_c", "light.c"),
+        group("group.ring_c", "group.ring_a", "light.d"),
+        group("group.outer", "group.ring_b"),
+    ]
+    index = GroupIndex(states)
+    assert index.closure["group.self"] == {"light.a"}
+    for ring in ("group.ring_a", "group.ring_b", "group.ring_c", "group.outer"):
+        assert index.closure[ring] == {"light.b", "light.c", "light.d"}
+    assert ["group.self", "group.self"] in index.cycles
+    assert ["group.ring_a", "group.ring_b", "group.ring_c", "group.ring_a"] in index.cycles
+
+
+def test_shared_index_rebuilds_only_when_groups_change():
+    states = [group("group.kitchen", "light.k1"), light("light.k1")]
+    index = get_group_index(states)
+    # Same groups, other states changed: the same index is reused.
+    assert get_group_index([group("group.kitchen", "light.k1"), dict(light("light.k1"), state="on")]) is index
+    changed = get_group_index([group("group.kitchen", "light.k1", "light.k2")])
+    assert changed is not index
+    assert changed.closure["group.kitchen"] == {"light.k1", "light.k2"}
+    assert get_group_index(states, version=("mirror", 1)) is not changed
+    assert get_group_index([], version=("mirror", 1)).closure == {"group.kitchen": {"light.k1"}}
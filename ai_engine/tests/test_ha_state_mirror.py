@@ -0,0 +1,90 @@
+# ai_engine/tests/test_ha_state_mirror.py
+import pytest
+
+pytest.importorskip("websockets.sync.server")
+from fake_ha import wait_for
+
+
+def state(entity_id, friendly_name, value="off", **attributes):
+    return {"entity_id": entity_id, "state": value, "attributes": dict(attributes, friendly_name=friendly_name)}
+
+
+@pytest.fixture
+def mirror(fake_ha, start_mirror):
+    fake_ha.states = [state("light.kitchen", "Kitchen Light"), state("fan.bedroom", "Bedroom Fan")]
+    mirror = start_mirror()
+    wait_for(lambda: mirror.connected)
+    return mirror
+
+
+def test_handshake_then_subscribe_then_resync(fake_ha, mirror):
+    auth = fake_ha.commands("auth")
+    assert auth == [{"type": "auth", "access_token": fake_ha.token}]
+    subscribed = [msg["event_type"] for msg in fake_ha.commands("subscribe_events")]
+    assert subscribed[0] == "state_changed"
+    assert set(subscribed) == {"state_changed", "area_registry_updated", "device_registry_updated",
+                               "entity_registry_updated"}
+    # The resync ran only once state_changed was subscribed, so no change can fall in between.
+    assert fake_ha.resyncs == [True]
+    assert mirror.is_ready()
+    assert mirror.get_entities() == {"light.kitchen": "Kitchen Light", "fan.bedroom": "Bedroom Fan"}
+
+
+def test_rejected_token_never_subscribes(fake_ha, start_mirror):
+    mirror = start_mirror(token="wrong")
+    # A second attempt means the first one has been given up on.
+    wait_for(lambda: fake_ha.connections >= 2)
+    assert not mirror.connected
+    assert fake_ha.commands("subscribe_events") == []
+
+
+def test_state_changed_add_update_remove(fake_ha, mirror):
+    version = mirror.version
+
+    new = state("switch.porch", "Porch Switch", "on")
+    fake_ha.send_event("state_changed", {"entity_id": "switch.porch", "old_state": None, "new_state": new})
+    wait_for(lambda: mirror.get_state("switch.porch") is not None)
+    assert mirror.get_state("switch.porch")["state"] == "on"
+    assert mirror.get_entities()["switch.porch"] == "Porch Switch"
+    assert mirror.version == version + 1
+
+    # A state change alone leaves the entity set (and its version) alone.
+    fake_ha.send_event("state_changed", {
+        "entity_id": "light.kitchen", "old_state": fake_ha.states[0],
+        "new_state": state("light.kitchen", "Kitchen Light", "on", brightness=255),
+    })
+    wait_for(lambda: mirror.get_state("light.kitchen")["state"] == "on")
+    assert mirror.get_state("light.kitchen")["attributes"]["brightness"] == 255
+    assert mirror.version == version + 1
+
+    # A rename does bump it.
+    fake_ha.send_event("state_changed", {
+        "entity_id": "light.kitchen", "old_state": None, "new_state": state("light.kitchen", "Kitchen Ceiling", "on"),
+    })
+    wait_for(lambda: mirror.get_entities()["light.kitchen"] == "Kitchen Ceiling")
+    assert mirror.version == version + 2
+
+    fake_ha.send_event("state_changed", {"entity_id": "switch.porch", "old_state": new, "new_state": None})
+    wait_for(lambda: mirror.get_state("switch.porch") is None)
+    assert "switch.porch" not in mirror.get_entities()
+    assert {s["entity_id"] for s in mirror.get_states()} == {"light.kitchen", "fan.bedroom"}
+    assert mirror.version == version + 3
+
+
+def test_reconnects_and_resyncs_after_the_server_drops(fake_ha, mirror):
+    # Changes made while the connection is down only reach the mirror through the resync.
+    fake_ha.states = [state("light.kitchen", "Kitchen Light", "on"), state("lock.front_door", "Front Door")]
+    fake_ha.drop()
+    wait_for(lambda: fake_ha.connections == 2 and mirror.connected)
+
+    assert [msg["access_token"] for msg in fake_ha.commands("auth")] == [fake_ha.token, fake_ha.token]
+    assert fake_ha.resyncs == [True, True]
+    assert mirror.get_entities() == {"light.kitchen": "Kitchen Light", "lock.front_door": "Front Door"}
+    assert mirror.get_state("light.kitchen")["state"] == "on"
+    assert mirror.get_state("fan.bedroom") is None
+
+    # Events flow over the new connection.
+    fake_ha.send_event("state_changed", {
+        "entity_id": "lock.front_door", "old_state": None, "new_state": state("lock.front_door", "Front Door", "locked"),
+    })
+    wait_for(lambda: mirror.get_state("lock.front_door")["state"] == "locked")
@@ -0,0 +1,47 @@
+# ai_engine/tests/test_service_batching.py
+from lib.service_batching import StreamingBatcher, plan_service_calls
+
+
+def task(service, *entity_ids, parameters=None):
+    return {"service": service, "entity_ids": list(entity_ids), "parameters": parameters}
+
+
+def test_plan_service_calls_coalesces_same_service_and_parameters():
+    batches = plan_service_calls([
+        task("light.turn_on", "light.a"),
+        task("fan.turn_on", "fan.a"),
+        task("light.turn_on", "light.b", "light.a", parameters={}),
+        task("light.turn_on", "light.c", parameters={"brightness_pct": 5}),
+    ])
+    assert [(b["service"], b["parameters"], b["entity_ids"], b["tasks"]) for b in batches] == [
+        ("light.turn_on", None, ["light.a", "light.b"], [0, 2]),
+        ("fan.turn_on", None, ["fan.a"], [1]),
+        ("light.turn_on", {"brightness_pct": 5}, ["light.c"], [3]),
+    ]
+
+
+def test_streaming_batcher_starts_each_run_as_one_call():
+    started = []
+    batcher = StreamingBatcher(started.append)
+    batcher.add(0, None, task("light.turn_on", "light.a"))
+    batcher.add(1, None, task("light.turn_on", "light.b"))
+    # Held while the run goes on.
+    assert started == []
+    batcher.add(2, (None, "could not find a matching device for 'light.x'", "light.x"), None)
+    batcher.add(4, None, task("fan.turn_on", "fan.a"))
+    # A different service ends the run before it.
+    assert [(b["service"], b["entity_ids"], b["tasks"]) for b in started] == [
+        ("light.turn_on", ["light.a", "light.b"], [0, 1]),
+    ]
+    batcher.add(5, None, task("light.turn_on", "light.a"))
+    batcher.flush()
+    batcher.flush()
+    assert [(b["service"], b["entity_ids"], b["tasks"]) for b in started] == [
+        ("light.turn_on", ["light.a", "light.b"], [0, 1]),
+        ("fan.turn_on", ["fan.a"], [2]),
+        ("light.turn_on", ["light.a"], [3]),
+    ]
+    assert batcher.batches == started
+    assert [t["index"] for t in batcher.tasks] == [0, 1, 4, 5]
+    assert list(batcher.failures) == [2]
+    assert batcher.indexes == {0, 1, 2, 4, 5}
@@ -0,0 +1,137 @@
+# ai_engine/tests/test_shared_state.py
+import gc
+import os
+import time
+import threading
+
+import pytest
+
+from lib import shared_state
+from lib.shared_state import FileStateStore, MemoryStateStore, PrefixedStore, StateLockTimeout
+
+REDIS_TEST_URL = os.environ.get("REDIS_TEST_URL")
+
+
+@pytest.fixture(params=["memory", "file", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryStateStore()
+        return
+    if request.param == "file":
+        yield FileStateStore(str(tmp_path))
+        return
+    if shared_state.redis is None or not REDIS_TEST_URL:
+        pytest.skip("set REDIS_TEST_URL (and install redis) to test the Redis store")
+    store = shared_state.RedisStateStore(REDIS_TEST_URL)
+    prefix = f"test:{os.getpid()}:{time.time()}:"
+    yield PrefixedStore(store, prefix)
+    for key in store.client.scan_iter(f"{prefix}*"):
+        store.client.delete(key)
+
+
+def test_values_lists_and_expiry(store):
+    assert store.get("missing") is None
+    store.set("plan", {"commands": [1, 2]})
+    assert store.get("plan") == {"commands": [1, 2]}
+    store.set("short", "lived", ttl=1)
+    for i in range(5):
+        store.append("turns", i, max_len=3)
+    assert store.get_list("turns") == [2, 3, 4]
+    store.delete("plan")
+    assert store.get("plan") is None
+    time.sleep(1.1)
+    assert store.get("short") is None
+
+
+def test_get_or_fill_fills_once(store):
+    calls = []
+    started = threading.Barrier(8)
+
+    def fill():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"Kitchen": ["light.kitchen"]}
+
+    results = []
+
+    def worker():
+        started.wait()
+        results.append(store.get_or_fill("area_data", fill, ttl=60))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"Kitchen": ["light.kitchen"]}] * 8
+    # Empty results are returned but not stored.
+    assert store.get_or_fill("empty", lambda: {}) == {}
+    assert store.get("empty") is None
+
+
+def test_lock_times_out_instead_of_running_unlocked(store, monkeypatch):
+    monkeypatch.setattr(shared_state, "STATE_LOCK_TIMEOUT", 0.2)
+    held, release = threading.Event(), threading.Event()
+
+    def holder():
+        with store.lock("sessions"):
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    held.wait(5)
+    try:
+        ran = []
+        with pytest.raises(StateLockTimeout):
+            with store.lock("sessions"):
+                ran.append(True)
+        assert ran == []
+        # get_or_fill falls back to filling without storing.
+        assert store.get_or_fill("sessions", lambda: ["fresh"]) == ["fresh"]
+        assert store.get("sessions") is None
+    finally:
+        release.set()
+        thread.join()
+    with store.lock("sessions"):
+        pass
+
+
+def test_memory_store_drops_unused_key_locks():
+    store = MemoryStateStore()
+    for i in range(1000):
+        with store.lock(f"key-{i}"):
+            pass
+        store.get_or_fill(f"fill-{i}", lambda: i + 1)
+    gc.collect()
+    assert len(store._key_locks) == 0
+
+
+def test_file_store_fills_without_holding_the_stripe_lock(tmp_path, monkeypatch):
+    # Every key shares one lock file.
+    monkeypatch.setattr(shared_state, "STATE_LOCK_STRIPES", 1)
+    store = FileStateStore(str(tmp_path))
+    filling, finish = threading.Event(), threading.Event()
+
+    def slow_fill():
+        filling.set()
+        finish.wait(5)
+        return "rendered"
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(store.get_or_fill("area_data", slow_fill)))
+    thread.start()
+    try:
+        filling.wait(5)
+        started = time.perf_counter()
+        # Unrelated keys on the same stripe are not held up by the fill.
+        store.append("turns", "hello")
+        assert store.get_or_fill("plan", lambda: "cached") == "cached"
+        assert time.perf_counter() - started < 1
+    finally:
+        finish.set()
+        thread.join()
+    assert result == ["rendered"]
+    assert store.get("area_data") == "rendered"
+    assert [name for name in os.listdir(tmp_path) if "filling" in name] == []
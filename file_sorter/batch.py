@@ -0,0 +1,81 @@
+# file_sorter/batch.py
+"""
+Sorts a whole directory tree with the worker pool, e.g. to backfill an archive.
+
+Files are recorded in the persistent job queue before any is processed, so an
+interrupted run picks up where it stopped when started again (with the same
+--db); files already sorted are not queued twice.
+
+    python batch.py /intake/archive --workers 2
+    python batch.py --resume             # finish what is left in the queue
+    python batch.py --status
+    python batch.py /intake --watch      # then keep sorting new files as they arrive
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+
+from lib.job_queue import JobQueue, QUEUE_DB
+from lib.batch import BatchRunner, BATCH_WORKERS, new_batch_id, walk_files
+from lib.watcher import DirectoryWatcher
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", nargs="?", help="directory to sort; omit with --resume or --status")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help=f"worker threads (default {BATCH_WORKERS})")
+    parser.add_argument("--db", default=QUEUE_DB, help=f"job queue database (default {QUEUE_DB})")
+    parser.add_argument("--no-recursive", action="store_true", help="only the files directly in the directory")
+    parser.add_argument("--resume", action="store_true", help="process what is left in the queue")
+    parser.add_argument("--retry-failed", action="store_true", help="queue failed files again first")
+    parser.add_argument("--status", action="store_true", help="print the queue counts and exit")
+    parser.add_argument("--watch", action="store_true", help="keep watching the directory for new files (Ctrl-C stops)")
+    args = parser.parse_args()
+
+    if not (args.directory or args.resume or args.status):
+        parser.error("give a directory, --resume or --status")
+    if args.directory and not os.path.isdir(args.directory):
+        parser.error(f"not a directory: {args.directory}")
+    if args.watch and not args.directory:
+        parser.error("--watch needs a directory")
+
+    queue = JobQueue(args.db)
+    if args.status:
+        print(json.dumps({"counts": queue.counts(), "recent_failures": queue.failures(limit=10)}, indent=2))
+        return 0
+
+    runner = BatchRunner(queue, workers=args.workers)
+    if args.retry_failed:
+        logger.info(f"Requeued {queue.retry_failed()} failed file(s).")
+    if args.watch:
+        # The watcher's first scan queues everything not seen before, then it follows new files.
+        watcher = DirectoryWatcher(args.directory, queue, runner)
+        runner.start()
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            logger.info(f"Stopped watching: {json.dumps(watcher.get_stats())}")
+        return 0
+    if args.directory:
+        batch_id = new_batch_id()
+        queued = queue.add(walk_files(args.directory, recursive=not args.no_recursive), batch_id)
+        logger.info(f"Queued {queued} new file(s) from {args.directory} as batch {batch_id}.")
+
+    logger.info(f"Processing {queue.counts()['queued']} queued file(s) with {runner.workers} worker(s).")
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        # Files in flight are requeued by the next run.
+        logger.warning("Interrupted; run again with --resume to continue.")
+        return 130
+
+    progress = runner.progress()
+    print(json.dumps(progress, indent=2))
+    return 1 if progress["counts"]["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
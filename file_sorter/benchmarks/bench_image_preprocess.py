@@ -0,0 +1,172 @@
+# file_sorter/benchmarks/bench_image_preprocess.py
+"""
+Bytes sent to the vision model and latency per file type, with and without
+downscaling before upload.
+
+Builds one synthetic file per type (a 24 MP JPEG, a Retina PNG screenshot, a
+12 MP HEIC if pillow-heif is installed, a DNG with sensor data and an embedded
+preview, a small JPEG) and sends each through get_ollama_vision_response to a
+stub Ollama. Like llama.cpp's image loader, the stub only decodes JPEG and PNG,
+then resizes to the encoder's 336x336; other formats are reported as
+undecodable, which is what the model would have done with them.
+
+    python benchmarks/bench_image_preprocess.py --repeat 3
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import struct
+import argparse
+import tempfile
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image, ImageFilter
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    """Decodes the image like the vision runner would; answers with a fixed description."""
+    protocol_version = "HTTP/1.1"
+    decoded = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        data = base64.b64decode(body["images"][0])
+        ok = data[:3] == b"\xff\xd8\xff" or data[:8] == b"\x89PNG\r\n\x1a\n"
+        if ok:
+            with Image.open(io.BytesIO(data)) as image:
+                image.convert("RGB").resize((336, 336), Image.Resampling.BICUBIC)
+        StubOllama.decoded[body["prompt"]] = ok
+        payload = json.dumps({"response": "A photo of a landscape", "done": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def photo(width, height):
+    """Photo-like content: smooth gradients plus sensor noise, so JPEG sizes are realistic."""
+    base = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40).filter(ImageFilter.GaussianBlur(1))
+    return Image.merge("RGB", (base, noise, Image.blend(base, noise, 0.5)))
+
+
+def write_dng(path, preview, sensor_bytes):
+    """A minimal little-endian DNG: IFD0 holds the JPEG preview, a SubIFD the CFA sensor data."""
+    jpeg = io.BytesIO()
+    preview.save(jpeg, format="JPEG", quality=90)
+    jpeg = jpeg.getvalue()
+    ifd0_at, sub_at = 8, 8 + 2 + 6 * 12 + 4
+    jpeg_at = sub_at + 2 + 5 * 12 + 4
+    sensor_at = jpeg_at + len(jpeg)
+
+    def ifd(entries, next_offset=0):
+        out = struct.pack("<H", len(entries))
+        for tag, typ, value in entries:
+            out += struct.pack("<HHII", tag, typ, 1, value)
+        return out + struct.pack("<I", next_offset)
+
+    with open(path, "wb") as f:
+        f.write(b"II*\0" + struct.pack("<I", ifd0_at))
+        f.write(ifd([
+            (0x00FE, 4, 1), (0x0103, 3, 6), (0x0112, 3, 1), (0x014A, 4, sub_at),
+            (0x0201, 4, jpeg_at), (0x0202, 4, len(jpeg)),
+        ]))
+        f.write(ifd([(0x00FE, 4, 0), (0x0103, 3, 7), (0x0106, 3, 32803), (0x0111, 4, sensor_at), (0x0117, 4, sensor_bytes)]))
+        f.write(jpeg)
+        remaining = sensor_bytes
+        while remaining:
+            chunk = min(remaining, 1 << 20)
+            f.write(os.urandom(chunk))
+            remaining -= chunk
+
+
+def build_files(directory):
+    files = []
+    big = photo(6000, 4000)
+    path = os.path.join(directory, "camera.jpg")
+    big.save(path, quality=92)
+    files.append(("JPEG 6000x4000", path))
+
+    screenshot = Image.new("RGBA", (2880, 1800), (250, 250, 250, 255))
+    screenshot.paste(photo(1400, 900).convert("RGBA"), (200, 300))
+    path = os.path.join(directory, "screenshot.png")
+    screenshot.save(path)
+    files.append(("PNG 2880x1800", path))
+
+    try:
+        import pillow_heif  # noqa: F401 - registers the HEIF plugin
+        path = os.path.join(directory, "phone.heic")
+        photo(4032, 3024).save(path, quality=90)
+        files.append(("HEIC 4032x3024", path))
+    except ImportError:
+        print("pillow-heif not installed; skipping HEIC")
+
+    path = os.path.join(directory, "camera.dng")
+    write_dng(path, photo(1620, 1080), 40 * 1024 * 1024)
+    files.append(("DNG 40 MB + preview", path))
+
+    path = os.path.join(directory, "small.jpg")
+    photo(800, 600).save(path, quality=85)
+    files.append(("JPEG 800x600", path))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-dimension", type=int, default=1024)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OLLAMA_API_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["VISION_MAX_DIMENSION"] = str(args.max_dimension)
+
+    from lib import image_cache, ollama_helpers
+    from lib.ollama_helpers import get_ollama_vision_response
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = build_files(directory)
+        print(f"\nmax dimension {args.max_dimension}, median of {args.repeat} run(s)\n")
+        print(f"{'file':<22}{'mode':<11}{'on disk':>10}{'sent':>10}{'call ms':>10}  model can decode")
+        total, sent_total = {}, {}
+        for name, path in files:
+            size = os.path.getsize(path)
+            for mode, preprocess in (("original", False), ("downscale", True)):
+                image_cache.VISION_PREPROCESS = preprocess
+                times = []
+                for _ in range(args.repeat):
+                    # A fresh cache, so every call reads, prepares and uploads the file.
+                    cache = image_cache.ImageEncodingCache()
+                    ollama_helpers.get_encoded_image = lambda p, c=cache: c.get(p)[1]
+                    start = time.perf_counter()
+                    get_ollama_vision_response(path, "stub", f"{name}/{mode}")
+                    times.append((time.perf_counter() - start) * 1000)
+                    sent = cache.get_stats()["bytes"]
+                ms = statistics.median(times)
+                ok = StubOllama.decoded.get(f"{name}/{mode}")
+                sent_total[mode] = sent_total.get(mode, 0) + sent
+                if StubOllama.decoded.get(f"{name}/original"):
+                    # Undecodable originals fail fast; only compare files the model reads either way.
+                    total[mode] = total.get(mode, 0) + ms
+                print(f"{name:<22}{mode:<11}{size / 1e6:>8.1f}MB{sent / 1e6:>8.2f}MB{ms:>10.0f}  {'yes' if ok else 'NO'}")
+        print(f"\nbytes sent: {sent_total['original'] / 1e6:.1f} MB original, {sent_total['downscale'] / 1e6:.2f} MB downscaled")
+        print(f"call time for files the model could already decode: {total['original']:.0f} ms original, "
+              f"{total['downscale']:.0f} ms downscaled")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
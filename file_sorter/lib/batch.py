@@ -0,0 +1,161 @@
+# file_sorter/lib/batch.py
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+
+from lib.pipeline import process_file
+
+logger = logging.getLogger(__name__)
+
+# Each worker makes its own vision calls, so more workers than Ollama serves
+# in parallel (OLLAMA_NUM_PARALLEL) only queue up inside Ollama.
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+PROGRESS_INTERVAL = float(os.getenv("BATCH_PROGRESS_INTERVAL", "30"))
+# files/minute is measured over this trailing window, so it follows the current pace.
+THROUGHPUT_WINDOW = float(os.getenv("BATCH_THROUGHPUT_WINDOW", "300"))
+
+def new_batch_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+def walk_files(root, recursive=True):
+    """Yields the files under `root` in a stable order, skipping hidden files and directories."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".")) if recursive else []
+        for filename in sorted(filenames):
+            if not filename.startswith("."):
+                yield os.path.join(dirpath, filename)
+
+class BatchRunner:
+    """
+    A bounded pool of worker threads draining a JobQueue through `process_fn`
+    (the single-file pipeline), with progress and files/minute throughput.
+    Workers exit once the queue is empty; `start` brings them back for new jobs.
+    A worker only exits after checking, under the same lock `start` holds, that
+    no `start` came in since the queue looked empty, so jobs queued while the
+    last worker is winding down are never left behind.
+    """
+
+    def __init__(self, queue, workers=BATCH_WORKERS, process_fn=process_file):
+        self.queue = queue
+        self.workers = max(1, workers)
+        self.process_fn = process_fn
+        self._lock = threading.Lock()
+        self._threads = []
+        # Bumped by every start(); a worker that saw an empty queue before a bump claims again.
+        self._generation = 0
+        self._finished = deque()
+        self._processed = 0
+        self._started_at = None
+        self._last_report = 0.0
+        self.queue.recover()
+
+    def start(self):
+        """Starts workers up to the pool size. Returns how many were started."""
+        with self._lock:
+            self._generation += 1
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if not self._threads:
+                self._started_at = time.time()
+                self._processed = 0
+                self._finished.clear()
+                self._last_report = self._started_at
+            missing = self.workers - len(self._threads)
+            for i in range(missing):
+                thread = threading.Thread(target=self._work, name=f"batch-worker-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+        return missing
+
+    def running(self):
+        with self._lock:
+            return any(t.is_alive() for t in self._threads)
+
+    def run(self):
+        """Processes the queue until it is empty; blocks the caller."""
+        self.start()
+        with self._lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+        self._report(force=True)
+
+    def _work(self):
+        try:
+            while True:
+                with self._lock:
+                    generation = self._generation
+                job = self.queue.claim()
+                if job is None:
+                    with self._lock:
+                        if generation != self._generation:
+                            continue
+                        # Leaves the pool in the same step as deciding to, so start() replaces it.
+                        self._threads.remove(threading.current_thread())
+                        return
+                self._process(*job)
+        finally:
+            with self._lock:
+                if threading.current_thread() in self._threads:
+                    self._threads.remove(threading.current_thread())
+
+    def _process(self, job_id, path):
+        try:
+            new_path, error = self.process_fn(path)
+        except Exception as e:
+            logger.exception(f"Unexpected error processing {path}")
+            new_path, error = None, str(e)
+        if error:
+            self.queue.fail(job_id, error)
+        else:
+            self.queue.complete(job_id, new_path)
+        with self._lock:
+            self._processed += 1
+            self._finished.append(time.time())
+        self._report()
+
+    def files_per_minute(self):
+        """Files finished per minute over the last THROUGHPUT_WINDOW seconds (or since start, if shorter)."""
+        now = time.time()
+        with self._lock:
+            while self._finished and self._finished[0] < now - THROUGHPUT_WINDOW:
+                self._finished.popleft()
+            if not self._started_at:
+                return 0.0
+            window = min(THROUGHPUT_WINDOW, now - self._started_at)
+            return len(self._finished) / window * 60 if window > 0 else 0.0
+
+    def progress(self, batch_id=None):
+        """Job counts plus this run's throughput and an estimate of the time left."""
+        counts = self.queue.counts(batch_id)
+        rate = self.files_per_minute()
+        remaining = counts["queued"] + counts["running"]
+        elapsed = time.time() - self._started_at if self._started_at else 0.0
+        return {
+            "batch_id": batch_id,
+            "counts": counts,
+            "total": sum(counts.values()),
+            "workers": self.workers,
+            "running": self.running(),
+            "processed_this_run": self._processed,
+            "elapsed_s": round(elapsed, 1),
+            "files_per_minute": round(rate, 2),
+            "overall_files_per_minute": round(self._processed / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "eta_s": round(remaining / rate * 60) if rate > 0 else None,
+        }
+
+    def _report(self, force=False):
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_report < PROGRESS_INTERVAL:
+                return
+            self._last_report = now
+        p = self.progress()
+        counts = p["counts"]
+        eta = f"{p['eta_s'] // 60}m" if p["eta_s"] is not None else "n/a"
+        logger.info(
+            f"Batch progress: {counts['done']} done, {counts['failed']} failed, {counts['queued']} queued, "
+            f"{counts['running']} running; {p['files_per_minute']:.1f} files/min, ETA {eta}"
+        )
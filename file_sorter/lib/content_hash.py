@@ -0,0 +1,36 @@
+# file_sorter/lib/content_hash.py
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+HASH_CHUNK = 1024 * 1024
+# (path, size, mtime) -> digest entries remembered, so a file is hashed once per pipeline run.
+HASH_MEMO_SIZE = 4096
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+def hash_file(file_path):
+    """
+    SHA-256 of a file's content, read in chunks so large RAWs are never held in
+    memory. Remembered by (path, size, mtime), so the dedup lookup, the image
+    encoding cache and the move share one read of an unchanged file.
+    """
+    st = os.stat(file_path)
+    key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+    with _memo_lock:
+        digest = _memo.get(key)
+        if digest:
+            _memo.move_to_end(key)
+            return digest
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _memo_lock:
+        _memo[key] = digest
+        while len(_memo) > HASH_MEMO_SIZE:
+            _memo.popitem(last=False)
+    return digest
@@ -0,0 +1,94 @@
+# file_sorter/lib/dedup_index.py
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# On the same persistent volume as the batch queue.
+DEDUP_DB = os.getenv("DEDUP_DB", "/var/lib/file_sorter/dedup.db")
+# Optional: reuse the analysis of a visually near-identical image (resized,
+# recompressed or re-exported copy) instead of calling the model again.
+DEDUP_NEAR_DUPLICATES = os.getenv("DEDUP_NEAR_DUPLICATES", "false").lower() in ("1", "true", "yes")
+# Largest Hamming distance between two 64-bit dHashes still taken as the same picture.
+DEDUP_PHASH_DISTANCE = int(os.getenv("DEDUP_PHASH_DISTANCE", "6"))
+
+class DedupIndex:
+    """
+    Content hash -> analysis (description, OCR text) and destination path of every
+    file the sorter has seen, in SQLite. Consulted before any model call: a file
+    whose bytes were sorted before is a duplicate, and one that was analysed but
+    not moved reuses its analysis. Perceptual hashes are kept in memory as well
+    for the near-duplicate lookup.
+    """
+
+    def __init__(self, path=DEDUP_DB):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " sha256 TEXT PRIMARY KEY,"
+            " phash INTEGER,"
+            " description TEXT,"
+            " ocr_text TEXT,"
+            " dest_path TEXT,"
+            " updated_at REAL)"
+        )
+        # dHashes are 64-bit unsigned; SQLite integers are signed, so they are stored shifted.
+        self._phashes = {
+            sha: phash + (1 << 63)
+            for sha, phash in self._conn.execute("SELECT sha256, phash FROM files WHERE phash IS NOT NULL")
+        }
+        self.stats = {"duplicates": 0, "reused": 0, "near_duplicates": 0, "analyzed": 0}
+
+    def lookup(self, sha256):
+        """Returns {"description", "ocr_text", "dest_path"} for a known content hash, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT description, ocr_text, dest_path FROM files WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        return dict(zip(("description", "ocr_text", "dest_path"), row)) if row else None
+
+    def find_similar(self, phash, max_distance=DEDUP_PHASH_DISTANCE):
+        """The analysed entry whose dHash is nearest to `phash`, as (sha256, distance), or None."""
+        best = None
+        with self._lock:
+            candidates = list(self._phashes.items())
+        for sha, other in candidates:
+            distance = (phash ^ other).bit_count()
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (sha, distance)
+        return best
+
+    def record_analysis(self, sha256, description, ocr_text, phash=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO files (sha256, phash, description, ocr_text, updated_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (sha256) DO UPDATE SET phash = COALESCE(excluded.phash, phash),"
+                " description = excluded.description, ocr_text = excluded.ocr_text, updated_at = excluded.updated_at",
+                (sha256, phash - (1 << 63) if phash is not None else None, description, ocr_text, time.time()),
+            )
+            if phash is not None:
+                self._phashes[sha256] = phash
+
+    def record_destination(self, sha256, dest_path):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO files (sha256, dest_path, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (sha256) DO UPDATE SET dest_path = excluded.dest_path, updated_at = excluded.updated_at",
+                (sha256, dest_path, time.time()),
+            )
+
+    def count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def get_stats(self):
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()
+            return dict(self.stats, entries=entries, perceptual_hashes=len(self._phashes))
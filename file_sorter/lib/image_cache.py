@@ -0,0 +1,74 @@
+# file_sorter/lib/image_cache.py
+import os
+import base64
+import logging
+import threading
+from collections import OrderedDict
+
+from lib.content_hash import hash_file
+from lib.image_preprocess import prepare_image, VISION_PREPROCESS
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the base64 images kept in memory (they are ~4/3 the size sent).
+IMAGE_CACHE_MB = float(os.getenv("IMAGE_CACHE_MB", "256"))
+
+class ImageEncodingCache:
+    """
+    Base64-encoded images, as sent to the vision model (downscaled by
+    prepare_image), keyed by the SHA-256 of the original file's bytes, least
+    recently used evicted first. hash_file remembers the hash of an unchanged
+    file, so the second vision call, a retry or a reprocessing run reuses the
+    first encoding without reading the file again.
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._encoded = OrderedDict()
+        self._size = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _lookup(self, digest):
+        encoded = self._encoded.get(digest)
+        if encoded is not None:
+            self._encoded.move_to_end(digest)
+        return encoded
+
+    def get(self, file_path):
+        """Returns (content hash, base64 image) for `file_path`, reading and encoding it only on a miss."""
+        digest = hash_file(file_path)
+        with self._lock:
+            encoded = self._lookup(digest)
+            if encoded is not None:
+                self.stats["hits"] += 1
+                return digest, encoded
+            self.stats["misses"] += 1
+        data = prepare_image(file_path) if VISION_PREPROCESS else None
+        if data is None:
+            with open(file_path, "rb") as f:
+                data = f.read()
+        encoded = base64.b64encode(data).decode('utf-8')
+        self._store(digest, encoded)
+        return digest, encoded
+
+    def _store(self, digest, encoded):
+        with self._lock:
+            if digest in self._encoded or len(encoded) > self.max_bytes:
+                return
+            self._encoded[digest] = encoded
+            self._size += len(encoded)
+            while self._size > self.max_bytes:
+                _, old = self._encoded.popitem(last=False)
+                self._size -= len(old)
+                self.stats["evictions"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._encoded), bytes=self._size)
+
+image_cache = ImageEncodingCache()
+
+def get_encoded_image(file_path):
+    """Base64 of `file_path` for a vision request, from the shared cache."""
+    return image_cache.get(file_path)[1]
@@ -0,0 +1,187 @@
+# file_sorter/lib/image_preprocess.py
+import io
+import os
+import struct
+import logging
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:  # pragma: no cover - HEIC files are then sent unchanged
+    register_heif_opener = None
+
+# The vision encoder sees a few hundred pixels (LLaVA 1.5: 336, 1.6: up to 672x672
+# tiles), so anything beyond this is upload and decode work for nothing.
+VISION_MAX_DIMENSION = int(os.getenv("VISION_MAX_DIMENSION", "1024"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+VISION_PREPROCESS = os.getenv("VISION_PREPROCESS", "true").lower() in ("1", "true", "yes")
+# Refuse to decode anything larger than this (decompression bombs, panoramas beyond reason).
+Image.MAX_IMAGE_PIXELS = int(os.getenv("VISION_MAX_PIXELS", str(300 * 1000 * 1000)))
+
+# TIFF-based RAW formats whose embedded JPEG preview is used instead of the sensor data.
+RAW_EXTENSIONS = {'.dng', '.raw', '.nef', '.nrw', '.cr2', '.arw', '.srw', '.orf', '.rw2', '.pef', '.erf', '.3fr'}
+
+# TIFF tags read by _find_raw_preview.
+_COMPRESSION, _PHOTOMETRIC, _STRIP_OFFSETS, _ORIENTATION, _STRIP_BYTE_COUNTS = 0x0103, 0x0106, 0x0111, 0x0112, 0x0117
+_SUB_IFDS, _JPEG_OFFSET, _JPEG_LENGTH, _EXIF_IFD = 0x014A, 0x0201, 0x0202, 0x8769
+# Sensor data rather than a viewable image: CFA and LinearRaw.
+_RAW_PHOTOMETRIC = {32803, 34892}
+# EXIF orientation -> the transpose that makes the image upright.
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def _read_ifd(f, offset, endian):
+    """Returns ({tag: [values]} for integer-typed tags, next IFD offset) of the TIFF IFD at `offset`."""
+    f.seek(offset)
+    count_data = f.read(2)
+    if len(count_data) < 2:
+        return {}, 0
+    (count,) = struct.unpack(endian + "H", count_data)
+    if count > 1000:
+        return {}, 0
+    entries = f.read(count * 12)
+    tags = {}
+    for i in range(len(entries) // 12):
+        tag, typ, n, value = struct.unpack(endian + "HHI4s", entries[i * 12:(i + 1) * 12])
+        if typ not in (3, 4, 13) or n > 64:
+            continue
+        fmt = endian + ("H" if typ == 3 else "I") * n
+        size = struct.calcsize(fmt)
+        if size <= 4:
+            raw = value[:size]
+        else:
+            here = f.tell()
+            f.seek(struct.unpack(endian + "I", value)[0])
+            raw = f.read(size)
+            f.seek(here)
+        if len(raw) == size:
+            tags[tag] = list(struct.unpack(fmt, raw))
+    (next_offset,) = struct.unpack(endian + "I", f.read(4) or b"\0\0\0\0")
+    return tags, next_offset
+
+def _find_raw_preview(f):
+    """
+    Walks the IFDs of a TIFF-based RAW file for embedded JPEG previews.
+    Returns ((offset, length) of the largest, orientation) or (None, 1).
+    Only the directory entries are read, never the sensor data.
+    """
+    header = f.read(8)
+    if header[:4] not in (b"II*\0", b"MM\0*"):
+        return None, 1
+    endian = "<" if header[:2] == b"II" else ">"
+    pending = [struct.unpack(endian + "I", header[4:8])[0]]
+    seen = set()
+    best, orientation = None, 1
+    while pending and len(seen) < 32:
+        offset = pending.pop()
+        if not offset or offset in seen:
+            continue
+        seen.add(offset)
+        tags, next_offset = _read_ifd(f, offset, endian)
+        pending.append(next_offset)
+        pending.extend(tags.get(_SUB_IFDS, []))
+        pending.extend(tags.get(_EXIF_IFD, []))
+        if len(seen) == 1 and _ORIENTATION in tags:
+            orientation = tags[_ORIENTATION][0]
+
+        candidates = []
+        if _JPEG_OFFSET in tags and _JPEG_LENGTH in tags:
+            candidates.append((tags[_JPEG_OFFSET][0], tags[_JPEG_LENGTH][0]))
+        if (tags.get(_COMPRESSION, [0])[0] in (6, 7) and tags.get(_PHOTOMETRIC, [0])[0] not in _RAW_PHOTOMETRIC
+                and len(tags.get(_STRIP_OFFSETS, [])) == 1 and len(tags.get(_STRIP_BYTE_COUNTS, [])) == 1):
+            candidates.append((tags[_STRIP_OFFSETS][0], tags[_STRIP_BYTE_COUNTS][0]))
+        for candidate in candidates:
+            f.seek(candidate[0])
+            # A baseline or progressive JPEG, not the lossless JPEG some RAWs store sensor data in.
+            if f.read(2) == b"\xff\xd8" and (best is None or candidate[1] > best[1]):
+                best = candidate
+    return best, orientation
+
+def _open_raw_preview(file_path):
+    with open(file_path, "rb") as f:
+        preview, orientation = _find_raw_preview(f)
+        if not preview:
+            return None
+        f.seek(preview[0])
+        image = Image.open(io.BytesIO(f.read(preview[1])))
+    # The preview carries no orientation of its own; the RAW's IFD0 has it.
+    image.info["raw_orientation"] = orientation
+    return image
+
+def _open_image(file_path):
+    """Opens `file_path` lazily; a RAW opens as its embedded preview when it has one."""
+    image = None
+    if os.path.splitext(file_path)[1].lower() in RAW_EXTENSIONS:
+        image = _open_raw_preview(file_path)
+    return image if image is not None else Image.open(file_path)
+
+def prepare_image(file_path, max_dimension=VISION_MAX_DIMENSION, quality=VISION_JPEG_QUALITY):
+    """
+    Returns the bytes to send to the vision model for `file_path`: the image
+    decoded (a RAW's embedded JPEG preview instead of its sensor data), turned
+    upright, scaled to fit `max_dimension` and re-encoded as RGB JPEG. JPEGs are
+    decoded at reduced scale, so even very large files never fully load into
+    memory. Small upright JPEGs are sent as they are. Returns None if the file
+    is not an image Pillow can read, so the caller sends the original bytes.
+    """
+    try:
+        with _open_image(file_path) as image:
+            orientation = image.info.get("raw_orientation") or image.getexif().get(_ORIENTATION, 1)
+            if (image.format == "JPEG" and orientation == 1 and max(image.size) <= max_dimension
+                    and image.mode in ("RGB", "L") and image.filename):
+                with open(file_path, "rb") as f:
+                    return f.read()
+            # JPEG only: lets libjpeg decode at 1/2, 1/4 or 1/8 scale directly.
+            image.draft("RGB", (max_dimension, max_dimension))
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            if orientation in _ORIENTATION_TRANSPOSE:
+                image = image.transpose(_ORIENTATION_TRANSPOSE[orientation])
+            if image.mode in ("RGBA", "LA", "P"):
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            out = io.BytesIO()
+            image.save(out, format="JPEG", quality=quality, optimize=True)
+            return out.getvalue()
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        logger.info(f"Not preprocessing {file_path} ({e}); sending it unchanged.")
+        return None
+
+def perceptual_hash(file_path, hash_size=8):
+    """
+    64-bit difference hash (dHash) of the image, or None if it cannot be read.
+    Resized, recompressed or re-exported copies of a photo land within a few
+    bits of each other, unlike their content hashes.
+    """
+    try:
+        with _open_image(file_path) as image:
+            image.draft("L", (hash_size * 8, hash_size * 8))
+            orientation = image.info.get("raw_orientation") or image.getexif().get(_ORIENTATION, 1)
+            gray = image.convert("L")
+            if orientation in _ORIENTATION_TRANSPOSE:
+                # Hash the upright image, so an upright re-export of it still matches.
+                gray = gray.transpose(_ORIENTATION_TRANSPOSE[orientation])
+            small = gray.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        logger.info(f"No perceptual hash for {file_path} ({e})")
+        return None
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (hash_size + 1) + col + 1])
+    return bits
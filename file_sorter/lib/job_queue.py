@@ -0,0 +1,204 @@
+# file_sorter/lib/job_queue.py
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Lives on a persistent volume, so a batch picks up where it stopped after a crash or restart.
+QUEUE_DB = os.getenv("QUEUE_DB", "/var/lib/file_sorter/queue.db")
+# A file is given up on after this many attempts, including ones cut short by a crash.
+MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", "3"))
+INSERT_CHUNK = 1000
+
+STATUSES = ("queued", "running", "done", "failed")
+
+class JobQueue:
+    """
+    Files waiting to be sorted, kept in SQLite. Each path is queued once and moves
+    from queued to running to done or failed; a failed attempt goes back to queued
+    until MAX_ATTEMPTS. Feeders that can tell files apart (see add_versions) may
+    queue a path again once a different file turns up under it. Safe to share
+    between the threads of one process.
+    """
+
+    def __init__(self, path=QUEUE_DB, max_attempts=MAX_ATTEMPTS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY,"
+            " path TEXT NOT NULL UNIQUE,"
+            " batch_id TEXT,"
+            " status TEXT NOT NULL DEFAULT 'queued',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " new_path TEXT,"
+            " error TEXT,"
+            " updated_at REAL,"
+            " version TEXT)"
+        )
+        if "version" not in {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+            # Queue databases created before versions were recorded.
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN version TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, status)")
+        # Named positions of whoever feeds the queue (e.g. a directory watcher), kept across restarts.
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def add(self, paths, batch_id):
+        """Queues `paths` under `batch_id`; paths already known are left as they are. Returns how many were added."""
+        added = 0
+        paths = list(paths)
+        with self._lock:
+            for start in range(0, len(paths), INSERT_CHUNK):
+                before = self._conn.total_changes
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO jobs (path, batch_id, updated_at) VALUES (?, ?, ?)",
+                    [(path, batch_id, time.time()) for path in paths[start:start + INSERT_CHUNK]],
+                )
+                self._conn.execute("COMMIT")
+                added += self._conn.total_changes - before
+        return added
+
+    def add_versions(self, versions, batch_id):
+        """
+        Queues {path: version} under `batch_id`, where a version is any string that
+        tells two files under the same path apart (e.g. ctime and size). A path whose
+        job is done or failed is queued again, with fresh attempts, when its version
+        differs: a new scan.pdf after the last one was sorted away. Paths queued or
+        running are left as they are. Returns how many were added or requeued.
+        """
+        now = time.time()
+        rows = [(path, batch_id, now, version) for path, version in sorted(versions.items())]
+        added = 0
+        with self._lock:
+            for start in range(0, len(rows), INSERT_CHUNK):
+                before = self._conn.total_changes
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT INTO jobs (path, batch_id, updated_at, version) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (path) DO UPDATE SET batch_id = excluded.batch_id, status = 'queued',"
+                    " attempts = 0, new_path = NULL, error = NULL, updated_at = excluded.updated_at,"
+                    " version = excluded.version"
+                    " WHERE status IN ('done', 'failed') AND version IS NOT excluded.version",
+                    rows[start:start + INSERT_CHUNK],
+                )
+                self._conn.execute("COMMIT")
+                added += self._conn.total_changes - before
+        return added
+
+    def unsorted(self, versions):
+        """The paths of {path: version} that add_versions would queue."""
+        paths = list(versions)
+        settled = set()
+        with self._lock:
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                for path, status, version in self._conn.execute(
+                    f"SELECT path, status, version FROM jobs WHERE path IN ({','.join('?' * len(chunk))})", chunk
+                ):
+                    if status in ("queued", "running") or version == versions[path]:
+                        settled.add(path)
+        return [path for path in paths if path not in settled]
+
+    def claim(self):
+        """Marks the oldest queued job running and returns (job id, path), or None if there is none."""
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?"
+                " WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1)"
+                " RETURNING id, path",
+                (time.time(),),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def complete(self, job_id, new_path):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', new_path = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (new_path, time.time(), job_id),
+            )
+
+    def fail(self, job_id, error):
+        """Records a failed attempt; the job is queued again unless it has used up its attempts."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,"
+                " error = ?, updated_at = ? WHERE id = ?",
+                (self.max_attempts, str(error), time.time(), job_id),
+            )
+
+    def recover(self):
+        """
+        Requeues jobs left running by a process that died. Returns how many; call it
+        before starting workers, while nothing else is processing this queue.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,"
+                " error = COALESCE(error, 'interrupted while processing'), updated_at = ?"
+                " WHERE status = 'running'",
+                (self.max_attempts, time.time()),
+            )
+        if cursor.rowcount:
+            logger.info(f"Recovered {cursor.rowcount} job(s) interrupted by a restart.")
+        return cursor.rowcount
+
+    def retry_failed(self, batch_id=None):
+        """Queues failed jobs (of one batch, or all) again with fresh attempts. Returns how many."""
+        query = "UPDATE jobs SET status = 'queued', attempts = 0, updated_at = ? WHERE status = 'failed'"
+        params = [time.time()]
+        if batch_id:
+            query += " AND batch_id = ?"
+            params.append(batch_id)
+        with self._lock:
+            return self._conn.execute(query, params).rowcount
+
+    def counts(self, batch_id=None):
+        """Number of jobs per status, for one batch or the whole queue."""
+        query = "SELECT status, COUNT(*) FROM jobs"
+        params = ()
+        if batch_id:
+            query += " WHERE batch_id = ?"
+            params = (batch_id,)
+        with self._lock:
+            rows = self._conn.execute(query + " GROUP BY status", params).fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def oldest_queued_age(self):
+        """Seconds since the longest-waiting queued job was queued (or requeued), or 0."""
+        with self._lock:
+            (oldest,) = self._conn.execute("SELECT MIN(updated_at) FROM jobs WHERE status = 'queued'").fetchone()
+        return max(0.0, time.time() - oldest) if oldest else 0.0
+
+    def get_cursor(self, name, default=0):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cursors WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_cursor(self, name, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO cursors (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+                (name, value),
+            )
+
+    def failures(self, batch_id=None, limit=20):
+        """The most recent failed jobs as (path, error)."""
+        query = "SELECT path, error FROM jobs WHERE status = 'failed'"
+        params = []
+        if batch_id:
+            query += " AND batch_id = ?"
+            params.append(batch_id)
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY updated_at DESC LIMIT ?", params + [limit]).fetchall()
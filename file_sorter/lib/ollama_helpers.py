@@ -1,12 +1,43 @@
 # file_sorter/lib/ollama_helpers.py
 import os
-import base64
+import json
 import requests
 import logging
 
+from lib.http_client import get_session, request_timeout
+from lib.image_cache import get_encoded_image
+
 logger = logging.getLogger(__name__)
 
 OLLAMA_API_BASE_URL = os.getenv("OLLAMA_API_BASE_URL", "http://ollama:11434")
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", "300"))
+
+ANALYSIS_PROMPT = (
+    "Analyze this image. Respond with a JSON object with two fields: "
+    "\"description\", a detailed description of the image focusing on objects, people, locations, and any text present; "
+    "and \"text\", all text that appears in the image, exactly as written, or an empty string if there is none."
+)
+# Constrains the combined reply to this shape (Ollama 0.5+; older versions treat it as "json").
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {"description": {"type": "string"}, "text": {"type": "string"}},
+    "required": ["description", "text"],
+}
+
+def _generate_vision(file_path, model_name, prompt, output_format=None):
+    payload = {
+        "model": model_name,
+        "prompt": prompt,
+        "images": [get_encoded_image(file_path)],
+        "stream": False
+    }
+    if output_format:
+        payload["format"] = output_format
+    response = get_session(OLLAMA_API_BASE_URL).post(
+        f"{OLLAMA_API_BASE_URL}/api/generate", json=payload, timeout=request_timeout(VISION_TIMEOUT)
+    )
+    response.raise_for_status()
+    return response.json().get("response", "").strip()
 
 def get_ollama_vision_response(file_path, model_name, prompt):
     """
@@ -14,21 +45,7 @@ def get_ollama_vision_response(file_path, model_name, prompt):
     """
     logger.info(f"Sending {file_path} to LLM for description using model {model_name}")
     try:
-        with open(file_path, "rb") as f:
-            image_data = f.read()
-
-        encoded_image = base64.b64encode(image_data).decode('utf-8')
-
-        headers = {"Content-Type": "application/json"}
-        payload = {
-            "model": model_name,
-            "prompt": prompt,
-            "images": [encoded_image],
-            "stream": False
-        }
-        response = requests.post(f"{OLLAMA_API_BASE_URL}/api/generate", headers=headers, json=payload)
-        response.raise_for_status()
-        response_text = response.json().get("response", "").strip()
+        response_text = _generate_vision(file_path, model_name, prompt)
         logger.info(f"LLM response for {file_path}: {response_text[:100]}...")
         return response_text
     except requests.exceptions.RequestException as e:
@@ -37,3 +54,29 @@ def get_ollama_vision_response(file_path, model_name, prompt):
     except Exception as e:
         logger.error(f"An unexpected error occurred during LLM request: {e}")
         return None
+
+def get_ollama_vision_analysis(file_path, model_name):
+    """
+    Gets the description and the text in an image from one multimodal LLM call,
+    so the image is uploaded and encoded by the model once instead of twice.
+    Returns (description, ocr_text), or None if the call fails or its reply is
+    not the expected JSON.
+    """
+    logger.info(f"Sending {file_path} to LLM for combined description and OCR using model {model_name}")
+    try:
+        response_text = _generate_vision(file_path, model_name, ANALYSIS_PROMPT, ANALYSIS_SCHEMA)
+        analysis = json.loads(response_text)
+        description, ocr_text = analysis["description"], analysis.get("text", "")
+        if not isinstance(description, str) or not isinstance(ocr_text, str) or not description.strip():
+            raise ValueError("missing description")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error calling Ollama API: {e}")
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Could not parse combined LLM analysis for {file_path}: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during LLM request: {e}")
+        return None
+    logger.info(f"LLM analysis for {file_path}: {description[:100]}... (text: {ocr_text[:50]!r})")
+    return description.strip(), ocr_text.strip()
@@ -2,9 +2,15 @@
 import os
 from datetime import datetime
 import logging
+import threading
+
+from lib.content_hash import hash_file
 
 logger = logging.getLogger(__name__)
 
+# Batch workers move files concurrently; the free-name check and the rename must not interleave.
+_move_lock = threading.Lock()
+
 TARGET_BASE_DIR = os.getenv("TARGET_BASE_DIR", "/organized_files")
 
 def generate_new_path_and_name(original_file_path, description, ocr_text, exif_data):
@@ -79,13 +85,30 @@ def generate_new_path_and_name(original_file_path, description, ocr_text, exif_d
 def move_file(source_path, destination_path, target_folder):
     """
     Moves the file to its new organized location, creating directories if necessary.
+    An existing file is never overwritten: the name gets the first 8 hex digits of
+    the file's content hash instead, so a file lands on the same name whatever order
+    files arrive in. Returns the path the file ended up at, or None if the move failed.
     """
     logger.info(f"Moving file from {source_path} to {destination_path}")
     try:
         os.makedirs(target_folder, exist_ok=True)
-        os.rename(source_path, destination_path)
+        with _move_lock:
+            if os.path.exists(destination_path) and os.path.samefile(source_path, destination_path):
+                # Already where it belongs (sorted before).
+                return destination_path
+            if os.path.exists(destination_path):
+                stem, extension = os.path.splitext(destination_path)
+                stem = f"{stem}_{hash_file(source_path)[:8]}"
+                destination_path = f"{stem}{extension}"
+                suffix = 1
+                # Only another copy of the same bytes can hold the hashed name.
+                while os.path.exists(destination_path):
+                    suffix += 1
+                    destination_path = f"{stem}_{suffix}{extension}"
+                logger.info(f"Destination taken; using {destination_path}")
+            os.rename(source_path, destination_path)
         logger.info(f"Successfully moved {source_path} to {destination_path}")
-        return True
+        return destination_path
     except Exception as e:
         logger.error(f"Error moving file {source_path} to {destination_path}: {e}")
-        return False
+        return None
@@ -0,0 +1,164 @@
+# file_sorter/lib/pipeline.py
+import os
+import logging
+import threading
+
+from lib.exif_helpers import get_exif_data
+from lib.ollama_helpers import get_ollama_vision_response, get_ollama_vision_analysis
+from lib.path_helpers import generate_new_path_and_name, move_file, TARGET_BASE_DIR
+from lib.content_hash import hash_file
+from lib.dedup_index import DedupIndex, DEDUP_NEAR_DUPLICATES
+from lib.image_preprocess import perceptual_hash
+
+logger = logging.getLogger(__name__)
+
+LLAVA_MODEL_NAME = os.getenv("LLAVA_MODEL_NAME", "llava")
+OCR_MODEL_NAME = os.getenv("OCR_MODEL_NAME", "llava")
+
+DESCRIPTION_PROMPT = "Describe this image in detail, focusing on objects, people, locations, and any text present."
+OCR_PROMPT = "Extract all text from this image."
+
+# "combined" asks for description and text in one JSON reply, falling back to
+# the two separate prompts when that fails; "separate" always makes two calls.
+# A dedicated OCR model (OCR_MODEL_NAME differing from LLAVA_MODEL_NAME) keeps
+# its own call either way.
+VISION_MODE = os.getenv("VISION_MODE", "combined").lower()
+
+# Content-hash index consulted before any model call (see DedupIndex).
+DEDUP_INDEX = os.getenv("DEDUP_INDEX", "true").lower() in ("1", "true", "yes")
+# What happens to a file whose exact bytes are already sorted: "move" it under
+# TARGET_BASE_DIR/Duplicates, "delete" it, or "skip" it (leave it where it is).
+DUPLICATE_ACTION = os.getenv("DUPLICATE_ACTION", "move").lower()
+
+vision_stats = {"combined": 0, "fallback": 0, "separate": 0}
+_vision_stats_lock = threading.Lock()
+
+def _count(outcome):
+    with _vision_stats_lock:
+        vision_stats[outcome] += 1
+
+_dedup_index = None
+_dedup_index_failed = False
+_dedup_index_lock = threading.Lock()
+
+def get_dedup_index():
+    """The shared DedupIndex, opened on first use; None if disabled or it cannot be opened."""
+    global _dedup_index, _dedup_index_failed
+    with _dedup_index_lock:
+        if _dedup_index is None and DEDUP_INDEX and not _dedup_index_failed:
+            try:
+                _dedup_index = DedupIndex()
+            except Exception as e:
+                logger.error(f"Could not open the dedup index, sorting without it: {e}")
+                _dedup_index_failed = True
+        return _dedup_index
+
+def is_same_file(path, other):
+    """True if both paths name the same file (e.g. a sorted file being sorted again)."""
+    try:
+        return os.path.samefile(path, other)
+    except OSError:
+        return False
+
+def handle_duplicate(file_path, existing_path):
+    """Applies DUPLICATE_ACTION to a file whose content is already sorted at `existing_path`."""
+    logger.info(f"{file_path} is a duplicate of {existing_path}; action: {DUPLICATE_ACTION}")
+    if DUPLICATE_ACTION == "delete":
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            return None, f"Failed to delete duplicate: {e}"
+        return existing_path, None
+    if DUPLICATE_ACTION == "skip":
+        return existing_path, None
+    target_folder = os.path.join(TARGET_BASE_DIR, "Duplicates")
+    moved_to = move_file(file_path, os.path.join(target_folder, os.path.basename(existing_path)), target_folder)
+    if not moved_to:
+        return None, "Failed to move duplicate"
+    return moved_to, None
+
+def analyze_image(file_path):
+    """Returns (description, ocr_text) for `file_path`; either may be None if its call failed."""
+    if VISION_MODE == "combined" and OCR_MODEL_NAME == LLAVA_MODEL_NAME:
+        analysis = get_ollama_vision_analysis(file_path, LLAVA_MODEL_NAME)
+        if analysis:
+            _count("combined")
+            return analysis
+        logger.warning(f"Combined analysis failed for {file_path}; falling back to separate calls.")
+        _count("fallback")
+    else:
+        _count("separate")
+
+    description = get_ollama_vision_response(file_path, LLAVA_MODEL_NAME, DESCRIPTION_PROMPT)
+    ocr_text = get_ollama_vision_response(file_path, OCR_MODEL_NAME, OCR_PROMPT)
+    return description, ocr_text
+
+def process_file(file_path):
+    """
+    Sorts one file: extracts EXIF data, describes and OCRs it with the vision
+    models, names it and moves it into TARGET_BASE_DIR. Files already in the
+    dedup index skip the models: exact duplicates get DUPLICATE_ACTION, and
+    files analysed before (or, optionally, near-duplicates) reuse that analysis.
+    Returns (new_file_path, None) on success or (None, error message).
+    """
+    if not os.path.exists(file_path):
+        return None, "File does not exist"
+
+    index = get_dedup_index()
+    digest = hash_file(file_path) if index else None
+    known = index.lookup(digest) if index else None
+    if known and known["dest_path"] and os.path.exists(known["dest_path"]):
+        if is_same_file(file_path, known["dest_path"]):
+            logger.info(f"{file_path} is already sorted; leaving it where it is.")
+            return known["dest_path"], None
+        index.count("duplicates")
+        return handle_duplicate(file_path, known["dest_path"])
+
+    # 1. Extract EXIF Data
+    exif_data = get_exif_data(file_path)
+
+    # 2. Get LLM Description and 3. Perform OCR
+    phash = None
+    if known and known["description"]:
+        # Analysed before but not sorted (a failed move, or the sorted copy was removed).
+        index.count("reused")
+        description, ocr_text = known["description"], known["ocr_text"]
+    else:
+        similar = None
+        if index and DEDUP_NEAR_DUPLICATES:
+            phash = perceptual_hash(file_path)
+            similar = index.find_similar(phash) if phash is not None else None
+        match = index.lookup(similar[0]) if similar else None
+        if match and match["description"]:
+            logger.info(f"{file_path} is a near-duplicate (distance {similar[1]}) of an analysed file; reusing its analysis.")
+            index.count("near_duplicates")
+            description, ocr_text = match["description"], match["ocr_text"]
+        else:
+            description, ocr_text = analyze_image(file_path)
+            if index:
+                index.count("analyzed")
+        if index and description:
+            index.record_analysis(digest, description, ocr_text, phash)
+    if not description:
+        logger.warning(f"Could not get LLM description for {file_path}. Proceeding without it.")
+    if not ocr_text:
+        logger.warning(f"Could not perform OCR for {file_path}. Proceeding without it.")
+
+    # 4. Generate New Path and Name
+    new_file_path, target_folder = generate_new_path_and_name(file_path, description, ocr_text, exif_data)
+    if index and os.path.exists(new_file_path) and hash_file(new_file_path) == digest:
+        # Sorted before the index knew about it.
+        index.record_destination(digest, new_file_path)
+        if is_same_file(file_path, new_file_path):
+            logger.info(f"{file_path} is already sorted; leaving it where it is.")
+            return new_file_path, None
+        index.count("duplicates")
+        return handle_duplicate(file_path, new_file_path)
+
+    # 5. Move File
+    moved_to = move_file(file_path, new_file_path, target_folder)
+    if not moved_to:
+        return None, "Failed to move file"
+    if index:
+        index.record_destination(digest, moved_to)
+    return moved_to, None
@@ -0,0 +1,312 @@
+# file_sorter/lib/watcher.py
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from collections import deque
+
+from lib.batch import new_batch_id
+
+logger = logging.getLogger(__name__)
+
+# "inotify" (Linux), "poll" (rescan every WATCH_POLL_INTERVAL seconds; works on
+# network and some bind mounts where no events arrive) or "auto": inotify when
+# it is available, polling otherwise.
+WATCH_MODE = os.getenv("WATCH_MODE", "auto").lower()
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "10"))
+# A file is queued once its size and mtime have not changed for this long.
+WATCH_SETTLE_SECONDS = float(os.getenv("WATCH_SETTLE_SECONDS", "5"))
+# Files that become ready within this window of each other go out as one batch.
+WATCH_BATCH_WINDOW = float(os.getenv("WATCH_BATCH_WINDOW", "2"))
+WATCH_BATCH_MAX = int(os.getenv("WATCH_BATCH_MAX", "500"))
+
+# Names uploaders and browsers give files while they are still being written.
+PARTIAL_PREFIXES = (".", "~$")
+PARTIAL_SUFFIXES = (".part", ".partial", ".tmp", ".crdownload", ".download", ".swp", ".filepart")
+
+_IN_MODIFY, _IN_CLOSE_WRITE, _IN_MOVED_TO, _IN_CREATE = 0x2, 0x8, 0x80, 0x100
+_IN_Q_OVERFLOW, _IN_IGNORED, _IN_ISDIR = 0x4000, 0x8000, 0x40000000
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+def file_version(ctime_ns, size):
+    """What tells a new file apart from an earlier one that had the same path."""
+    return f"{ctime_ns}:{size}"
+
+def is_partial(filename):
+    return filename.startswith(PARTIAL_PREFIXES) or filename.lower().endswith(PARTIAL_SUFFIXES)
+
+class _Inotify:
+    """Minimal inotify binding through libc: one watch per directory of a tree."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+        self.dirs = {}
+
+    def add_tree(self, root):
+        """Watches `root` and every directory below it; returns the directories added."""
+        added = []
+        for dirpath, dirnames, _ in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dirpath), _WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOENT:
+                    continue
+                raise OSError(err, f"inotify_add_watch {dirpath}: {os.strerror(err)}")
+            self.dirs[wd] = dirpath
+            added.append(dirpath)
+        return added
+
+    def read(self, timeout):
+        """
+        Waits up to `timeout` seconds. Returns (file paths written or moved in,
+        new directories, whether events were lost).
+        """
+        files, new_dirs, overflow = [], [], False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return files, new_dirs, overflow
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return files, new_dirs, overflow
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0"))
+            offset += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & _IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            directory = self.dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO) and not name.startswith("."):
+                    new_dirs.append(path)
+            elif mask & (_IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO):
+                files.append(path)
+        return files, new_dirs, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+class DirectoryWatcher:
+    """
+    Feeds new files under `root` into the batch job queue, so they go through the
+    same pipeline as /process_file and /process_batch without a webhook per file.
+
+    Files are seen through inotify or by rescanning, held back until their size
+    and mtime settle (partially written files), and the ready ones are queued
+    together as one batch per burst. The newest change time (ctime) queued is
+    kept in the queue database as a cursor: on start the tree is scanned for
+    anything changed since, so files that arrived while the sorter was down are
+    caught up. ctime, unlike mtime, is not preserved by copy tools.
+
+    Jobs are keyed on the path, so a file is queued with its ctime and size as
+    its version: a new file reusing a name already sorted away (scan.pdf,
+    IMG_0001.jpg) is queued again rather than taken for the old one.
+    """
+
+    def __init__(self, root, queue, runner=None, mode=WATCH_MODE, settle_seconds=WATCH_SETTLE_SECONDS,
+                 batch_window=WATCH_BATCH_WINDOW, batch_max=WATCH_BATCH_MAX, poll_interval=WATCH_POLL_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.queue = queue
+        self.runner = runner
+        self.mode = mode
+        self.settle_seconds = settle_seconds
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+        self.poll_interval = poll_interval
+        self.cursor_name = f"watch:{self.root}"
+        self.cursor = queue.get_cursor(self.cursor_name)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+        # path -> [size, mtime_ns, ctime_ns, stable since]
+        self._pending = {}
+        # path -> (ctime_ns, size), settled and waiting for the batch to close
+        self._ready = {}
+        self._ready_since = None
+        self._lags = deque(maxlen=1000)
+        self.stats = {"batches": 0, "files_queued": 0, "rescans": 0, "last_batch_at": None}
+
+    def start(self):
+        """Starts watching in a background thread."""
+        self._thread = threading.Thread(target=self.run, name="directory-watcher", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def run(self):
+        """Watches until stop() is called; blocks the caller."""
+        if self.mode in ("auto", "inotify"):
+            try:
+                self._inotify = _Inotify()
+                self._inotify.add_tree(self.root)
+            except (OSError, AttributeError) as e:
+                if self._inotify:
+                    self._inotify.close()
+                self._inotify = None
+                if self.mode == "inotify":
+                    raise
+                logger.warning(f"inotify unavailable ({e}); polling {self.root} every {self.poll_interval:.0f}s.")
+        logger.info(f"Watching {self.root} ({'inotify' if self._inotify else 'polling'}).")
+        # Catch up on whatever arrived while the sorter was not running.
+        self._scan(self.root)
+        next_scan = time.time() + self.poll_interval
+        try:
+            while not self._stop.is_set():
+                tick = min(1.0, self.settle_seconds / 2 or 1.0)
+                if self._inotify:
+                    files, new_dirs, overflow = self._inotify.read(tick)
+                    for path in files:
+                        self._note(path)
+                    for directory in new_dirs:
+                        # Files can land in a new directory before its watch exists.
+                        self._inotify.add_tree(directory)
+                        self._scan(directory, everything=True)
+                    if overflow:
+                        logger.warning("inotify queue overflowed; rescanning.")
+                        self._scan(self.root)
+                else:
+                    self._stop.wait(tick)
+                    if time.time() >= next_scan:
+                        self._scan(self.root)
+                        next_scan = time.time() + self.poll_interval
+                self._settle()
+                self._flush()
+        finally:
+            if self._inotify:
+                self._inotify.close()
+
+    def _note(self, path):
+        if is_partial(os.path.basename(path)):
+            return
+        with self._lock:
+            if path not in self._pending and path not in self._ready:
+                self._pending[path] = [None, None, None, None]
+
+    def _scan(self, root, everything=False):
+        """
+        Notes files under `root` changed since the cursor. In a directory that
+        changed since then, older files the queue has not sorted are noted too (a
+        directory moved in keeps its files' ctimes).
+        """
+        with self._lock:
+            self.stats["rescans"] += 1
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            try:
+                dir_changed = everything or os.stat(dirpath).st_ctime_ns >= self.cursor
+            except OSError:
+                continue
+            older = {}
+            for filename in filenames:
+                if is_partial(filename):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_ctime_ns >= self.cursor:
+                    self._note(path)
+                elif dir_changed:
+                    older[path] = file_version(st.st_ctime_ns, st.st_size)
+            for path in self.queue.unsorted(older):
+                self._note(path)
+
+    def _settle(self):
+        """Moves files whose size and mtime held still for settle_seconds from pending to ready."""
+        now = time.time()
+        with self._lock:
+            pending = list(self._pending.items())
+        for path, state in pending:
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Deleted or renamed away before it settled.
+                with self._lock:
+                    self._pending.pop(path, None)
+                continue
+            if (st.st_size, st.st_mtime_ns) != (state[0], state[1]):
+                state[:] = [st.st_size, st.st_mtime_ns, st.st_ctime_ns, now]
+            elif now - state[3] >= self.settle_seconds:
+                with self._lock:
+                    self._pending.pop(path, None)
+                    self._ready[path] = (st.st_ctime_ns, st.st_size)
+                    if self._ready_since is None:
+                        self._ready_since = now
+
+    def _flush(self, force=False):
+        """Queues the ready files as one batch once the burst is over or the batch is full."""
+        now = time.time()
+        with self._lock:
+            if not self._ready:
+                return
+            if not force and len(self._ready) < self.batch_max and now - self._ready_since < self.batch_window:
+                return
+            ready, self._ready, self._ready_since = self._ready, {}, None
+            oldest_pending = min((s[2] for s in self._pending.values() if s[2] is not None), default=None)
+        batch_id = new_batch_id()
+        queued = self.queue.add_versions({path: file_version(*ident) for path, ident in ready.items()}, batch_id)
+        # Never past a file still settling, so a restart finds it again.
+        cursor = max(ctime for ctime, _ in ready.values())
+        if oldest_pending is not None:
+            cursor = min(cursor, oldest_pending - 1)
+        with self._lock:
+            if cursor > self.cursor:
+                self.cursor = cursor
+            self._lags.extend(now - ctime / 1e9 for ctime, _ in ready.values())
+            self.stats["batches"] += 1
+            self.stats["files_queued"] += queued
+            self.stats["last_batch_at"] = now
+        self.queue.set_cursor(self.cursor_name, self.cursor)
+        logger.info(f"Watcher queued {queued} new file(s) of {len(ready)} ready as batch {batch_id}.")
+        if queued < len(ready):
+            logger.debug(f"{len(ready) - queued} ready file(s) were already queued or sorted in that version.")
+        if self.runner and queued:
+            self.runner.start()
+
+    def get_stats(self):
+        """Queue depth and lag: how long files wait to be queued, and how long the oldest has been queued."""
+        counts = self.queue.counts()
+        with self._lock:
+            lags = sorted(self._lags)
+            stats = dict(
+                self.stats,
+                root=self.root,
+                mode="inotify" if self._inotify else "poll",
+                watched_dirs=len(self._inotify.dirs) if self._inotify else None,
+                settling=len(self._pending),
+                ready=len(self._ready),
+                cursor=self.cursor / 1e9,
+            )
+        stats["queue_depth"] = counts["queued"] + counts["running"]
+        stats["counts"] = counts
+        stats["oldest_queued_s"] = round(self.queue.oldest_queued_age(), 1)
+        stats["enqueue_lag_s"] = {
+            "p50": round(lags[len(lags) // 2], 2) if lags else None,
+            "p95": round(lags[int(len(lags) * 0.95)], 2) if lags else None,
+            "max": round(lags[-1], 2) if lags else None,
+        }
+        return stats
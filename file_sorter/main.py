@@ -1,18 +1,22 @@
 import os
 import json
 import logging
+import threading
 from flask import Flask, request, jsonify
 from datetime import datetime
-from lib.exif_helpers import get_exif_data
-from lib.ollama_helpers import get_ollama_vision_response
-from lib.path_helpers import generate_new_path_and_name, move_file
+from lib.pipeline import process_file, vision_stats, get_dedup_index
+from lib.image_cache import image_cache
+from lib.http_client import get_pool_stats
+from lib.job_queue import JobQueue, QUEUE_DB
+from lib.batch import BatchRunner, new_batch_id, walk_files
+from lib.watcher import DirectoryWatcher
 
 # --- Configuration ---
 OLLAMA_API_BASE_URL = os.getenv("OLLAMA_API_BASE_URL", "http://ollama:11434")
-LLAVA_MODEL_NAME = os.getenv("LLAVA_MODEL_NAME", "llava")
-OCR_MODEL_NAME = os.getenv("OCR_MODEL_NAME", "llava")
 TARGET_BASE_DIR = os.getenv("TARGET_BASE_DIR", "/organized_files")
 LOG_FILE = os.getenv("LOG_FILE", "/var/log/file_sorter.log")
+# When set, new files under this directory are picked up without a /process_file call.
+WATCH_DIR = os.getenv("WATCH_DIR")
 
 # Setup basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,6 +24,18 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Created on the first batch request, so single-file use never touches the queue database.
+batch_runner = None
+batch_runner_lock = threading.Lock()
+
+def get_batch_runner():
+    global batch_runner
+    with batch_runner_lock:
+        if batch_runner is None:
+            batch_runner = BatchRunner(JobQueue())
+        return batch_runner
+
+watcher = None
 
 
 # --- Flask Routes ---
@@ -38,34 +54,75 @@ def process_file_endpoint():
 
     logger.info(f"Received request to process file: {file_path}")
 
-    # 1. Extract EXIF Data
-    exif_data = get_exif_data(file_path)
-
-    # 2. Get LLM Description
-    description_prompt = "Describe this image in detail, focusing on objects, people, locations, and any text present."
-    description = get_ollama_vision_response(file_path, LLAVA_MODEL_NAME, description_prompt)
-    if not description:
-        logger.warning(f"Could not get LLM description for {file_path}. Proceeding without it.")
-
-    # 3. Perform OCR
-    ocr_prompt = "Extract all text from this image."
-    ocr_text = get_ollama_vision_response(file_path, OCR_MODEL_NAME, ocr_prompt)
-    if not ocr_text:
-        logger.warning(f"Could not perform OCR for {file_path}. Proceeding without it.")
-
-    # 4. Generate New Path and Name
-    new_file_path, target_folder = generate_new_path_and_name(file_path, description, ocr_text, exif_data)
-
-    # 5. Move File
-    if move_file(file_path, new_file_path, target_folder):
-        return jsonify({
-            "status": "success",
-            "message": "File processed and organized successfully",
-            "original_path": file_path,
-            "new_path": new_file_path
-        }), 200
-    else:
-        return jsonify({"status": "error", "message": "Failed to move file"}), 500
+    new_file_path, error = process_file(file_path)
+    if error:
+        return jsonify({"status": "error", "message": error}), 500
+    return jsonify({
+        "status": "success",
+        "message": "File processed and organized successfully",
+        "original_path": file_path,
+        "new_path": new_file_path
+    }), 200
+
+@app.route('/process_batch', methods=['POST'])
+def process_batch_endpoint():
+    """
+    Queues many files and sorts them in the background with the worker pool.
+    Expected JSON payload: {"directory": "/intake/archive", "recursive": true}
+    or {"file_paths": ["/intake/a.jpg", ...]}. Returns 202 with the batch id.
+    """
+    data = request.get_json() or {}
+    directory = data.get('directory')
+    file_paths = data.get('file_paths')
+
+    if directory:
+        if not os.path.isdir(directory):
+            logger.error(f"Invalid or non-existent directory received: {directory}")
+            return jsonify({"status": "error", "message": "Invalid or non-existent directory"}), 400
+        file_paths = walk_files(directory, recursive=data.get('recursive', True))
+    elif not isinstance(file_paths, list) or not file_paths:
+        return jsonify({"status": "error", "message": "Provide a directory or a list of file_paths"}), 400
+
+    runner = get_batch_runner()
+    batch_id = new_batch_id()
+    queued = runner.queue.add(file_paths, batch_id)
+    runner.start()
+    logger.info(f"Queued {queued} file(s) as batch {batch_id}")
+    return jsonify({"status": "queued", "batch_id": batch_id, "queued": queued}), 202
+
+@app.route('/process_batch', methods=['GET'])
+@app.route('/process_batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id=None):
+    """Progress and throughput of one batch, or of the whole queue."""
+    runner = get_batch_runner()
+    progress = runner.progress(batch_id)
+    progress["recent_failures"] = [
+        {"path": path, "error": error} for path, error in runner.queue.failures(batch_id, limit=10)
+    ]
+    return jsonify(progress), 200
+
+@app.route('/stats/http', methods=['GET'])
+def http_stats():
+    """Connection pool counters (opened vs. reused) for this process."""
+    return jsonify({"pid": os.getpid(), "pools": get_pool_stats()}), 200
+
+@app.route('/stats/vision', methods=['GET'])
+def vision_stats_endpoint():
+    """Combined vs. two-call analyses and image encoding cache counters for this process."""
+    return jsonify({"pid": os.getpid(), "calls": dict(vision_stats), "image_cache": image_cache.get_stats()}), 200
+
+@app.route('/stats/dedup', methods=['GET'])
+def dedup_stats():
+    """Duplicates found and analyses reused from the content-hash index by this process."""
+    index = get_dedup_index()
+    return jsonify({"pid": os.getpid(), "enabled": index is not None, **(index.get_stats() if index else {})}), 200
+
+@app.route('/stats/watch', methods=['GET'])
+def watch_stats():
+    """Directory watcher state: files settling, batches queued, queue depth and lag."""
+    if watcher is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **watcher.get_stats()}), 200
 
 @app.route('/healthz', methods=['GET'])
 def health_check():
@@ -75,4 +132,14 @@ def health_check():
 if __name__ == '__main__':
     # Ensure the target base directory exists for the application
     os.makedirs(TARGET_BASE_DIR, exist_ok=True)
+    # Resume a batch that was cut short by a crash or restart.
+    if os.path.exists(QUEUE_DB):
+        runner = get_batch_runner()
+        pending = runner.queue.counts()["queued"]
+        if pending:
+            logger.info(f"Resuming {pending} queued batch job(s).")
+            runner.start()
+    if WATCH_DIR:
+        watcher = DirectoryWatcher(WATCH_DIR, get_batch_runner().queue, get_batch_runner())
+        watcher.start()
     app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
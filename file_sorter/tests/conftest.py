@@ -0,0 +1,6 @@
+# file_sorter/tests/conftest.py
+import os
+import sys
+
+# The sorter's modules import each other as `lib.*`, relative to file_sorter/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
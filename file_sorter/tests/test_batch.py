@@ -0,0 +1,94 @@
+# file_sorter/tests/test_batch.py
+import threading
+
+import pytest
+
+from lib.batch import BatchRunner, walk_files
+from lib.job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "queue.db"), max_attempts=1)
+
+
+def sort_ok(path):
+    return path.replace("/in/", "/out/"), None
+
+
+def test_run_drains_the_queue(queue):
+    queue.add([f"/in/{i}.jpg" for i in range(20)], "b")
+    runner = BatchRunner(queue, workers=4, process_fn=sort_ok)
+    runner.run()
+    assert queue.counts() == {"queued": 0, "running": 0, "done": 20, "failed": 0}
+    assert not runner.running()
+    assert runner.progress()["processed_this_run"] == 20
+
+
+def test_errors_and_exceptions_fail_the_job(queue):
+    def flaky(path):
+        if path.endswith("1.jpg"):
+            raise RuntimeError("boom")
+        if path.endswith("2.jpg"):
+            return None, "Failed to move file"
+        return sort_ok(path)
+
+    queue.add(["/in/1.jpg", "/in/2.jpg", "/in/3.jpg"], "b")
+    BatchRunner(queue, workers=2, process_fn=flaky).run()
+    assert queue.counts() == {"queued": 0, "running": 0, "done": 1, "failed": 2}
+    assert sorted(queue.failures()) == [("/in/1.jpg", "boom"), ("/in/2.jpg", "Failed to move file")]
+
+
+class PausingQueue:
+    """Holds the worker that finds the queue empty until the test lets it go on."""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.empty_seen = threading.Event()
+        self.resume = threading.Event()
+
+    def claim(self):
+        job = self.queue.claim()
+        if job is None and not self.resume.is_set():
+            self.empty_seen.set()
+            self.resume.wait(5)
+        return job
+
+    def __getattr__(self, name):
+        return getattr(self.queue, name)
+
+
+def test_start_while_the_last_worker_winds_down(queue):
+    pausing = PausingQueue(queue)
+    runner = BatchRunner(pausing, workers=1, process_fn=sort_ok)
+    runner.start()
+    assert pausing.empty_seen.wait(5)
+
+    # The worker has seen an empty queue but not exited yet.
+    queue.add(["/in/a.jpg", "/in/b.jpg"], "late")
+    runner.start()
+    pausing.resume.set()
+    with runner._lock:
+        threads = list(runner._threads)
+    for thread in threads:
+        thread.join(5)
+
+    assert queue.counts("late") == {"queued": 0, "running": 0, "done": 2, "failed": 0}
+
+
+def test_restart_after_idle(queue):
+    runner = BatchRunner(queue, workers=2, process_fn=sort_ok)
+    runner.run()
+    queue.add(["/in/a.jpg"], "b")
+    assert runner.start() == 2
+    runner.run()
+    assert queue.counts()["done"] == 1
+
+
+def test_walk_files_skips_hidden(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / ".cache").mkdir()
+    for name in ("b.jpg", "a.jpg", ".hidden.jpg", "sub/c.pdf", ".cache/d.jpg"):
+        (tmp_path / name).write_bytes(b"x")
+    assert [p[len(str(tmp_path)) + 1:] for p in walk_files(str(tmp_path))] == ["a.jpg", "b.jpg", "sub/c.pdf"]
+    assert len(list(walk_files(str(tmp_path), recursive=False))) == 2
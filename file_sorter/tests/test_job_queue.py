@@ -0,0 +1,93 @@
+# file_sorter/tests/test_job_queue.py
+import sqlite3
+
+import pytest
+
+from lib.job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "queue.db"), max_attempts=2)
+
+
+def test_add_is_idempotent_per_path(queue):
+    assert queue.add(["/in/a.jpg", "/in/b.jpg"], "batch-1") == 2
+    assert queue.add(["/in/b.jpg", "/in/c.jpg"], "batch-2") == 1
+    assert queue.counts() == {"queued": 3, "running": 0, "done": 0, "failed": 0}
+    assert queue.counts("batch-1")["queued"] == 2
+
+
+def test_claim_in_order_then_complete(queue):
+    queue.add(["/in/a.jpg", "/in/b.jpg"], "b")
+    first = queue.claim()
+    assert first[1] == "/in/a.jpg"
+    assert queue.claim()[1] == "/in/b.jpg"
+    assert queue.claim() is None
+    queue.complete(first[0], "/out/a.jpg")
+    assert queue.counts() == {"queued": 0, "running": 1, "done": 1, "failed": 0}
+
+
+def test_failures_retry_until_max_attempts(queue):
+    queue.add(["/in/a.jpg"], "b")
+    job_id, _ = queue.claim()
+    queue.fail(job_id, "model timed out")
+    assert queue.counts()["queued"] == 1
+    job_id, _ = queue.claim()
+    queue.fail(job_id, "model timed out again")
+    assert queue.counts()["failed"] == 1
+    assert queue.failures() == [("/in/a.jpg", "model timed out again")]
+
+    assert queue.retry_failed() == 1
+    assert queue.claim() is not None
+
+
+def test_recover_requeues_interrupted_jobs(tmp_path):
+    path = str(tmp_path / "queue.db")
+    queue = JobQueue(path, max_attempts=2)
+    queue.add(["/in/a.jpg", "/in/b.jpg"], "b")
+    queue.claim()
+    queue.claim()
+    # A new process finds both still running.
+    restarted = JobQueue(path, max_attempts=2)
+    assert restarted.recover() == 2
+    assert restarted.counts()["queued"] == 2
+
+
+def test_add_versions_requeues_a_reused_path(queue):
+    assert queue.add_versions({"/in/scan.pdf": "1:100"}, "b1") == 1
+    # Same file again while it is still queued: left alone.
+    assert queue.add_versions({"/in/scan.pdf": "2:100"}, "b2") == 0
+    job_id, _ = queue.claim()
+    queue.complete(job_id, "/out/scan.pdf")
+
+    assert queue.unsorted({"/in/scan.pdf": "1:100"}) == []
+    assert queue.add_versions({"/in/scan.pdf": "1:100"}, "b3") == 0
+    # A new file under the same name.
+    assert queue.unsorted({"/in/scan.pdf": "3:250"}) == ["/in/scan.pdf"]
+    assert queue.add_versions({"/in/scan.pdf": "3:250"}, "b4") == 1
+    assert queue.counts("b4")["queued"] == 1
+    assert queue.claim() is not None
+
+
+def test_cursors(queue):
+    assert queue.get_cursor("watch:/in") == 0
+    queue.set_cursor("watch:/in", 123)
+    queue.set_cursor("watch:/in", 456)
+    assert queue.get_cursor("watch:/in") == 456
+
+
+def test_opens_a_database_without_versions(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, batch_id TEXT,"
+        " status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0,"
+        " new_path TEXT, error TEXT, updated_at REAL)"
+    )
+    conn.execute("INSERT INTO jobs (path, status) VALUES ('/in/a.jpg', 'done')")
+    conn.commit()
+    conn.close()
+
+    queue = JobQueue(path)
+    assert queue.add_versions({"/in/a.jpg": "1:1"}, "b") == 1
@@ -0,0 +1,70 @@
+# file_sorter/tests/test_pipeline.py
+import os
+
+import pytest
+
+from lib import pipeline, path_helpers
+from lib.dedup_index import DedupIndex
+
+
+@pytest.fixture
+def sorter(tmp_path, monkeypatch):
+    """process_file with a fresh dedup index, sorting into tmp_path/out, and no vision model."""
+    target = str(tmp_path / "out")
+    monkeypatch.setattr(path_helpers, "TARGET_BASE_DIR", target)
+    monkeypatch.setattr(pipeline, "TARGET_BASE_DIR", target)
+    monkeypatch.setattr(pipeline, "_dedup_index", DedupIndex(str(tmp_path / "dedup.db")))
+    monkeypatch.setattr(pipeline, "DEDUP_NEAR_DUPLICATES", False)
+    calls = []
+
+    def analyze(path):
+        calls.append(path)
+        return "A scanned invoice from the plumber", "INVOICE 42"
+
+    monkeypatch.setattr(pipeline, "analyze_image", analyze)
+    intake = tmp_path / "intake"
+    intake.mkdir()
+
+    def new_file(name, content=b"%PDF-1.4 invoice"):
+        path = intake / name
+        path.write_bytes(content)
+        return str(path)
+
+    return pipeline.process_file, new_file, calls
+
+
+@pytest.mark.parametrize("action", ["move", "delete", "skip"])
+def test_sorting_a_sorted_file_leaves_it_alone(sorter, monkeypatch, action):
+    process_file, new_file, calls = sorter
+    monkeypatch.setattr(pipeline, "DUPLICATE_ACTION", action)
+    sorted_path, error = process_file(new_file("scan.pdf"))
+    assert error is None and os.path.exists(sorted_path)
+
+    assert process_file(sorted_path) == (sorted_path, None)
+    assert os.path.exists(sorted_path)
+    assert not os.path.exists(os.path.join(path_helpers.TARGET_BASE_DIR, "Duplicates"))
+    assert pipeline._dedup_index.lookup(pipeline.hash_file(sorted_path))["dest_path"] == sorted_path
+    assert len(calls) == 1
+
+
+def test_sorted_file_unknown_to_the_index_stays_put(sorter, monkeypatch, tmp_path):
+    process_file, new_file, _ = sorter
+    monkeypatch.setattr(pipeline, "DUPLICATE_ACTION", "delete")
+    sorted_path, _ = process_file(new_file("scan.pdf"))
+    # As if the index had been lost since.
+    monkeypatch.setattr(pipeline, "_dedup_index", DedupIndex(str(tmp_path / "fresh.db")))
+
+    assert process_file(sorted_path) == (sorted_path, None)
+    assert os.path.exists(sorted_path)
+
+
+def test_copy_of_a_sorted_file_is_a_duplicate(sorter, monkeypatch):
+    process_file, new_file, calls = sorter
+    monkeypatch.setattr(pipeline, "DUPLICATE_ACTION", "delete")
+    sorted_path, _ = process_file(new_file("scan.pdf"))
+    copy = new_file("scan (1).pdf")
+
+    assert process_file(copy) == (sorted_path, None)
+    assert not os.path.exists(copy)
+    assert os.path.exists(sorted_path)
+    assert len(calls) == 1